@@ -0,0 +1,110 @@
+"""
+Webhook cold start: import time of runlytics.webhook and time from process
+start to the first 200 from GET /, each measured in fresh interpreters.
+
+Also checks the import budget: the median import must stay under --budget
+seconds and must not pull in the heavy modules the routes defer (pandas,
+the SQLAlchemy engine, ijson, the ORM models, the Sheets client). Exits 1
+when either check fails, so it can run as a CI step; both checks also run
+with the tests (tests/test_cold_start.py).
+
+Usage: PYTHONPATH=src python benchmarks/bench_cold_start.py [--runs 5] [--budget 1.0]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+
+# Must not be imported by `import runlytics.webhook`
+DEFERRED_MODULES = [
+    "pandas", "numpy", "ijson", "sqlalchemy.engine", "gspread", "oauth2client", "requests",
+    "runlytics.database.models", "runlytics.ingestion.journal_ingest", "runlytics.ingestion.strava_ingest",
+]
+
+# Default --budget: max median seconds for `import runlytics.webhook`
+IMPORT_BUDGET_S = float(os.getenv("COLD_START_BUDGET_S", "1.0"))
+
+IMPORT_PROBE = f"""
+import sys, time, json
+t0 = time.perf_counter()
+import runlytics.webhook
+seconds = time.perf_counter() - t0
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {DEFERRED_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def environment(db_path):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(SRC), env.get("PYTHONPATH")]))
+    env["DATABASE_URL"] = f"sqlite:///{db_path}"
+    return env
+
+
+def measure_import(env):
+    out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_first_response(env, timeout=60):
+    """Seconds from spawning uvicorn to the first 200 from GET /."""
+    port = free_port()
+    t0 = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "runlytics.webhook:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - t0 < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - t0
+            except OSError:
+                time.sleep(0.005)
+        raise TimeoutError(f"No response from / within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET_S, help="max median import seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = environment(os.path.join(tmp, "cold_start.db"))
+        imports = [measure_import(env) for _ in range(args.runs)]
+        first = [measure_first_response(env) for _ in range(args.runs)]
+
+    import_s = statistics.median(r["seconds"] for r in imports)
+    loaded = sorted({m for r in imports for m in r["loaded"]})
+    import_runs = ", ".join(f"{r['seconds']:.3f}" for r in imports)
+    first_runs = ", ".join(f"{s:.3f}" for s in first)
+    print(f"import runlytics.webhook   median {import_s:.3f}s  (runs: {import_runs})")
+    print(f"first 200 from GET /       median {statistics.median(first):.3f}s  (runs: {first_runs})")
+
+    failures = []
+    if import_s > args.budget:
+        failures.append(f"import took {import_s:.3f}s, budget {args.budget:.3f}s")
+    if loaded:
+        failures.append(f"import loaded deferred modules: {', '.join(loaded)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
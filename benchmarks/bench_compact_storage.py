@@ -0,0 +1,144 @@
+"""
+Storage size and range-scan speed: biometrics rows vs. the compact layout.
+
+Loads `days` of per-minute heart rate plus a few sparser metrics into
+biometrics, moves them all into biometric_points, packs all but the last
+week into daily blocks, and compares table+index sizes and a 7-day
+heart-rate range scan at each stage:
+
+    rows     SELECT ... FROM biometrics
+    points   SELECT ... FROM biometrics_compact (the view) after the move
+    blocks   the same view query after packing, and compact.read_range
+
+Usage: PYTHONPATH=src python benchmarks/bench_compact_storage.py [days] [db_url]
+(default: 90 days in a temporary SQLite file; pass a PostgreSQL URL for
+pg_total_relation_size and realistic scan costs)
+"""
+import os
+import sys
+import time
+import tempfile
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from runlytics.database.models import Base
+from runlytics.database.manager import get_engine, session_scope
+from runlytics.database.bulk import load_biometrics
+from runlytics.database import compact
+
+# metric -> (unit, minutes between samples, value generator)
+METRICS = {
+    "heart_rate": ("count/min", 1, lambda rng, n: rng.integers(50, 180, n).astype(float)),
+    "step_count": ("count", 5, lambda rng, n: rng.integers(0, 600, n).astype(float)),
+    "active_energy": ("kcal", 5, lambda rng, n: np.round(rng.uniform(0, 15, n), 3)),
+    "walking_running_distance": ("km", 5, lambda rng, n: np.round(rng.uniform(0, 0.8, n), 4)),
+}
+START = pd.Timestamp("2024-01-01")
+SCAN_DAYS = 7
+SCAN_REPEATS = 20
+
+# Every table that holds samples; the layouts differ in which ones are filled
+SAMPLE_TABLES = ["biometrics", "biometric_series", "biometric_points", "biometric_blocks"]
+
+
+def make_rows(days, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for name, (unit, every, values) in METRICS.items():
+        dates = pd.date_range(START, START + pd.Timedelta(days=days), freq=f"{every}min", inclusive="left")
+        frames.append(pd.DataFrame({
+            "date": dates, "type": name, "value": values(rng, len(dates)), "unit": unit, "source": "Apple Watch",
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def table_sizes(engine):
+    """Bytes per table, indexes included."""
+    with engine.connect() as connection:
+        if engine.dialect.name == "sqlite":
+            rows = connection.execute(text(
+                "SELECT m.tbl_name, SUM(s.pgsize) FROM dbstat s JOIN sqlite_master m ON m.name = s.name GROUP BY m.tbl_name"
+            )).all()
+        else:
+            rows = connection.execute(text(
+                "SELECT relname, pg_total_relation_size(oid) FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace"
+            )).all()
+    return dict(rows)
+
+
+def timed_scan(fn):
+    fn()  # warm-up
+    t0 = time.perf_counter()
+    for _ in range(SCAN_REPEATS):
+        rows = fn()
+    return (time.perf_counter() - t0) / SCAN_REPEATS, rows
+
+
+def vacuum(engine):
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            connection.exec_driver_sql("VACUUM")
+    else:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM FULL")
+
+
+def stored_bytes(engine):
+    vacuum(engine)
+    sizes = table_sizes(engine)
+    return sum(sizes.get(t, 0) for t in SAMPLE_TABLES)
+
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 90
+    db_url = sys.argv[2] if len(sys.argv) > 2 else f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'compact.db')}"
+    engine = get_engine(db_url)
+
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP VIEW IF EXISTS {compact.VIEW_NAME}"))
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    compact.create_compact_storage(engine)
+
+    rows = make_rows(days)
+    print(f"Synthetic biometrics: {len(rows):,} rows over {days} days")
+
+    # A week in the range that ends up packed
+    lo = (START + pd.Timedelta(days=max(days - 7 - SCAN_DAYS, 0))).to_pydatetime()
+    hi = lo + timedelta(days=SCAN_DAYS)
+    params = {"type": "heart_rate", "lo": lo, "hi": hi}
+    scan_sql = "SELECT date, type, value, unit, source FROM {table} WHERE type = :type AND date >= :lo AND date < :hi ORDER BY date"
+
+    def scan(table):
+        with engine.connect() as connection:
+            return len(connection.execute(text(scan_sql.format(table=table)), params).all())
+
+    def scan_blocks():
+        with session_scope(db_url) as session:
+            return len(compact.read_range(session, "heart_rate", lo, hi))
+
+    results = {}
+    with session_scope(db_url) as session:
+        load_biometrics(session, rows)
+    results["rows"] = (stored_bytes(engine), timed_scan(lambda: scan("biometrics")))
+
+    with session_scope(db_url) as session:
+        moved = compact.sync_compact(session, before=START + pd.Timedelta(days=days))
+    print(f"Moved {moved['rows']:,} rows into biometric_points")
+    results["points"] = (stored_bytes(engine), timed_scan(lambda: scan(compact.VIEW_NAME)))
+
+    with session_scope(db_url) as session:
+        packed = compact.pack_blocks(session, before=START + pd.Timedelta(days=days - 7))
+    print(f"Packed {packed['points']:,} points into {packed['blocks']:,} blocks")
+    packed_bytes = stored_bytes(engine)
+    results["blocks"] = (packed_bytes, timed_scan(lambda: scan(compact.VIEW_NAME)))
+    results["read_range"] = (packed_bytes, timed_scan(scan_blocks))
+
+    rows_bytes = results["rows"][0]
+    print(f"\n{'layout':<10} {'bytes':>14} {'bytes/row':>10} {'vs rows':>8} {f'{SCAN_DAYS}-day HR scan':>16} {'rows':>8}")
+    for layout, (size, (seconds, count)) in results.items():
+        print(f"{layout:<10} {size:>14,} {size / len(rows):>10.1f} {size / rows_bytes:>7.2f}x {seconds * 1000:>14.1f}ms {count:>8,}")
+    assert len({count for _, (_, count) in results.values()}) == 1
@@ -0,0 +1,87 @@
+"""
+Lagged correlation engine on a synthetic daily feature matrix (years of
+days, ~30 features, a third of the values missing):
+
+    naive        pandas DataFrame.corr of the matrix against each shifted copy
+    fit          runlytics.analysis.correlations, every lag in one batched pass
+    update       one new day folded in, re-reading the last REFRESH_DAYS days
+                 (what a webhook ingest triggers)
+
+Also checks that fit and fit + updates agree with the naive coefficients.
+
+Usage: PYTHONPATH=src python benchmarks/bench_correlations.py [--years 10] [--features 30] [--max-lag 60]
+"""
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from runlytics.analysis.correlations import LaggedCorrelations, REFRESH_DAYS
+
+
+def synthetic_features(days, features, missing=0.33, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2015-01-01", periods=days, freq="D")
+    values = rng.normal(size=(days, features)) * rng.uniform(0.5, 5000, features) + rng.uniform(-10, 10000, features)
+    # A few lagged dependencies, so the top pairs mean something
+    for lag, (i, j) in enumerate([(0, 1), (2, 3), (4, 5)], start=1):
+        values[lag:, j] += 0.8 * values[:-lag, i] / values[:, i].std() * values[:, j].std()
+    values[rng.random(values.shape) < missing] = np.nan
+    return pd.DataFrame(values, index=index, columns=[f"feature_{k}" for k in range(features)])
+
+
+def naive(frame, max_lag, min_overlap):
+    width = frame.shape[1]
+    return np.stack([
+        pd.concat([frame, frame.shift(-lag).add_suffix("_later")], axis=1).corr(min_periods=min_overlap).to_numpy()[:width, width:]
+        for lag in range(max_lag + 1)
+    ])
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--features", type=int, default=30)
+    parser.add_argument("--max-lag", type=int, default=60)
+    parser.add_argument("--min-overlap", type=int, default=10)
+    args = parser.parse_args()
+
+    frame = synthetic_features(args.years * 365, args.features)
+    print(f"{len(frame)} days x {args.features} features, lags 0-{args.max_lag}")
+
+    naive_s, expected = timed(lambda: naive(frame, args.max_lag, args.min_overlap), repeat=1)
+
+    def fit():
+        engine = LaggedCorrelations(args.max_lag, args.min_overlap)
+        engine.fit(frame)
+        return engine
+    fit_s, engine = timed(fit)
+    fit_error = np.nanmax(np.abs(engine.matrix()[1] - expected))
+
+    # Fit on all but the last 30 days, then add them one at a time like daily syncs
+    incremental = LaggedCorrelations(args.max_lag, args.min_overlap)
+    incremental.fit(frame.iloc[:-30])
+    update_times = []
+    for end in range(len(frame) - 29, len(frame) + 1):
+        since = incremental.frame.index[-1] - pd.Timedelta(days=REFRESH_DAYS)
+        tail = frame.iloc[:end].loc[since:]
+        t0 = time.perf_counter()
+        incremental.update(tail, since)
+        update_times.append(time.perf_counter() - t0)
+    update_error = np.nanmax(np.abs(incremental.matrix()[1] - expected))
+
+    print(f"naive (pandas corr per lag)  {naive_s * 1000:9.1f} ms")
+    print(f"fit (batched sums)           {fit_s * 1000:9.1f} ms   ({naive_s / fit_s:.0f}x, max |r - naive| {fit_error:.1e})")
+    print(f"update (one new day)         {np.median(update_times) * 1000:9.1f} ms   median of {len(update_times)} (max |r - naive| {update_error:.1e})")
+    print("\nStrongest lagged pairs:")
+    print(engine.top(limit=5).to_string(index=False))
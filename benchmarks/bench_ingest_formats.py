@@ -0,0 +1,66 @@
+"""
+/ingest body formats: wire size and parse throughput per format/encoding.
+
+Every variant goes through runlytics.processing.payloads.iter_payload_batches
+(decompression + parsing into biometrics frames, no database), as the
+webhook does.
+
+Usage: PYTHONPATH=src python benchmarks/bench_ingest_formats.py [points]
+"""
+import io
+import sys
+import gzip
+import json
+import time
+
+from bench_health_parser import make_payload
+from runlytics.processing import payloads
+
+
+def ndjson_metrics(payload):
+    """One line per metric, as in the export's metrics list."""
+    return "\n".join(json.dumps(m) for m in payload["data"]["metrics"]).encode()
+
+
+def ndjson_points(payload):
+    """One line per point, carrying its metric's name and units."""
+    lines = (
+        json.dumps({"name": m["name"], "units": m["units"], **point})
+        for m in payload["data"]["metrics"] for point in m["data"]
+    )
+    return "\n".join(lines).encode()
+
+
+def variants(payload):
+    raw_json = json.dumps(payload).encode()
+    yield "json", payloads.JSON, "identity", raw_json
+    yield "json + gzip", payloads.JSON, "gzip", gzip.compress(raw_json, 6)
+    if payloads.zstandard is not None:
+        yield "json + zstd", payloads.JSON, "zstd", payloads.zstandard.ZstdCompressor(level=3).compress(raw_json)
+
+    metrics = ndjson_metrics(payload)
+    yield "ndjson (metric lines)", payloads.NDJSON, "identity", metrics
+    yield "ndjson (point lines)", payloads.NDJSON, "identity", ndjson_points(payload)
+    yield "ndjson + gzip", payloads.NDJSON, "gzip", gzip.compress(metrics, 6)
+
+    if payloads.msgpack is not None:
+        packed = payloads.msgpack.packb(payload)
+        yield "msgpack", payloads.MSGPACK, "identity", packed
+        if payloads.zstandard is not None:
+            yield "msgpack + zstd", payloads.MSGPACK, "zstd", payloads.zstandard.ZstdCompressor(level=3).compress(packed)
+
+
+if __name__ == "__main__":
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    payload = make_payload(points)
+    print(f"Synthetic payload: {points:,} points")
+    print(f"{'format':<24} {'bytes':>13} {'vs json':>8} {'seconds':>8} {'points/s':>12}")
+
+    json_bytes = None
+    for label, fmt, encoding, body in variants(payload):
+        json_bytes = json_bytes or len(body)
+        t0 = time.perf_counter()
+        rows = sum(len(rows) for kind, rows in payloads.iter_payload_batches(io.BytesIO(body), fmt, encoding))
+        elapsed = time.perf_counter() - t0
+        assert rows == points, (label, rows)
+        print(f"{label:<24} {len(body):>13,} {len(body) / json_bytes:>7.2f}x {elapsed:>8.2f} {points / elapsed:>12,.0f}")
@@ -0,0 +1,69 @@
+"""
+Strava upload dedup cost vs. history size.
+
+Before: upload_to_supabase loaded every run date into a Python set.
+After: indexed lookups over only the incoming ids/dates (sync_state watermark).
+
+Usage: PYTHONPATH=src python benchmarks/bench_strava_dedup.py [db_url]
+(default: in-memory SQLite; pass a PostgreSQL URL for a realistic round-trip cost)
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from runlytics.database.models import Base, Run
+from runlytics.database.manager import get_engine, session_scope
+from runlytics.database.bulk import upsert_runs
+from runlytics.ingestion.strava_ingest import upload_to_supabase
+
+HISTORY_SIZES = [1_000, 10_000, 100_000]
+START = datetime(2000, 1, 1, 6)
+
+
+def strava_activity(i, date):
+    return {
+        "id": 10_000_000 + i,
+        "type": "Run",
+        "start_date": date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "start_date_local": date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "distance": 10_000,
+        "moving_time": 3_000,
+        "map": {},
+    }
+
+
+def legacy_dedup(session):
+    """The original duplicate check: every run date ever recorded."""
+    return set(dt[0].replace(tzinfo=None) for dt in session.query(Run.date).all())
+
+
+if __name__ == "__main__":
+    db_url = sys.argv[1] if len(sys.argv) > 1 else "sqlite://"
+    engine = get_engine(db_url)
+
+    print(f"{'history':>10} {'before (all dates)':>20} {'after (upload)':>16}")
+    for size in HISTORY_SIZES:
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+
+        with session_scope(db_url) as session:
+            history = [{"date": START + timedelta(hours=6 * i), "source": "strava"} for i in range(size)]
+            for start in range(0, size, 10_000):
+                upsert_runs(session, history[start:start + 10_000])
+
+        # Two new activities after the existing history
+        latest = START + timedelta(hours=6 * size)
+        incoming = [strava_activity(size + k, latest + timedelta(days=k)) for k in range(2)]
+
+        with session_scope(db_url) as session:
+            t0 = time.perf_counter()
+            legacy_dedup(session)
+            before = time.perf_counter() - t0
+
+        with session_scope(db_url) as session:
+            t0 = time.perf_counter()
+            added = upload_to_supabase(incoming, session)["written"]
+            after = time.perf_counter() - t0
+            assert added == 2
+
+        print(f"{size:>10,} {before * 1000:>18.1f}ms {after * 1000:>14.1f}ms")
@@ -0,0 +1,11 @@
+"""
+End-to-end ETL benchmark on synthetic data.
+
+generators.py builds deterministic Health Auto Export payloads, Strava
+activity pages and journal sheet records; __main__.py times each pipeline
+stage at several data sizes against SQLite (default) or a local Postgres
+and writes the results as JSON for comparison across commits:
+
+    PYTHONPATH=src python -m benchmarks.pipeline --sizes small,medium
+    PYTHONPATH=src python -m benchmarks.pipeline --db postgresql+psycopg2://... --compare old.json
+"""
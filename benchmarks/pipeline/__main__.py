@@ -0,0 +1,197 @@
+"""
+Runs the pipeline benchmark. See benchmarks/pipeline/__init__.py.
+
+Stages, per size (each size starts from an empty database):
+    parse          payload bytes -> biometrics/runs batches (no database)
+    ingest         /ingest job body: writes + rollups, training load, shapes, zones
+    ingest_repeat  the same payload again, as Health Auto Export resends it
+    strava_upload  upload_to_supabase over every generated activity page
+    journal_upload upload_journal_to_supabase over the sheet records
+    journal_resync sync_journal after one new sheet row (incremental; the full
+                   sync that sets its row cursor is not timed)
+    coach_report   AICoach().generate_report()
+"""
+import io
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from contextlib import redirect_stdout
+from datetime import datetime, timezone, timedelta
+
+from benchmarks.pipeline import generators
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+RESULTS_DIR = REPO_ROOT / "benchmarks" / "results"
+
+SIZES = {
+    "small": {"metrics": 4, "points": 2_000, "workouts": 10, "activities": 100, "journal_days": 60},
+    "medium": {"metrics": 8, "points": 20_000, "workouts": 50, "activities": 500, "journal_days": 365},
+    "large": {"metrics": 12, "points": 100_000, "workouts": 200, "activities": 2_000, "journal_days": 1_000},
+}
+
+
+def git_commit():
+    """(short sha, dirty) of the working tree, or (None, None) outside git."""
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip())
+        return sha, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def timed(fn, rows=None):
+    """Runs fn quietly; returns {"seconds", "rows", "rows_per_sec"} (rows: fixed count or fn's result)."""
+    t0 = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        result = fn()
+    seconds = time.perf_counter() - t0
+    rows = rows if rows is not None else result
+    return {"seconds": round(seconds, 4), "rows": rows, "rows_per_sec": round(rows / seconds, 1) if seconds and rows else 0.0}
+
+
+def reset_database(db_url):
+    from sqlalchemy import text
+    from runlytics.database.models import Base
+    from runlytics.database.manager import get_engine
+    from runlytics.database.compact import VIEW_NAME
+
+    engine = get_engine(db_url)
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP VIEW IF EXISTS {VIEW_NAME}"))
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+
+def run_size(name, params, db_url, anchor):
+    os.environ["DATABASE_URL"] = db_url
+    reset_database(db_url)
+
+    # Imported late: the webhook reads DATABASE_URL at import
+    from runlytics import webhook
+    from runlytics.database.manager import session_scope
+    from runlytics.processing.payloads import iter_payload_batches
+    from runlytics.processing.spatial import SPATIAL_INDEX_PATH
+    from runlytics.ingestion.strava_ingest import upload_to_supabase
+    from runlytics.ingestion.journal_ingest import upload_journal_to_supabase, sync_journal, ListSheet
+    from runlytics.analysis.coach import AICoach
+
+    webhook.get_watermarks().reset()
+    SPATIAL_INDEX_PATH.unlink(missing_ok=True)
+
+    payload = generators.health_payload(params["metrics"], params["points"], params["workouts"], anchor=anchor)
+    body = json.dumps(payload).encode()
+    activities = [a for page in generators.strava_pages(params["activities"], anchor=anchor) for a in page]
+    records = generators.journal_records(params["journal_days"], anchor=anchor)
+    points = params["metrics"] * params["points"]
+
+    def parse():
+        return sum(len(rows) for _, rows in iter_payload_batches(io.BytesIO(body)))
+
+    def ingest(dedup):
+        result = webhook.run_ingest(io.BytesIO(body), dedup=dedup)
+        return result["metrics_saved"] + result["runs_saved"]
+
+    def strava():
+        with session_scope(db_url) as session:
+            return upload_to_supabase(activities, session)["written"]
+
+    def journal():
+        with session_scope(db_url) as session:
+            return upload_journal_to_supabase(records, session)
+
+    def report():
+        AICoach().generate_report()
+        return 1
+
+    stages = {
+        "parse": timed(parse),
+        "ingest": timed(lambda: ingest(dedup=False), rows=points + params["workouts"]),
+        "ingest_repeat": timed(lambda: ingest(dedup=True), rows=points + params["workouts"]),
+        "strava_upload": timed(strava, rows=len(activities)),
+        "journal_upload": timed(journal),
+    }
+
+    sheet = ListSheet.from_records(records)
+    timed(lambda: sync_journal(sheet)["fetched"])
+    next_day = generators._anchor(anchor) + timedelta(days=1)
+    sheet.rows.append(list(generators.journal_records(1, seed=1, anchor=next_day)[0].values()))
+    stages["journal_resync"] = timed(lambda: sync_journal(sheet)["fetched"])
+
+    stages["coach_report"] = timed(report)
+    return stages
+
+
+def print_results(results, baseline=None):
+    print(f"\n{'size':<8} {'stage':<16} {'seconds':>9} {'rows':>10} {'rows/s':>12}" + (f" {'vs base':>9}" if baseline else ""))
+    for size, entry in results["sizes"].items():
+        for stage, r in entry["stages"].items():
+            line = f"{size:<8} {stage:<16} {r['seconds']:>9.3f} {r['rows']:>10,} {r['rows_per_sec']:>12,.0f}"
+            base = (baseline or {}).get("sizes", {}).get(size, {}).get("stages", {}).get(stage)
+            if base and base["seconds"]:
+                line += f" {r['seconds'] / base['seconds']:>8.2f}x"
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.pipeline", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="small,medium", help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument("--db", help="database URL (default: a temporary SQLite file per size)")
+    parser.add_argument("--anchor", help="newest day of synthetic data (default: today)")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/pipeline-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to report ratios against")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's INFO logs")
+    args = parser.parse_args(argv)
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"unknown size(s): {', '.join(unknown)}")
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    output = Path(args.output).resolve() if args.output else None
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    # Relative outputs of the pipeline (coach report, spatial index) go to a scratch directory
+    workdir = tempfile.mkdtemp(prefix="runlytics-bench-")
+    os.chdir(workdir)
+    os.environ.setdefault("DB_SSLMODE", "")
+
+    commit, dirty = git_commit()
+    results = {
+        "benchmark": "pipeline",
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": None,
+        "anchor": args.anchor,
+        "sizes": {},
+    }
+
+    for size in sizes:
+        db_url = args.db or f"sqlite:///{os.path.join(workdir, f'{size}.db')}"
+        results["database"] = db_url.split(":", 1)[0].split("+", 1)[0]
+        print(f"Running {size} ({SIZES[size]})...", file=sys.stderr)
+        results["sizes"][size] = {"params": SIZES[size], "stages": run_size(size, SIZES[size], db_url, args.anchor)}
+
+    print_results(results, baseline)
+
+    if output is None:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        output = RESULTS_DIR / f"pipeline-{commit or 'nogit'}{'-dirty' if dirty else ''}.json"
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Deterministic synthetic inputs for every upstream source.
+
+Each generator takes a seed and an anchor date (the newest day of data,
+default today) so the same arguments always produce the same payload, and
+the data lands in the windows the coach report looks at.
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from runlytics.processing.gis import encode_polyline
+
+# Health Auto Export metric names, in the order payloads include them
+METRICS = [
+    ("heart_rate", "count/min", 1, (55, 175)),
+    ("step_count", "count", 5, (0, 600)),
+    ("active_energy", "kcal", 5, (0, 15)),
+    ("walking_running_distance", "km", 5, (0, 0.8)),
+    ("heart_rate_variability", "ms", 240, (25, 90)),
+    ("resting_heart_rate", "count/min", 1440, (45, 60)),
+    ("vo2_max", "ml/(kg*min)", 1440, (48, 56)),
+    ("weight_body_mass", "kg", 1440, (68, 74)),
+    ("body_fat_percentage", "%", 1440, (10, 14)),
+    ("lean_body_mass", "kg", 1440, (58, 63)),
+    ("apple_exercise_time", "min", 60, (0, 60)),
+    ("basal_energy_burned", "kcal", 5, (5, 8)),
+]
+
+# Sheet headers as typed in the journal (matched by keyword in find_header_map)
+JOURNAL_HEADERS = ["Timestamp", "Date", "RPE (Exertion)", "Mood / Motivation ", "Soreness", "Knee Pain", "Sleep Quality", "Notes"]
+
+# Somewhere to run
+ORIGIN = (32.08, 34.78)
+
+
+def _anchor(anchor):
+    return pd.Timestamp(anchor).normalize() if anchor is not None else pd.Timestamp.now().normalize()
+
+
+def _route(rng, points):
+    """A random-walk route of `points` (lat, lng) pairs around ORIGIN (~10 m steps)."""
+    steps = rng.normal(0, 0.0001, size=(points, 2)).cumsum(axis=0)
+    return np.asarray(ORIGIN) + steps
+
+
+def health_payload(metrics=4, points=10_000, workouts=10, route_points=500, seed=0, anchor=None):
+    """
+    Health Auto Export document: `metrics` metrics (cycling through METRICS,
+    suffixed once the list runs out) of `points` samples each at the
+    metric's sampling interval ending at the anchor, plus running workouts.
+    """
+    rng = np.random.default_rng(seed)
+    end = _anchor(anchor)
+    document = {"data": {"metrics": [], "workouts": []}}
+
+    for m in range(metrics):
+        name, unit, every, (lo, hi) = METRICS[m % len(METRICS)]
+        if m >= len(METRICS):
+            name = f"{name}_{m // len(METRICS)}"
+        dates = pd.date_range(end=end, periods=points, freq=f"{every}min").strftime("%Y-%m-%d %H:%M:%S +0200")
+        values = np.round(rng.uniform(lo, hi, points), 2)
+        document["data"]["metrics"].append({
+            "name": name,
+            "units": unit,
+            "data": [{"date": d, "qty": float(v), "source": "Apple Watch"} for d, v in zip(dates, values)],
+        })
+
+    for w in range(workouts):
+        start = end - timedelta(days=w, hours=-6)
+        route = _route(rng, route_points)
+        document["data"]["workouts"].append({
+            "name": "Running",
+            "start": start.strftime("%Y-%m-%d %H:%M:%S +0200"),
+            "duration": float(rng.integers(25, 120)),
+            "distance": float(np.round(rng.uniform(4, 25), 2)),
+            "avg_heart_rate": float(rng.integers(135, 165)),
+            "max_heart_rate": float(rng.integers(165, 190)),
+            "active_energy": float(rng.integers(300, 1500)),
+            "route": [{"lat": float(lat), "lon": float(lng)} for lat, lng in route],
+        })
+    return document
+
+
+def strava_pages(activities=200, per_page=200, route_points=300, seed=0, anchor=None):
+    """Pages of Strava /athlete/activities results (newest first), 80% runs, with encoded summary polylines."""
+    rng = np.random.default_rng(seed)
+    end = _anchor(anchor)
+    rows = []
+    for i in range(activities):
+        start = end - timedelta(days=i // 2, hours=(i % 2) * 10 - 17)
+        moving = int(rng.integers(1500, 7200))
+        rows.append({
+            "id": 9_000_000_000 + i,
+            "type": "Run" if rng.random() < 0.8 else "Ride",
+            "start_date": (start - timedelta(hours=2)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "start_date_local": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "distance": float(np.round(moving * rng.uniform(2.5, 4.0), 1)),
+            "moving_time": moving,
+            "average_heartrate": float(np.round(rng.uniform(130, 165), 1)),
+            "max_heartrate": float(rng.integers(165, 192)),
+            "kilojoules": float(np.round(moving * rng.uniform(0.2, 0.4), 1)),
+            "map": {"id": f"a{i}", "summary_polyline": encode_polyline(_route(rng, route_points)), "resource_state": 2},
+        })
+    return [rows[start:start + per_page] for start in range(0, len(rows), per_page)]
+
+
+def journal_records(days=90, seed=0, anchor=None):
+    """gspread get_all_records() output: one row per day, newest last, some cells left blank."""
+    rng = np.random.default_rng(seed)
+    end = _anchor(anchor)
+    records = []
+    for d in range(days - 1, -1, -1):
+        day = end - timedelta(days=d)
+        blank = rng.random(5) < 0.1
+        values = [int(v) for v in rng.integers(1, 11, 5)]
+        records.append(dict(zip(JOURNAL_HEADERS, [
+            (day + timedelta(hours=21)).strftime("%m/%d/%Y %H:%M:%S"),
+            day.strftime("%m/%d/%Y"),
+            *("" if b else v for b, v in zip(blank, values)),
+            "" if rng.random() < 0.7 else f"Synthetic note {d}",
+        ])))
+    return records
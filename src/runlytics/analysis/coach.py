@@ -1,55 +1,85 @@
 import os
 import json
+import time
+import hashlib
+import threading
 import pandas as pd
-from sqlalchemy import create_engine
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+from runlytics.database.manager import get_engine
+from runlytics.database.sync_state import data_watermarks
+from runlytics.utils.telemetry import operation, span
+
+# "duckdb" reads the local Parquet mirror (runlytics.database.mirror) instead of Supabase
+COACH_BACKEND = os.getenv("COACH_BACKEND", "postgres")
+
+# 7-day mean, window mean, sample count and trend per metric, computed in the database.
+# A missing 7-day mean counts as 0 and a missing/zero baseline as 1 (no division by zero).
+# Plain SQL that runs on both Postgres and the DuckDB mirror.
+PHYSIOLOGY_QUERY = """
+WITH agg AS (
+    SELECT
+        type,
+        COUNT(*) AS samples,
+        COALESCE(AVG(CASE WHEN date > :recent_since THEN value END), 0) AS recent_avg,
+        COALESCE(NULLIF(AVG(value), 0), 1) AS baseline_avg
+    FROM biometrics
+    WHERE date > :since
+    AND type IN (
+        'resting_heart_rate', 'heart_rate_variability', 'vo2_max',
+        'apple_exercise_time', 'weight_body_mass', 'body_fat_percentage', 'lean_body_mass'
+    )
+    GROUP BY type
+)
+SELECT
+    type, samples, recent_avg, baseline_avg,
+    CASE
+        WHEN recent_avg > baseline_avg * 1.02 THEN 'High'
+        WHEN recent_avg < baseline_avg * 0.98 THEN 'Low'
+        ELSE 'Stable'
+    END AS trend
+FROM agg
+"""
 
 class AICoach:
-    def __init__(self):
-        db_url = os.getenv("DATABASE_URL")
-        if not db_url:
-            raise ValueError("DATABASE_URL environment variable is not set")
-        
-        # Connect to Supabase
-        self.engine = create_engine(db_url, pool_pre_ping=True)
-
-    def get_metric_stats(self, df, metric_name, days=30):
-        """Helper to safely calculate stats for a specific metric."""
-        sub_df = df[df['type'] == metric_name]
-        
-        if sub_df.empty:
+    def __init__(self, warehouse=None):
+        self.warehouse = warehouse
+        if self.warehouse is None and COACH_BACKEND == "duckdb":
+            from runlytics.database.mirror import LocalWarehouse
+            self.warehouse = LocalWarehouse()
+
+        # Connect to Supabase (shared process-wide pool; raises if DATABASE_URL is not set)
+        self.engine = None if self.warehouse is not None else get_engine()
+
+    def read_sql(self, query, params=None):
+        """Runs a parameterized (:name) analysis query against the local mirror if one is attached, else Postgres."""
+        if self.warehouse is not None:
+            return self.warehouse.query(query, params)
+        return pd.read_sql(text(query), self.engine, params=params)
+
+    def get_metric_stats(self, df, metric_name):
+        """Formats one metric's row from the grouped physiology query."""
+        if metric_name not in df.index:
             return None
 
-        # 7-day average (Current Status)
-        recent_df = sub_df[sub_df['date'] > (datetime.now() - pd.Timedelta(days=7))]
-        recent_avg = recent_df['value'].mean()
-        
-        # 30-day average (Baseline)
-        overall_avg = sub_df['value'].mean()
-        
-        # Avoid division by zero
-        if pd.isna(recent_avg): recent_avg = 0
-        if pd.isna(overall_avg) or overall_avg == 0: overall_avg = 1 
-
+        row = df.loc[metric_name]
         return {
-            "7_day_avg": round(recent_avg, 2),
-            "30_day_baseline": round(overall_avg, 2),
-            "trend": "High" if recent_avg > overall_avg * 1.02 else "Low" if recent_avg < overall_avg * 0.98 else "Stable"
+            "7_day_avg": round(float(row['recent_avg']), 2),
+            "30_day_baseline": round(float(row['baseline_avg']), 2),
+            "samples": int(row['samples']),
+            "trend": row['trend']
         }
 
     def get_physiology(self, days=30):
         """Calculates cardio and body composition baselines."""
-        # UPDATED: Added 'weight_body_mass' and 'lean_body_mass' to the query
-        query = f"""
-        SELECT type, value, date
-        FROM biometrics
-        WHERE date > NOW() - INTERVAL '{days} days'
-        AND type IN (
-            'resting_heart_rate', 'heart_rate_variability', 'vo2_max', 
-            'apple_exercise_time', 'weight_body_mass', 'body_fat_percentage', 'lean_body_mass'
-        )
-        """
-        df = pd.read_sql(query, self.engine)
+        # One row per metric whatever the sampling rate; the text is constant so the
+        # statement can be cached, only the cutoffs change.
+        now = datetime.now()
+        df = self.read_sql(PHYSIOLOGY_QUERY, {
+            "since": now - timedelta(days=days),
+            "recent_since": now - timedelta(days=7),
+        })
 
         if df.empty:
             return {"error": "No biometrics found"}
@@ -57,6 +87,7 @@ class AICoach:
         # Normalize names to be cleaner for the AI
         # 'weight_body_mass' -> 'weight'
         df['type'] = df['type'].replace('weight_body_mass', 'weight')
+        df = df.set_index('type')
 
         stats = {
             "cardio": {},
@@ -77,21 +108,23 @@ class AICoach:
 
     def get_recent_runs(self, limit=10):
         """Fetches recent run data."""
-        query = f"""
+        query = """
         SELECT date, distance_km, duration_min, avg_hr, energy_kcal
         FROM runs
         ORDER BY date DESC
-        LIMIT {limit}
+        LIMIT :limit
         """
-        df = pd.read_sql(query, self.engine)
+        df = self.read_sql(query, {"limit": int(limit)})
         if df.empty: return []
         df['date'] = df['date'].astype(str)
         return df.to_dict(orient='records')
 
-    def generate_report(self):
-        """Generates the context file for the LLM."""
-        physio = self.get_physiology()
-        runs = self.get_recent_runs()
+    def build_report(self):
+        """The report as a dict (see generate_report)."""
+        with span("physiology"):
+            physio = self.get_physiology()
+        with span("recent_runs"):
+            runs = self.get_recent_runs()
 
         report = {
             "generated_at": datetime.now().isoformat(),
@@ -103,16 +136,78 @@ class AICoach:
             "recent_training": runs,
             "analysis_instructions": "Analyze the user's readiness. If HRV is low, warn against high-intensity plyometrics. If Weight is trending up, flag it as a risk for both goals."
         }
+        return report
+
+    def generate_report(self):
+        """Generates the context file for the LLM."""
+        with operation("coach_report"):
+            report = self.build_report()
+
+            # Save locally
+            output_path = "data/coach_context.json"
+            os.makedirs("data", exist_ok=True)
+
+            with span("write"), open(output_path, "w") as f:
+                json.dump(report, f, indent=2)
 
-        # Save locally
-        output_path = "data/coach_context.json"
-        os.makedirs("data", exist_ok=True)
-        
-        with open(output_path, "w") as f:
-            json.dump(report, f, indent=2)
-        
         return output_path
 
+# --- REPORT CACHE ---
+# Tables the report reads; a committed write to one of them invalidates it
+REPORT_TABLES = ("biometrics", "runs")
+# The 7/30-day windows are relative to now, so even without new data a report is rebuilt after this long
+COACH_REPORT_MAX_AGE = float(os.getenv("COACH_REPORT_MAX_AGE", "3600"))
+
+class ReportCache:
+    """
+    The last built report as JSON bytes plus an ETag, keyed on the
+    data_watermarks of REPORT_TABLES. A hit runs no database query; the
+    first request after an ingest/sync that wrote to those tables (or
+    after max_age seconds) rebuilds it, one request at a time.
+    """
+
+    def __init__(self, max_age=COACH_REPORT_MAX_AGE, coach_factory=AICoach):
+        self.max_age = max_age
+        self.coach_factory = coach_factory
+        self._entry = None  # (watermarks, built at (monotonic), body, etag)
+        self._lock = threading.Lock()
+
+    def _fresh(self, entry):
+        return (
+            entry is not None
+            and entry[0] == data_watermarks.snapshot(REPORT_TABLES)
+            and time.monotonic() - entry[1] < self.max_age
+        )
+
+    def get(self):
+        """(body, etag) of an up-to-date report."""
+        entry = self._entry
+        if self._fresh(entry):
+            return entry[2], entry[3]
+
+        with self._lock:
+            # Another request may have rebuilt it while this one waited
+            entry = self._entry
+            if self._fresh(entry):
+                return entry[2], entry[3]
+
+            # Taken before the queries: a write landing mid-build forces the next rebuild
+            marks = data_watermarks.snapshot(REPORT_TABLES)
+            with operation("coach_report"):
+                report = self.coach_factory().build_report()
+            body = json.dumps(report, indent=2, default=str).encode()
+            # Hash the content without generated_at, so a rebuild with the same numbers keeps the tag
+            content = json.dumps({k: v for k, v in report.items() if k != "generated_at"}, sort_keys=True, default=str)
+            etag = '"' + hashlib.blake2b(content.encode(), digest_size=12).hexdigest() + '"'
+            self._entry = (marks, time.monotonic(), body, etag)
+            return body, etag
+
+    def invalidate(self):
+        self._entry = None
+
+# Served by GET /coach/report
+report_cache = ReportCache()
+
 if __name__ == "__main__":
     try:
         coach = AICoach()
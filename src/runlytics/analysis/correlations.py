@@ -0,0 +1,317 @@
+"""
+Lagged correlations between daily features from every source.
+
+load_features() builds one row per day, one column per feature:
+    journal:<score>   daily_journal (rpe, mood, soreness, knee_pain, sleep_quality)
+    bio:<type>        biometric_daily (daily total for cumulative types, mean otherwise)
+    run:<metric>      that day's runs: distance_km, pace_min_per_km, avg_hr and
+                      efficiency (metres per minute per bpm)
+
+r[lag, i, j] is the Pearson correlation of feature i on day t with feature j
+on day t + lag, over the days where both are present. "Does sleep quality
+predict tomorrow's pace" is i = journal:sleep_quality, j = run:pace_min_per_km,
+lag = 1.
+
+All lags and pairs come from one batched matrix product of the standardised
+matrix against lagged views of itself, which yields the pairwise-complete
+sums (n, sum x, sum y, sum x^2, sum y^2, sum xy). The sums are additive over
+days, so new days (and re-read recent ones) are folded in by subtracting the
+old contributions of the changed tail and adding the new ones, instead of
+recomputing years of history.
+"""
+import os
+import time
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import select
+
+from runlytics.database.models import DailyJournal, BiometricDaily, Run
+from runlytics.database.manager import session_scope
+from runlytics.database.sync_state import data_watermarks
+from runlytics.utils.telemetry import operation, span
+
+logger = logging.getLogger("correlations")
+
+MAX_LAG = int(os.getenv("CORRELATION_MAX_LAG", "14"))
+# Pairs with fewer days in common get no coefficient
+MIN_OVERLAP = int(os.getenv("CORRELATION_MIN_OVERLAP", "10"))
+# Days before the newest one that are re-read on each update (late samples, journal edits)
+REFRESH_DAYS = int(os.getenv("CORRELATION_REFRESH_DAYS", "7"))
+# Full rebuild after this long, for writes from other processes and older backfills
+MAX_AGE = float(os.getenv("CORRELATION_MAX_AGE", "3600"))
+# Lags per batched product; bounds the (lags x 3 features x days) temporary
+LAG_CHUNK = 16
+
+JOURNAL_FEATURES = ["rpe", "mood", "soreness", "knee_pain", "sleep_quality"]
+# Cumulative biometrics use the daily total, the rest the daily mean
+SUM_TYPES = {"step_count", "active_energy", "basal_energy_burned", "walking_running_distance", "apple_exercise_time", "flights_climbed"}
+# A day without runs ran 0 km; its pace and HR are missing, not 0
+ZERO_FILL = ["run:distance_km"]
+# Tables the features come from (keys of data_watermarks)
+TABLES = ("daily_journal", "biometrics", "runs")
+
+
+def load_features(session, since=None):
+    """Daily feature frame (see module docstring) from day `since` on. Days without data are absent."""
+    journal_q = select(DailyJournal.date, *[getattr(DailyJournal, f) for f in JOURNAL_FEATURES])
+    bio_q = select(BiometricDaily.type, BiometricDaily.day, BiometricDaily.value_sum, BiometricDaily.value_mean)
+    run_q = select(Run.date, Run.distance_km, Run.duration_min, Run.avg_hr).where(Run.distance_km > 0, Run.duration_min > 0)
+    if since is not None:
+        journal_q = journal_q.where(DailyJournal.date >= since.date())
+        bio_q = bio_q.where(BiometricDaily.day >= since.to_pydatetime())
+        run_q = run_q.where(Run.date >= since.tz_localize("UTC").to_pydatetime())
+
+    frames = []
+    journal = pd.DataFrame(session.execute(journal_q).all(), columns=["day", *JOURNAL_FEATURES])
+    if not journal.empty:
+        journal["day"] = pd.to_datetime(journal["day"])
+        frames.append(journal.set_index("day").add_prefix("journal:"))
+
+    bio = pd.DataFrame(session.execute(bio_q).all(), columns=["type", "day", "value_sum", "value_mean"])
+    if not bio.empty:
+        bio["value"] = np.where(bio["type"].isin(SUM_TYPES), bio["value_sum"], bio["value_mean"])
+        bio["day"] = pd.to_datetime(bio["day"]).dt.normalize()
+        frames.append(bio.pivot_table(index="day", columns="type", values="value", aggfunc="mean").add_prefix("bio:"))
+
+    runs = pd.DataFrame(session.execute(run_q).all(), columns=["date", "distance_km", "duration_min", "avg_hr"])
+    if not runs.empty:
+        runs["day"] = pd.to_datetime(runs["date"], utc=True).dt.tz_localize(None).dt.normalize()
+        # Duration-weighted HR over the runs that have one
+        runs["hr_minutes"] = runs["avg_hr"] * runs["duration_min"]
+        runs["hr_weight"] = runs["duration_min"].where(runs["avg_hr"].notna())
+        daily = runs.groupby("day")[["distance_km", "duration_min", "hr_minutes", "hr_weight"]].sum(min_count=1)
+        hr = daily["hr_minutes"] / daily["hr_weight"]
+        frames.append(pd.DataFrame({
+            "run:distance_km": daily["distance_km"],
+            "run:pace_min_per_km": daily["duration_min"] / daily["distance_km"],
+            "run:avg_hr": hr,
+            "run:efficiency": daily["distance_km"] * 1000 / daily["duration_min"] / hr,
+        }))
+
+    if not frames:
+        return pd.DataFrame(dtype=float)
+    frame = pd.concat(frames, axis=1).sort_index().astype(float)
+    frame.columns.name = None
+    return frame
+
+
+def _complete(frame, start=None, end=None):
+    """frame on every day from start to end (default: its own span), zero-filling ZERO_FILL columns."""
+    if start is None and frame.empty:
+        return frame
+    days = pd.date_range(start if start is not None else frame.index.min(), end if end is not None else frame.index.max(), freq="D")
+    frame = frame.reindex(days)
+    for column in ZERO_FILL:
+        if column in frame:
+            frame[column] = frame[column].fillna(0.0)
+    return frame
+
+
+def lagged_sums(z, max_lag, first_later=0):
+    """
+    Pairwise-complete sums over day pairs (t, t + lag), lag = 0..max_lag,
+    whose later day is row first_later or after, for a (days x features)
+    matrix with NaNs. Returns (6, lags, F, F): n, sum x, sum y, sum x^2,
+    sum y^2, sum xy, x being feature i on the earlier day, y feature j on
+    the later one.
+    """
+    days, features = z.shape
+    sums = np.zeros((6, max_lag + 1, features, features))
+    rows = days - first_later
+    if rows <= 0 or features == 0:
+        return sums
+
+    present = ~np.isnan(z)
+    x = np.where(present, z, 0.0)
+    # Columns [x | 1 | x^2], zero where missing, so one product gives every sum
+    stack = np.concatenate([x, present.astype(float), x * x], axis=1)
+
+    # Earlier rows for lag l are [first_later - l, days - l); zero rows pad the front
+    pad = max(max_lag - first_later, 0)
+    earlier = np.concatenate([np.zeros((pad, 3 * features)), stack[max(first_later - max_lag, 0):]])
+    later = stack[first_later:]
+    windows = sliding_window_view(earlier, rows, axis=0)  # windows[max_lag - l] is lag l, (3F, rows)
+
+    X, ONE, SQ = slice(0, features), slice(features, 2 * features), slice(2 * features, 3 * features)
+    for start in range(0, max_lag + 1, LAG_CHUNK):
+        lags = np.arange(start, min(start + LAG_CHUNK, max_lag + 1))
+        product = windows[max_lag - lags] @ later
+        sums[0, lags] = product[:, ONE, ONE]
+        sums[1, lags] = product[:, X, ONE]
+        sums[2, lags] = product[:, ONE, X]
+        sums[3, lags] = product[:, SQ, ONE]
+        sums[4, lags] = product[:, ONE, SQ]
+        sums[5, lags] = product[:, X, X]
+    return sums
+
+
+def correlation(sums, min_overlap=MIN_OVERLAP):
+    """(r, n) from lagged_sums; r is NaN below min_overlap days or for a constant series."""
+    n, sx, sy, sxx, syy, sxy = sums
+    var_x = n * sxx - sx * sx
+    var_y = n * syy - sy * sy
+    # Inputs are standardised, so variances are O(n^2); anything far below is rounding
+    valid = (n >= max(min_overlap, 2)) & (var_x > 1e-9 * n * n) & (var_y > 1e-9 * n * n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = (n * sxy - sx * sy) / np.sqrt(var_x * var_y)
+    r = np.where(valid, np.clip(r, -1.0, 1.0), np.nan)
+    return r, n.astype(np.int64)
+
+
+class LaggedCorrelations:
+    """Lagged correlation state over a daily feature frame: fit() once, then update() with recent days."""
+
+    def __init__(self, max_lag=MAX_LAG, min_overlap=MIN_OVERLAP):
+        self.max_lag = max_lag
+        self.min_overlap = min_overlap
+        self.frame = None
+        self.sums = None
+
+    def _z(self, values):
+        return (values - self.center) / self.scale
+
+    def fit(self, frame):
+        """Computes every lag from scratch over frame (loaded by load_features)."""
+        self.frame = _complete(frame)
+        values = self.frame.to_numpy(dtype=float)
+        # Standardising keeps the one-pass sums well conditioned; fixed at fit time
+        # so later updates add comparable sums
+        counts = (~np.isnan(values)).sum(axis=0)
+        self.center = np.divide(np.nansum(values, axis=0), counts, out=np.zeros(values.shape[1]), where=counts > 0)
+        spread = np.sqrt(np.divide(np.nansum((values - self.center) ** 2, axis=0), counts, out=np.zeros(values.shape[1]), where=counts > 0))
+        self.scale = np.where(spread > 0, spread, 1.0)
+        self.sums = lagged_sums(self._z(values), self.max_lag)
+        return len(values)
+
+    def update(self, tail, since):
+        """
+        Replaces the rows from day `since` on with tail (load_features(session, since)),
+        which may add days. Returns the number of rows whose sums were redone, or None
+        when tail can't be folded in (new features, or days before the fitted range): refit.
+        """
+        since = pd.Timestamp(since).normalize()
+        if self.frame is None or self.frame.empty or since < self.frame.index[0]:
+            return None
+        if set(tail.columns) - set(self.frame.columns):
+            return None
+
+        old = self.frame
+        end = max(old.index[-1], tail.index.max()) if not tail.empty else old.index[-1]
+        fresh = _complete(tail.reindex(columns=old.columns), start=since, end=end)
+        new = pd.concat([old[old.index < since], fresh])
+
+        old_values = old.to_numpy(dtype=float)
+        new_values = new.to_numpy(dtype=float)
+        common = min(len(old_values), len(new_values))
+        a, b = old_values[:common], new_values[:common]
+        differs = ~((a == b) | (np.isnan(a) & np.isnan(b))).all(axis=1)
+        first = int(np.argmax(differs)) if differs.any() else common
+        if first == len(old_values) == len(new_values):
+            return 0
+
+        self.sums -= lagged_sums(self._z(old_values), self.max_lag, first)
+        self.sums += lagged_sums(self._z(new_values), self.max_lag, first)
+        self.frame = new
+        return len(new_values) - first
+
+    def matrix(self):
+        """(features, r, n); r and n are (lags x features x features), see the module docstring."""
+        r, n = correlation(self.sums, self.min_overlap)
+        return list(self.frame.columns), r, n
+
+    def top(self, target=None, max_lag=None, limit=20, include_self=False):
+        """Strongest pairs as a frame (feature, target, lag, r, n), by |r|; target filters the later-day feature."""
+        features, r, n = self.matrix()
+        if not features:
+            return pd.DataFrame(columns=["feature", "target", "lag", "r", "n"])
+        lag, i, j = np.meshgrid(np.arange(r.shape[0]), np.arange(len(features)), np.arange(len(features)), indexing="ij")
+        keep = ~np.isnan(r)
+        if not include_self:
+            keep &= i != j
+        if max_lag is not None:
+            keep &= lag <= max_lag
+        if target is not None:
+            keep &= j == (features.index(target) if target in features else -1)
+
+        pairs = pd.DataFrame({
+            "feature": np.asarray(features, dtype=object)[i[keep]],
+            "target": np.asarray(features, dtype=object)[j[keep]],
+            "lag": lag[keep],
+            "r": r[keep],
+            "n": n[keep],
+        })
+        order = pairs["r"].abs().sort_values(ascending=False, kind="stable").index
+        return pairs.loc[order].head(limit).reset_index(drop=True)
+
+
+class CorrelationCache:
+    """
+    LaggedCorrelations kept in step with the database, keyed on the
+    data_watermarks of TABLES. A hit runs no query; after a committed write
+    to one of them the next read re-loads the last REFRESH_DAYS days and
+    folds them in, and every max_age seconds it is rebuilt in full.
+    """
+
+    def __init__(self, max_lag=MAX_LAG, max_age=MAX_AGE):
+        self.max_lag = max_lag
+        self.max_age = max_age
+        self.engine = None
+        self._marks = None
+        self._built = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self, session):
+        # Taken before the queries: a write landing mid-update forces the next one
+        marks = data_watermarks.snapshot(TABLES)
+        if self.engine is not None and marks == self._marks and time.monotonic() - self._built < self.max_age:
+            return "hit"
+
+        with operation("correlations") as op:
+            changed = None
+            if self.engine is not None and time.monotonic() - self._built < self.max_age and not self.engine.frame.empty:
+                since = self.engine.frame.index[-1] - pd.Timedelta(days=REFRESH_DAYS)
+                with span("load"):
+                    tail = load_features(session, since)
+                with span("sums"):
+                    changed = self.engine.update(tail, since)
+            if changed is None:
+                with span("load"):
+                    frame = load_features(session)
+                engine = LaggedCorrelations(self.max_lag)
+                with span("sums"):
+                    changed = engine.fit(frame)
+                self.engine, self._built = engine, time.monotonic()
+                mode = "full"
+            else:
+                mode = "incremental"
+            op.add_rows("days", changed)
+        self._marks = marks
+        logger.info("correlations %s update: %d days recomputed, %d features", mode, changed, len(self.engine.frame.columns))
+        return mode
+
+    def top(self, session_factory=session_scope, **filters):
+        """(LaggedCorrelations.top(**filters) on up-to-date sums, days covered, features)."""
+        with self._lock:
+            with session_factory() as session:
+                self._refresh(session)
+            frame = self.engine.frame
+            return self.engine.top(**filters), len(frame), list(frame.columns)
+
+    def invalidate(self):
+        with self._lock:
+            self.engine = None
+
+# Served by GET /analysis/correlations
+correlation_cache = CorrelationCache()
+
+if __name__ == "__main__":
+    import sys
+
+    target = sys.argv[1] if len(sys.argv) > 1 else None
+    pairs, days, features = correlation_cache.top(target=target, limit=30)
+    print(f"{days} days, {len(features)} features, lags 0-{correlation_cache.max_lag}")
+    print(pairs.to_string(index=False) if not pairs.empty else "No pairs with enough overlapping days.")
@@ -0,0 +1,239 @@
+"""
+Aerobic decoupling and cardiac drift per run.
+
+Each run window [runs.date, + duration_min) is split into two halves.
+The per-minute heart_rate samples (and walking_running_distance samples,
+for pace) in biometrics are attached to every run containing them with
+one sorted interval join (zones.locate) instead of a query per run, then
+aggregated per half:
+
+    EF            = speed / HR                    (efficiency factor)
+    decoupling %  = (EF1 - EF2) / EF1 * 100       (Pa:HR)
+    HR drift %    = (HR2 - HR1) / HR1 * 100       (steady-pace stretches only)
+
+Cardiac drift is the HR rise at constant pace, so HR drift only uses HR
+samples in PACE_BIN_S bins whose distance is within STEADY_PACE_TOLERANCE
+of the run's median bin; a run without distance samples has none.
+
+Results are cached in run_drift, so update_run_drift() only computes runs
+it hasn't seen, plus runs younger than DRIFT_PENDING_DAYS that were cached
+before any of their HR samples arrived. Large batches are split across a
+process pool.
+"""
+import os
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from runlytics.database.models import Run, RunDrift
+from runlytics.database.bulk import dialect_insert, INSERT_CHUNK_SIZE
+from runlytics.database.compact import samples_table
+from runlytics.processing.zones import locate
+
+logger = logging.getLogger("drift")
+
+HR_TYPE = "heart_rate"
+DISTANCE_TYPE = "walking_running_distance"
+
+# A half needs this many HR samples to count (per-minute samples: 5 minutes)
+MIN_HALF_SAMPLES = 5
+
+# HR drift bins and how far a bin's distance may stray from the run's median bin
+PACE_BIN_S = 300
+STEADY_PACE_TOLERANCE = 0.10
+
+# A run cached without HR samples is retried while younger than this (late Health exports)
+DRIFT_PENDING_DAYS = int(os.getenv("DRIFT_PENDING_DAYS", "14"))
+
+# Runs whose samples are read per query (bounds memory on a full-history pass)
+RUNS_PER_QUERY = 200
+
+# Below this many runs the pool's startup costs more than it saves
+PARALLEL_MIN_RUNS = 100
+
+DRIFT_WORKERS = int(os.getenv("DRIFT_WORKERS", str(os.cpu_count() or 1)))
+
+RESULT_COLUMNS = [
+    "run_id", "hr_first", "hr_second", "speed_first", "speed_second",
+    "decoupling_pct", "hr_drift_pct", "hr_samples",
+]
+
+
+def run_windows(runs):
+    """runs (id, date, duration_min) -> sorted windows with run_id, start, mid, end (naive wall clock)."""
+    start = pd.to_datetime(runs["date"], utc=True).dt.tz_localize(None)
+    duration = pd.to_timedelta(pd.to_numeric(runs["duration_min"], errors="coerce"), unit="min")
+    windows = pd.DataFrame({
+        "run_id": runs["id"].to_numpy(),
+        "start": start.to_numpy(),
+        "mid": (start + duration / 2).to_numpy(),
+        "end": (start + duration).to_numpy(),
+    }).astype({"start": "datetime64[ns]", "mid": "datetime64[ns]", "end": "datetime64[ns]"})
+    return windows.dropna().sort_values("start", ignore_index=True)
+
+
+def window_stats(windows, samples):
+    """
+    Per-run drift for sorted windows and sorted samples (date, type, value).
+    Module-level so it can run in a worker process.
+    """
+    result = pd.DataFrame({"run_id": windows["run_id"]})
+    if samples.empty:
+        joined = samples.assign(
+            run_id=pd.Series(dtype=windows["run_id"].dtype), start=pd.Series(dtype="datetime64[ns]"), half=pd.Series(dtype=int),
+        )
+    else:
+        # Attach each sample to every run window containing it (overlapping duplicates both keep it)
+        run, sample = locate(
+            samples["date"].to_numpy(dtype="datetime64[ns]").view(np.int64),
+            windows["start"].to_numpy().view(np.int64), windows["end"].to_numpy().view(np.int64),
+        )
+        joined = pd.concat([
+            samples.iloc[sample].reset_index(drop=True), windows.iloc[run].reset_index(drop=True),
+        ], axis=1)
+        joined["half"] = np.where(joined["date"] < joined["mid"], 1, 2)
+    joined["bin"] = ((joined["date"] - joined["start"]).dt.total_seconds() // PACE_BIN_S).astype(np.int64)
+
+    hr_rows = joined[joined["type"] == HR_TYPE]
+    dist_rows = joined[joined["type"] == DISTANCE_TYPE]
+    hr = hr_rows.groupby(["run_id", "half"])["value"].agg(["mean", "count"]).unstack("half")
+    dist = dist_rows.groupby(["run_id", "half"])["value"].sum().unstack("half")
+
+    # Steady-pace bins: distance within tolerance of the run's median bin
+    bins = dist_rows.groupby(["run_id", "bin"])["value"].sum()
+    median = bins.groupby(level="run_id").transform("median")
+    steady_bins = bins.index[(median > 0) & ((bins - median).abs() <= STEADY_PACE_TOLERANCE * median)]
+    steady_rows = hr_rows[pd.MultiIndex.from_frame(hr_rows[["run_id", "bin"]]).isin(steady_bins)]
+    steady = steady_rows.groupby(["run_id", "half"])["value"].agg(["mean", "count"]).unstack("half")
+
+    def column(frame, key):
+        if key not in frame.columns:
+            return pd.Series(np.nan, index=result["run_id"])
+        return frame[key].reindex(result["run_id"])
+
+    hr_1, hr_2 = column(hr, ("mean", 1)), column(hr, ("mean", 2))
+    n_1, n_2 = column(hr, ("count", 1)).fillna(0), column(hr, ("count", 2)).fillna(0)
+    valid = (n_1 >= MIN_HALF_SAMPLES) & (n_2 >= MIN_HALF_SAMPLES)
+    hr_1, hr_2 = hr_1.where(valid), hr_2.where(valid)
+
+    # Both halves last (end - start) / 2
+    half_min = ((windows["end"] - windows["start"]).dt.total_seconds() / 120).to_numpy()
+    speed_1 = (column(dist, 1).to_numpy() / half_min)
+    speed_2 = (column(dist, 2).to_numpy() / half_min)
+    ef_1, ef_2 = speed_1 / hr_1.to_numpy(), speed_2 / hr_2.to_numpy()
+
+    result["hr_first"] = hr_1.to_numpy()
+    result["hr_second"] = hr_2.to_numpy()
+    result["speed_first"] = speed_1
+    result["speed_second"] = speed_2
+    result["decoupling_pct"] = (ef_1 - ef_2) / ef_1 * 100
+
+    steady_1, steady_2 = column(steady, ("mean", 1)), column(steady, ("mean", 2))
+    steady_valid = (column(steady, ("count", 1)).fillna(0) >= MIN_HALF_SAMPLES) & (column(steady, ("count", 2)).fillna(0) >= MIN_HALF_SAMPLES)
+    steady_1, steady_2 = steady_1.where(steady_valid).to_numpy(), steady_2.where(steady_valid).to_numpy()
+    result["hr_drift_pct"] = (steady_2 - steady_1) / steady_1 * 100
+    result["hr_samples"] = (n_1 + n_2).astype(int).to_numpy()
+    return result[RESULT_COLUMNS]
+
+
+def _slices(windows, samples, parts):
+    """Splits windows into parts and gives each the samples inside its time span."""
+    for index in np.array_split(np.arange(len(windows)), parts):
+        if not len(index):
+            continue
+        chunk = windows.iloc[index]
+        lo = samples["date"].searchsorted(chunk["start"].iloc[0], side="left")
+        hi = samples["date"].searchsorted(chunk["end"].max(), side="left")
+        yield chunk.reset_index(drop=True), samples.iloc[lo:hi].reset_index(drop=True)
+
+
+def compute_drift(windows, samples, workers=DRIFT_WORKERS):
+    """Drift for every window; split across `workers` processes when the batch is large enough."""
+    samples = samples.sort_values("date", ignore_index=True)
+    if workers <= 1 or len(windows) < PARALLEL_MIN_RUNS:
+        return window_stats(windows, samples)
+
+    parts = list(_slices(windows, samples, workers))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(window_stats, *zip(*parts)))
+    return pd.concat(results, ignore_index=True)
+
+
+def load_samples(session, start, end):
+    """HR and distance samples in [start, end), sorted by time."""
+    table = samples_table(start)
+    rows = session.execute(
+        select(table.c.date, table.c.type, table.c.value)
+        .where(table.c.type.in_([HR_TYPE, DISTANCE_TYPE]))
+        .where(table.c.date >= start, table.c.date < end)
+        .order_by(table.c.date)
+    ).all()
+    samples = pd.DataFrame(rows, columns=["date", "type", "value"])
+    samples["date"] = pd.to_datetime(samples["date"]).astype("datetime64[ns]")
+    return samples
+
+
+def _write(session, frame):
+    rows = frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+    insert = dialect_insert(session.connection())
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        stmt = insert(RunDrift).values(rows[start:start + INSERT_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["run_id"],
+            set_={c: stmt.excluded[c] for c in RESULT_COLUMNS[1:]},
+        )
+        session.execute(stmt)
+
+
+def update_run_drift(session, recompute=False, workers=DRIFT_WORKERS):
+    """
+    Computes drift for runs not yet in run_drift and recent runs cached
+    without HR samples (every run with recompute=True) and caches the
+    results. The caller commits.
+    Returns {"runs": computed, "with_hr": runs with enough HR data, "seconds": s}.
+    """
+    t0 = time.perf_counter()
+    query = select(Run.id, Run.date, Run.duration_min).where(Run.duration_min > 0)
+    if not recompute:
+        pending_since = datetime.now(timezone.utc) - timedelta(days=DRIFT_PENDING_DAYS)
+        query = query.outerjoin(RunDrift, RunDrift.run_id == Run.id).where(
+            RunDrift.run_id.is_(None) | ((RunDrift.hr_samples == 0) & (Run.date >= pending_since))
+        )
+    runs = pd.DataFrame(session.execute(query).all(), columns=["id", "date", "duration_min"])
+
+    windows = run_windows(runs)
+    stats = {"runs": len(windows), "with_hr": 0, "seconds": 0.0}
+    if windows.empty:
+        return stats
+
+    # One sample query per block of consecutive runs, then a single pass over the lot
+    blocks = []
+    for start in range(0, len(windows), RUNS_PER_QUERY):
+        block = windows.iloc[start:start + RUNS_PER_QUERY]
+        blocks.append(load_samples(session, block["start"].iloc[0].to_pydatetime(), block["end"].max().to_pydatetime()))
+    samples = pd.concat(blocks, ignore_index=True).drop_duplicates()
+
+    result = compute_drift(windows, samples, workers=workers)
+    _write(session, result)
+
+    stats["with_hr"] = int(result["hr_first"].notna().sum())
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    logger.info(f"Run drift computed: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    # python -m runlytics.analysis.drift [--recompute]
+    import sys
+    from runlytics.database.models import Base
+    from runlytics.database.manager import get_engine, session_scope
+
+    Base.metadata.create_all(bind=get_engine(), tables=[RunDrift.__table__])
+    with session_scope() as session:
+        stats = update_run_drift(session, recompute="--recompute" in sys.argv)
+    print(f"Run drift complete: {stats}")
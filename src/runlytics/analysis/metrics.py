@@ -0,0 +1,186 @@
+"""
+Training load: Banister TRIMP per run, then ATL (fatigue), CTL (fitness)
+and TSB (form) as exponentially weighted daily series.
+
+The series is stored in the training_load table, one row per day. Its
+last row is the engine's state: update() continues from it and only
+computes the days since (or since the earliest changed run), while
+compute()/rebuild() recompute the whole history in one vectorized pass,
+for backfills and after changing the parameters.
+"""
+import os
+import time
+import logging
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, delete
+
+from runlytics.database.models import Run, TrainingLoadDay
+from runlytics.database.bulk import dialect_insert, INSERT_CHUNK_SIZE
+
+logger = logging.getLogger("metrics")
+
+# Athlete parameters for TRIMP; changing them needs a rebuild()
+HR_REST = float(os.getenv("TRIMP_HR_REST", "50"))
+HR_MAX = float(os.getenv("TRIMP_HR_MAX", "190"))
+SEX = os.getenv("TRIMP_SEX", "male")
+
+# Banister's weighting: TRIMP = minutes * HRr * a * e^(b * HRr)
+TRIMP_WEIGHTS = {"male": (0.64, 1.92), "female": (0.86, 1.67)}
+
+# Time constants (days) of the fatigue and fitness curves
+ATL_DAYS = 7
+CTL_DAYS = 42
+
+SERIES_COLUMNS = ["day", "trimp", "atl", "ctl", "tsb"]
+
+
+def _ewma(values, alpha, initial):
+    """y[t] = y[t-1] + alpha * (x[t] - y[t-1]) starting from y[-1] = initial, in one pass."""
+    seeded = pd.Series(np.concatenate([[initial], values]))
+    return seeded.ewm(alpha=alpha, adjust=False).mean().to_numpy()[1:]
+
+
+class TrainingLoad:
+    def __init__(self, hr_rest=HR_REST, hr_max=HR_MAX, sex=SEX, atl_days=ATL_DAYS, ctl_days=CTL_DAYS):
+        if hr_max <= hr_rest:
+            raise ValueError("hr_max must be above hr_rest")
+        if sex not in TRIMP_WEIGHTS:
+            raise ValueError(f"Unknown sex '{sex}', expected one of {sorted(TRIMP_WEIGHTS)}")
+
+        self.hr_rest = hr_rest
+        self.hr_max = hr_max
+        self.weights = TRIMP_WEIGHTS[sex]
+        # Daily decay of each curve
+        self.atl_alpha = 1 - np.exp(-1 / atl_days)
+        self.ctl_alpha = 1 - np.exp(-1 / ctl_days)
+
+    def trimp(self, runs):
+        """TRIMP per run from avg_hr and duration_min (0 when either is missing)."""
+        a, b = self.weights
+        hr = pd.to_numeric(runs["avg_hr"], errors="coerce").to_numpy(dtype=float)
+        minutes = pd.to_numeric(runs["duration_min"], errors="coerce").to_numpy(dtype=float)
+
+        hrr = np.clip((hr - self.hr_rest) / (self.hr_max - self.hr_rest), 0, 1)
+        load = minutes * hrr * a * np.exp(b * hrr)
+        return np.nan_to_num(load, nan=0.0)
+
+    def daily_load(self, runs, start=None, end=None):
+        """Summed TRIMP per calendar day from start to end (inclusive), rest days as 0."""
+        # runs.date holds the run's local wall-clock start, so its date is the training day
+        days = pd.to_datetime(runs["date"], utc=True).dt.tz_localize(None).dt.normalize()
+        load = pd.Series(self.trimp(runs), index=days).groupby(level=0).sum()
+
+        start = pd.Timestamp(start) if start is not None else load.index.min()
+        end = pd.Timestamp(end) if end is not None else load.index.max()
+        if pd.isna(start) or pd.isna(end) or start > end:
+            return pd.Series(dtype=float, index=pd.DatetimeIndex([]))
+        return load.reindex(pd.date_range(start, end, freq="D"), fill_value=0.0)
+
+    def series(self, daily, atl=0.0, ctl=0.0):
+        """ATL/CTL/TSB for a daily load series, continuing from the previous day's atl/ctl."""
+        values = daily.to_numpy(dtype=float)
+        atl_series = _ewma(values, self.atl_alpha, atl)
+        ctl_series = _ewma(values, self.ctl_alpha, ctl)
+
+        # Form going into each day uses the previous day's curves
+        prev_atl = np.concatenate([[atl], atl_series])[:-1]
+        prev_ctl = np.concatenate([[ctl], ctl_series])[:-1]
+
+        return pd.DataFrame({
+            "day": daily.index.date,
+            "trimp": values,
+            "atl": atl_series,
+            "ctl": ctl_series,
+            "tsb": prev_ctl - prev_atl,
+        }, columns=SERIES_COLUMNS)
+
+    def compute(self, runs, end=None):
+        """Full-history series for a runs DataFrame (date, duration_min, avg_hr), through end (default today)."""
+        if runs.empty:
+            return pd.DataFrame(columns=SERIES_COLUMNS)
+        end = end or max(pd.Timestamp.now().normalize(), self.daily_load(runs).index.max())
+        return self.series(self.daily_load(runs, end=end))
+
+    # --- Database ---
+
+    def load_runs(self, session, since=None):
+        query = select(Run.date, Run.duration_min, Run.avg_hr)
+        if since is not None:
+            query = query.where(Run.date >= pd.Timestamp(since).tz_localize("UTC").to_pydatetime())
+        return pd.DataFrame(session.execute(query).all(), columns=["date", "duration_min", "avg_hr"])
+
+    def _write(self, session, frame):
+        rows = frame.to_dict(orient="records")
+        insert = dialect_insert(session.connection())
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            stmt = insert(TrainingLoadDay).values(rows[start:start + INSERT_CHUNK_SIZE])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["day"],
+                set_={c: stmt.excluded[c] for c in SERIES_COLUMNS[1:]},
+            )
+            session.execute(stmt)
+
+    def rebuild(self, session):
+        """Recomputes and stores the whole series. The caller commits."""
+        t0 = time.perf_counter()
+        frame = self.compute(self.load_runs(session))
+        session.execute(delete(TrainingLoadDay))
+        self._write(session, frame)
+
+        stats = {"mode": "rebuild", "days": len(frame), "seconds": round(time.perf_counter() - t0, 3)}
+        logger.info(f"Training load rebuilt: {stats}")
+        return stats
+
+    def update(self, session, since=None):
+        """
+        Extends the stored series to today, recomputing from the earlier of
+        the day after the last stored day and since (the earliest new or
+        changed run). Only those days are read and written. The caller commits.
+        """
+        t0 = time.perf_counter()
+        last = session.execute(
+            select(TrainingLoadDay).order_by(TrainingLoadDay.day.desc()).limit(1)
+        ).scalar()
+        if last is None:
+            return self.rebuild(session)
+
+        start = last.day + timedelta(days=1)
+        if since is not None:
+            start = min(start, pd.Timestamp(since).tz_localize(None).date())
+
+        previous = session.get(TrainingLoadDay, start - timedelta(days=1))
+        if previous is None:
+            # A run older than the stored history
+            return self.rebuild(session)
+
+        runs = self.load_runs(session, since=start)
+        end = pd.Timestamp.now().normalize()
+        if not runs.empty:
+            end = max(end, self.daily_load(runs).index.max())
+
+        daily = self.daily_load(runs, start=start, end=end)
+        frame = self.series(daily, atl=previous.atl, ctl=previous.ctl)
+        self._write(session, frame)
+
+        stats = {"mode": "incremental", "days": len(frame), "from": str(start), "seconds": round(time.perf_counter() - t0, 3)}
+        logger.info(f"Training load updated: {stats}")
+        return stats
+
+
+def update_training_load(session, run_dates=None):
+    """Incremental update after runs were written (run_dates: their start times)."""
+    since = min(run_dates) if run_dates else None
+    return TrainingLoad().update(session, since=since)
+
+
+if __name__ == "__main__":
+    from runlytics.database.models import Base
+    from runlytics.database.manager import get_engine, session_scope
+
+    Base.metadata.create_all(bind=get_engine(), tables=[TrainingLoadDay.__table__])
+    with session_scope() as session:
+        stats = TrainingLoad().rebuild(session)
+    print(f"Training load rebuild complete: {stats}")
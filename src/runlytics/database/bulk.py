@@ -0,0 +1,222 @@
+import io
+import time
+import logging
+import pandas as pd
+from sqlalchemy import insert, func, null, or_, cast, Text, JSON
+from sqlalchemy.dialects import postgresql, sqlite
+
+from runlytics.database.models import Biometric, Run
+
+logger = logging.getLogger("bulk")
+
+# Rows per COPY round trip (PostgreSQL + psycopg2)
+COPY_CHUNK_SIZE = 50_000
+
+# Rows per multi-row INSERT on other backends.
+# 5 columns x 1000 rows stays under SQLite's 32766 and Postgres' 65535 bind limits.
+INSERT_CHUNK_SIZE = 1_000
+
+BIOMETRIC_COLUMNS = ["date", "type", "value", "unit", "source"]
+CONFLICT_COLUMNS = ["date", "type", "source"]
+
+STAGE_TABLE = "biometrics_stage"
+
+# Runs are keyed on their start time (runs.date is UNIQUE)
+RUN_FIELDS = ["distance_km", "duration_min", "avg_hr", "max_hr", "energy_kcal", "source", "route_json"]
+
+# Field precedence when a run with the same date already exists:
+#   "incoming"          - overwrite with the new value
+#   "existing"          - keep the stored value
+#   "coalesce_incoming" - new value, unless it is NULL
+#   "coalesce_existing" - stored value, only filled in if it is NULL
+RUN_POLICIES = ("incoming", "existing", "coalesce_incoming", "coalesce_existing")
+
+# Apple Watch pushes refine a run as the export catches up, but shouldn't wipe fields with NULLs
+APPLE_HEALTH_RUN_POLICY = {field: "coalesce_incoming" for field in RUN_FIELDS}
+
+# Strava never touches a run that is already stored
+STRAVA_RUN_POLICY = {field: "existing" for field in RUN_FIELDS}
+
+CREATE_STAGE_SQL = f"""
+    CREATE TEMP TABLE IF NOT EXISTS {STAGE_TABLE} (
+        date timestamp, type text, value double precision, unit text, source text
+    ) ON COMMIT DROP
+"""
+
+COPY_SQL = f"COPY {STAGE_TABLE} ({', '.join(BIOMETRIC_COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+
+MERGE_SQL = f"""
+    INSERT INTO biometrics ({', '.join(BIOMETRIC_COLUMNS)})
+    SELECT {', '.join(BIOMETRIC_COLUMNS)} FROM {STAGE_TABLE}
+    ON CONFLICT ({', '.join(CONFLICT_COLUMNS)}) DO NOTHING
+"""
+
+
+def _records(frame):
+    """DataFrame -> list of row dicts, with NaN mapped to None."""
+    return frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+
+
+def supports_copy(connection):
+    """COPY needs PostgreSQL and a driver exposing copy_expert (psycopg2)."""
+    return connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2"
+
+
+def _copy_chunks(connection, frame, chunk_size):
+    """Streams the frame into the staging table chunk by chunk and merges each chunk."""
+    connection.exec_driver_sql(CREATE_STAGE_SQL)
+    cursor = connection.connection.cursor()
+    inserted = 0
+
+    try:
+        for start in range(0, len(frame), chunk_size):
+            buf = io.StringIO()
+            frame.iloc[start:start + chunk_size].to_csv(buf, header=False, index=False, na_rep="\\N")
+            buf.seek(0)
+            cursor.copy_expert(COPY_SQL, buf)
+
+            inserted += connection.exec_driver_sql(MERGE_SQL).rowcount
+            connection.exec_driver_sql(f"TRUNCATE {STAGE_TABLE}")
+    finally:
+        cursor.close()
+
+    return inserted
+
+
+def _insert_chunks(connection, frame, chunk_size):
+    """Fallback for backends without COPY: chunked multi-row INSERTs."""
+    dialect = connection.dialect.name
+    inserted = 0
+
+    for start in range(0, len(frame), chunk_size):
+        rows = _records(frame.iloc[start:start + chunk_size])
+
+        if dialect == "postgresql":
+            stmt = postgresql.insert(Biometric).values(rows).on_conflict_do_nothing(index_elements=CONFLICT_COLUMNS)
+        elif dialect == "sqlite":
+            stmt = sqlite.insert(Biometric).values(rows).on_conflict_do_nothing(index_elements=CONFLICT_COLUMNS)
+        else:
+            stmt = insert(Biometric).values(rows)
+
+        inserted += connection.execute(stmt).rowcount
+
+    return inserted
+
+
+def load_biometrics(session, rows, chunk_size=None):
+    """
+    Bulk-loads biometrics rows (DataFrame or list of dicts), skipping
+    existing (date, type, source) points. Runs inside the session's
+    transaction; the caller commits.
+    Returns a stats dict: rows, inserted, seconds, rows_per_sec, method.
+    """
+    frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows, columns=BIOMETRIC_COLUMNS)
+    frame = frame[BIOMETRIC_COLUMNS]
+
+    stats = {"rows": len(frame), "inserted": 0, "seconds": 0.0, "rows_per_sec": 0.0, "method": None}
+    if frame.empty:
+        return stats
+
+    connection = session.connection()
+    t0 = time.perf_counter()
+
+    if supports_copy(connection):
+        stats["method"] = "copy"
+        stats["inserted"] = _copy_chunks(connection, frame, chunk_size or COPY_CHUNK_SIZE)
+    else:
+        stats["method"] = "insert"
+        stats["inserted"] = _insert_chunks(connection, frame, chunk_size or INSERT_CHUNK_SIZE)
+
+    stats["seconds"] = time.perf_counter() - t0
+    stats["rows_per_sec"] = round(stats["rows"] / stats["seconds"], 1) if stats["seconds"] else 0.0
+
+    logger.info(
+        f"Loaded {stats['inserted']}/{stats['rows']} biometrics via {stats['method']} "
+        f"in {stats['seconds']:.2f}s ({stats['rows_per_sec']:.0f} rows/s)"
+    )
+    return stats
+
+
+def dialect_insert(connection):
+    """The INSERT construct with ON CONFLICT support for this backend."""
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert
+    if dialect == "sqlite":
+        return sqlite.insert
+    raise NotImplementedError(f"Upserts are not supported on the '{dialect}' backend")
+
+
+def _run_update_set(stmt, policy):
+    """Builds the ON CONFLICT DO UPDATE SET clause for a field-precedence policy."""
+    table = Run.__table__
+    set_ = {}
+    for field in RUN_FIELDS:
+        rule = policy.get(field, "incoming")
+        if rule not in RUN_POLICIES:
+            raise ValueError(f"Unknown run policy '{rule}' for field '{field}'")
+
+        if rule == "incoming":
+            set_[field] = stmt.excluded[field]
+        elif rule == "coalesce_incoming":
+            set_[field] = func.coalesce(stmt.excluded[field], table.c[field])
+        elif rule == "coalesce_existing":
+            set_[field] = func.coalesce(table.c[field], stmt.excluded[field])
+    return set_
+
+
+def _run_changed(set_):
+    """WHERE clause for ON CONFLICT DO UPDATE: only rows the SET would actually change."""
+    table = Run.__table__
+    changed = []
+    for field, value in set_.items():
+        column = table.c[field]
+        # Postgres has no equality operator for json; compare the serialised text
+        if isinstance(column.type, JSON):
+            column, value = cast(column, Text), cast(value, Text)
+        changed.append(column.is_distinct_from(value))
+    return or_(*changed)
+
+
+def upsert_runs(session, rows, policy=None, chunk_size=INSERT_CHUNK_SIZE):
+    """
+    Set-based upsert of runs keyed on runs.date: one
+    INSERT ... ON CONFLICT (date) DO UPDATE ... RETURNING per chunk
+    instead of a SELECT + INSERT per run. policy maps each field in
+    RUN_FIELDS to one of RUN_POLICIES (default "incoming").
+    Runs inside the session's transaction; the caller commits.
+    A resent run that would be left unchanged isn't rewritten.
+    Returns a stats dict: rows, written (inserted or changed) and dates
+    (start times of the written runs).
+    """
+    policy = policy or {}
+
+    # ON CONFLICT DO UPDATE can't touch the same row twice in one statement: last one wins
+    by_date = {}
+    for row in rows:
+        entry = {k: row.get(k) for k in ["date"] + RUN_FIELDS}
+        # JSON columns bind None as JSON 'null', which COALESCE treats as a value
+        if entry["route_json"] is None:
+            entry["route_json"] = null()
+        by_date[row["date"]] = entry
+    unique_rows = list(by_date.values())
+
+    stats = {"rows": len(unique_rows), "written": 0, "dates": []}
+    if not unique_rows:
+        return stats
+
+    connection = session.connection()
+    upsert_insert = dialect_insert(connection)
+
+    for start in range(0, len(unique_rows), chunk_size):
+        stmt = upsert_insert(Run).values(unique_rows[start:start + chunk_size])
+        set_ = _run_update_set(stmt, policy)
+        if set_:
+            stmt = stmt.on_conflict_do_update(index_elements=["date"], set_=set_, where=_run_changed(set_))
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=["date"])
+
+        stats["dates"].extend(connection.execute(stmt.returning(Run.date)).scalars())
+    stats["written"] = len(stats["dates"])
+
+    return stats
@@ -0,0 +1,404 @@
+"""
+Compact, dictionary-encoded storage for biometrics history.
+
+biometrics repeats type, unit and source as text on every row and carries
+two single-column indexes besides the unique key. With compact storage on,
+it only holds the last COMPACT_RETAIN_DAYS days (the ingest write path and
+what recent reads need); older samples live once per series:
+
+    biometric_series   (id, type, source, unit)     one row per (type, source)
+    biometric_points   (series_id, date, value)     primary key is the only index
+    biometric_blocks   (series_id, bucket, ...)     one row per series and day
+
+sync_compact() moves biometrics rows older than the retention window into
+biometric_points: each page is deleted with DELETE ... RETURNING and the
+returned rows written as points in the same transaction, so a row leaves
+biometrics only through the statement that hands it over. pack_blocks()
+then folds points older than PACK_AFTER_DAYS into daily blocks: offsets
+from midnight and values as two parallel arrays (Postgres compresses them
+out of line; JSON text on SQLite). Blocks keep min/max/sum so daily stats
+don't need decoding.
+
+Reading:
+  - the biometrics_compact view has the columns of biometrics over all
+    three tiers (recent rows, points and unnested blocks), so existing
+    queries over any date range only change the table name; a sample
+    stored in two tiers is read once, from the most recent one;
+    samples_table() picks biometrics or the view for a range;
+  - read_range() decodes blocks in Python, faster for long ranges.
+
+Set BIOMETRICS_COMPACT=1 to have /ingest move aged-out rows after each write.
+"""
+import os
+import time
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, delete, func, text, Table, MetaData, Column, DateTime, String, Float
+
+from runlytics.database.models import Base, Biometric, BiometricSeries, BiometricPoint, BiometricBlock
+from runlytics.database.bulk import dialect_insert, INSERT_CHUNK_SIZE
+
+logger = logging.getLogger("compact")
+
+COMPACT_ENABLED = os.getenv("BIOMETRICS_COMPACT", "0").lower() not in ("0", "false", "")
+
+# Days of samples kept in biometrics; keep it above the coach's 30-day window,
+# which reads biometrics directly
+RETAIN_DAYS = int(os.getenv("COMPACT_RETAIN_DAYS", "35"))
+
+# Points older than this many days are packed into blocks by pack_blocks()
+PACK_AFTER_DAYS = int(os.getenv("COMPACT_PACK_AFTER_DAYS", "42"))
+
+# Rows per DELETE ... RETURNING in sync_compact()
+MOVE_PAGE_SIZE = 50_000
+
+# Days of one series loaded per pack_blocks() step
+PACK_PAGE_DAYS = 31
+
+VIEW_NAME = "biometrics_compact"
+
+_SAMPLE_COLUMNS = "date, type, value, unit, source"
+# Each compact tier as samples plus their series (id and stored source, '' for none)
+_POINTS_SQL = """
+    SELECT p.date AS date, s.type AS type, p.value AS value, s.unit AS unit, s.source AS series_source, p.series_id AS series_id
+    FROM biometric_points p JOIN biometric_series s ON s.id = p.series_id
+"""
+# Blocks unnested back into samples, per dialect
+_BLOCKS_SQL = {
+    "postgresql": """
+    SELECT k.bucket + u.offset_us * INTERVAL '1 microsecond' AS date, s.type AS type, u.value AS value,
+           s.unit AS unit, s.source AS series_source, k.series_id AS series_id
+    FROM biometric_blocks k
+    JOIN biometric_series s ON s.id = k.series_id
+    CROSS JOIN LATERAL unnest(k.offsets_us, k.sample_values) AS u(offset_us, value)
+""",
+    # Same text format SQLAlchemy stores DateTime in, so range filters compare correctly
+    "sqlite": """
+    SELECT strftime('%Y-%m-%d %H:%M:%S', k.bucket, '+' || (o.value / 1000000) || ' seconds')
+           || '.' || printf('%06d', o.value % 1000000) AS date,
+           s.type AS type, v.value AS value, s.unit AS unit, s.source AS series_source, k.series_id AS series_id
+    FROM biometric_blocks k
+    JOIN biometric_series s ON s.id = k.series_id
+    JOIN json_each(k.offsets_us) o
+    JOIN json_each(k.sample_values) v ON v.key = o.key
+""",
+}
+
+# A sample stored in more than one tier (e.g. a backfill with dedup off re-inserts
+# compacted samples into biometrics) is read from the most recent tier only:
+# biometrics, then points, then blocks. Both probes are primary/unique key lookups.
+_IN_BIOMETRICS = "SELECT 1 FROM biometrics b WHERE b.date = t.date AND b.type = t.type AND COALESCE(b.source, '') = t.series_source"
+_IN_POINTS = "SELECT 1 FROM biometric_points p WHERE p.series_id = t.series_id AND p.date = t.date"
+_TIER_SQL = "SELECT date, type, value, unit, NULLIF(series_source, '') AS source FROM ({tier}) t WHERE {where}"
+
+# The view as a selectable with the biometrics columns (not part of Base, so create_all skips it)
+VIEW = Table(
+    VIEW_NAME, MetaData(),
+    Column("date", DateTime), Column("type", String), Column("value", Float), Column("unit", String), Column("source", String),
+)
+
+
+def view_sql(dialect):
+    if dialect not in _BLOCKS_SQL:
+        raise NotImplementedError(f"Compact storage is not supported on the '{dialect}' backend")
+    points = _TIER_SQL.format(tier=_POINTS_SQL, where=f"NOT EXISTS ({_IN_BIOMETRICS})")
+    blocks = _TIER_SQL.format(tier=_BLOCKS_SQL[dialect], where=f"NOT EXISTS ({_IN_BIOMETRICS}) AND NOT EXISTS ({_IN_POINTS})")
+    return f"CREATE VIEW {VIEW_NAME} AS SELECT {_SAMPLE_COLUMNS} FROM biometrics UNION ALL {points} UNION ALL {blocks}"
+
+
+def retention_cutoff():
+    """Midnight RETAIN_DAYS ago: biometrics holds every sample from here on."""
+    return (pd.Timestamp.now().normalize() - pd.Timedelta(days=RETAIN_DAYS)).to_pydatetime()
+
+
+def samples_table(start=None):
+    """
+    Table to read raw samples dated from `start` (None: any date) from:
+    biometrics, or the biometrics_compact view when compact storage is on
+    and the range reaches past the retention window.
+    """
+    if COMPACT_ENABLED and (start is None or pd.Timestamp(start).tz_localize(None) < pd.Timestamp(retention_cutoff())):
+        return VIEW
+    return Biometric.__table__
+
+
+# --- Block arrays ---
+
+def encode_block(bucket, times, values):
+    """Sorted timestamps (datetime64) and values of one day -> (offsets in us since bucket, values) lists."""
+    t = np.asarray(times, dtype="datetime64[us]").astype(np.int64)
+    if not len(t):
+        raise ValueError("Cannot encode an empty block")
+    offsets = t - pd.Timestamp(bucket).to_datetime64().astype("datetime64[us]").astype(np.int64)
+    v = np.asarray(values, dtype=float)
+    return offsets.tolist(), [None if np.isnan(x) else x for x in v.tolist()]
+
+
+def decode_block(bucket, offsets, values):
+    """Block arrays -> (datetime64[us] times, float64 values, NaN where missing)."""
+    start = pd.Timestamp(bucket).to_datetime64().astype("datetime64[us]").astype(np.int64)
+    times = (start + np.asarray(offsets, dtype=np.int64)).astype("datetime64[us]")
+    return times, np.array(values, dtype=float)
+
+
+# --- Schema ---
+
+def create_compact_storage(engine):
+    """Creates the compact tables if missing and (re)creates the biometrics_compact view."""
+    Base.metadata.create_all(bind=engine, tables=[
+        BiometricSeries.__table__, BiometricPoint.__table__, BiometricBlock.__table__,
+    ])
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP VIEW IF EXISTS {VIEW_NAME}"))
+        connection.execute(text(view_sql(engine.dialect.name)))
+
+
+# --- Writing ---
+
+def series_ids(session, frame):
+    """{(type, source): id} for the series in a frame (type, source, unit), registering new ones."""
+    keys = frame[["type", "source", "unit"]].drop_duplicates(["type", "source"])
+    rows = keys.astype(object).where(keys.notna(), None).to_dict(orient="records")
+    if rows:
+        stmt = dialect_insert(session.connection())(BiometricSeries).values(rows)
+        session.execute(stmt.on_conflict_do_nothing(index_elements=["type", "source"]))
+
+    ids = {}
+    types = keys["type"].unique().tolist()
+    for start in range(0, len(types), INSERT_CHUNK_SIZE):
+        result = session.execute(
+            select(BiometricSeries.type, BiometricSeries.source, BiometricSeries.id)
+            .where(BiometricSeries.type.in_(types[start:start + INSERT_CHUNK_SIZE]))
+        )
+        ids.update({(t, s): i for t, s, i in result})
+    return ids
+
+
+def write_points(session, rows):
+    """
+    Writes biometrics-shaped rows (DataFrame or list of dicts) straight into
+    the compact points, skipping existing (series, date). The caller commits.
+    """
+    frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows, columns=["date", "type", "value", "unit", "source"])
+    frame = frame.dropna(subset=["date", "type"]).assign(source=lambda f: f["source"].fillna(""))
+    if frame.empty:
+        return {"rows": 0, "inserted": 0}
+
+    ids = series_ids(session, frame)
+    points = pd.DataFrame({
+        "series_id": [ids[k] for k in zip(frame["type"], frame["source"])],
+        "date": pd.to_datetime(frame["date"]),
+        "value": frame["value"],
+    })
+    records = points.astype(object).where(points.notna(), None).to_dict(orient="records")
+
+    # One cached statement, executemany'd, instead of compiling a VALUES list per chunk
+    connection = session.connection()
+    stmt = dialect_insert(connection)(BiometricPoint.__table__).on_conflict_do_nothing(index_elements=["series_id", "date"])
+    inserted = 0
+    for start in range(0, len(records), INSERT_CHUNK_SIZE):
+        inserted += max(connection.execute(stmt, records[start:start + INSERT_CHUNK_SIZE]).rowcount, 0)
+    return {"rows": len(records), "inserted": inserted}
+
+
+def sync_compact(session, before=None):
+    """
+    Moves biometrics rows dated before `before` (default: retention_cutoff())
+    into biometric_points, MOVE_PAGE_SIZE rows per DELETE ... RETURNING.
+    The caller commits. Returns {"rows": moved, "inserted": new points, "seconds": s}.
+    """
+    t0 = time.perf_counter()
+    cutoff = pd.Timestamp(before).to_pydatetime() if before is not None else retention_cutoff()
+    table = Biometric.__table__
+    stats = {"rows": 0, "inserted": 0, "seconds": 0.0}
+
+    while True:
+        page = select(table.c.id).where(table.c.date < cutoff, table.c.type.is_not(None)).limit(MOVE_PAGE_SIZE)
+        moved = session.execute(
+            delete(table).where(table.c.id.in_(page.scalar_subquery()))
+            .returning(table.c.date, table.c.type, table.c.value, table.c.unit, table.c.source)
+        ).all()
+        if not moved:
+            break
+        written = write_points(session, pd.DataFrame(moved, columns=["date", "type", "value", "unit", "source"]))
+        stats["rows"] += len(moved)
+        stats["inserted"] += written["inserted"]
+        if len(moved) < MOVE_PAGE_SIZE:
+            break
+
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    if stats["rows"]:
+        logger.info(f"Compact biometrics synced: {stats}")
+    return stats
+
+
+def _block_row(series_id, bucket, times, values):
+    offsets, sample_values = encode_block(bucket, times, values)
+    finite = np.isfinite(values)
+    return {
+        "series_id": int(series_id),
+        "bucket": bucket.to_pydatetime(),
+        "samples": len(times),
+        "first_date": pd.Timestamp(times[0]).to_pydatetime(),
+        "last_date": pd.Timestamp(times[-1]).to_pydatetime(),
+        "value_min": float(np.nanmin(values)) if finite.any() else None,
+        "value_max": float(np.nanmax(values)) if finite.any() else None,
+        "value_sum": float(np.nansum(values)),
+        "offsets_us": offsets,
+        "sample_values": sample_values,
+    }
+
+
+def _pack_page(session, series_id, lo, hi):
+    """Packs one series' points in [lo, hi) into daily blocks, merging with stored blocks. Returns (points, blocks)."""
+    points = pd.DataFrame(
+        session.execute(
+            select(BiometricPoint.date, BiometricPoint.value)
+            .where(BiometricPoint.series_id == series_id, BiometricPoint.date >= lo, BiometricPoint.date < hi)
+            .order_by(BiometricPoint.date)
+        ).all(),
+        columns=["date", "value"],
+    )
+    if points.empty:
+        return 0, 0
+    points["date"] = pd.to_datetime(points["date"]).astype("datetime64[us]")
+    points["value"] = pd.to_numeric(points["value"]).astype(float)
+    points["bucket"] = points["date"].dt.normalize()
+
+    # Late points for a day that is already packed are merged into its block
+    buckets = [b.to_pydatetime() for b in points["bucket"].unique()]
+    existing = {
+        pd.Timestamp(block.bucket): decode_block(block.bucket, block.offsets_us, block.sample_values)
+        for block in session.execute(
+            select(BiometricBlock.bucket, BiometricBlock.offsets_us, BiometricBlock.sample_values)
+            .where(BiometricBlock.series_id == series_id, BiometricBlock.bucket.in_(buckets))
+        )
+    }
+
+    rows = []
+    for bucket, group in points.groupby("bucket", sort=False):
+        times, values = group["date"].to_numpy(), group["value"].to_numpy()
+        if bucket in existing:
+            old_times, old_values = existing[bucket]
+            merged = pd.Series(np.concatenate([old_values, values]), index=np.concatenate([old_times, times]))
+            # A stored point wins over a re-sent one, as in biometrics
+            merged = merged[~merged.index.duplicated(keep="first")].sort_index()
+            times, values = merged.index.to_numpy(), merged.to_numpy()
+        rows.append(_block_row(series_id, bucket, times, values))
+
+    insert = dialect_insert(session.connection())
+    # Block rows are large; keep statements small
+    for start in range(0, len(rows), 100):
+        stmt = insert(BiometricBlock).values(rows[start:start + 100])
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=["series_id", "bucket"],
+            set_={c: stmt.excluded[c] for c in ("samples", "first_date", "last_date", "value_min", "value_max", "value_sum", "offsets_us", "sample_values")},
+        ))
+    session.execute(delete(BiometricPoint).where(
+        BiometricPoint.series_id == series_id, BiometricPoint.date >= lo, BiometricPoint.date < hi,
+    ))
+    return len(points), len(rows)
+
+
+def pack_blocks(session, before=None):
+    """
+    Moves points dated before `before` (default: PACK_AFTER_DAYS ago,
+    midnight) into daily blocks, PACK_PAGE_DAYS of one series at a time.
+    The caller commits. Returns {"points": moved, "blocks": written, "seconds": s}.
+    """
+    t0 = time.perf_counter()
+    before = pd.Timestamp(before) if before is not None else pd.Timestamp.now().normalize() - pd.Timedelta(days=PACK_AFTER_DAYS)
+    cutoff = before.to_pydatetime()
+    stats = {"points": 0, "blocks": 0, "seconds": 0.0}
+
+    oldest = session.execute(
+        select(BiometricPoint.series_id, func.min(BiometricPoint.date))
+        .where(BiometricPoint.date < cutoff)
+        .group_by(BiometricPoint.series_id)
+    ).all()
+    for series_id, first in oldest:
+        lo = pd.Timestamp(first).normalize()
+        while lo < before:
+            hi = min(lo + pd.Timedelta(days=PACK_PAGE_DAYS), before)
+            points, blocks = _pack_page(session, series_id, lo.to_pydatetime(), hi.to_pydatetime())
+            stats["points"] += points
+            stats["blocks"] += blocks
+            lo = hi
+
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    logger.info(f"Compact blocks packed: {stats}")
+    return stats
+
+
+# --- Reading ---
+
+def read_range(session, metric_type, start, end, source=None):
+    """
+    Samples of metric_type in [start, end) from all three tiers, sorted,
+    as a DataFrame with the biometrics columns (date, type, value, unit, source).
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    query = select(BiometricSeries.id, BiometricSeries.source, BiometricSeries.unit).where(BiometricSeries.type == metric_type)
+    if source is not None:
+        query = query.where(BiometricSeries.source == (source or ""))
+    series = {s.id: s for s in session.execute(query)}
+
+    columns = ["date", "type", "value", "unit", "source"]
+    parts = []
+    if series:
+        blocks = session.execute(
+            select(BiometricBlock.series_id, BiometricBlock.bucket, BiometricBlock.offsets_us, BiometricBlock.sample_values)
+            .where(BiometricBlock.series_id.in_(list(series)))
+            .where(BiometricBlock.bucket >= start.normalize().to_pydatetime(), BiometricBlock.bucket < end.to_pydatetime())
+        ).all()
+        for block in blocks:
+            times, values = decode_block(block.bucket, block.offsets_us, block.sample_values)
+            lo, hi = np.searchsorted(times, start.to_datetime64(), "left"), np.searchsorted(times, end.to_datetime64(), "left")
+            parts.append(pd.DataFrame({"series_id": block.series_id, "date": times[lo:hi], "value": values[lo:hi]}))
+
+        points = session.execute(
+            select(BiometricPoint.series_id, BiometricPoint.date, BiometricPoint.value)
+            .where(BiometricPoint.series_id.in_(list(series)))
+            .where(BiometricPoint.date >= start.to_pydatetime(), BiometricPoint.date < end.to_pydatetime())
+        ).all()
+        if points:
+            parts.append(pd.DataFrame(points, columns=["series_id", "date", "value"]))
+
+    frame = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["series_id", "date", "value"])
+    frame["type"] = metric_type
+    frame["unit"] = frame["series_id"].map({i: s.unit for i, s in series.items()})
+    frame["source"] = frame["series_id"].map({i: s.source or None for i, s in series.items()})
+
+    # Rows still inside the retention window (or not yet moved)
+    table = Biometric.__table__
+    recent = select(table.c.date, table.c.value, table.c.unit, table.c.source).where(
+        table.c.type == metric_type, table.c.date >= start.to_pydatetime(), table.c.date < end.to_pydatetime(),
+    )
+    if source is not None:
+        recent = recent.where(table.c.source == source) if source else recent.where(table.c.source.is_(None))
+    rows = session.execute(recent).all()
+    if rows:
+        frame = pd.concat([frame, pd.DataFrame(rows, columns=["date", "value", "unit", "source"]).assign(type=metric_type)], ignore_index=True)
+
+    if frame.empty:
+        return pd.DataFrame(columns=columns)
+    frame["date"] = pd.to_datetime(frame["date"]).astype("datetime64[us]")
+    # Tiers were added oldest first: a sample stored twice keeps its most recent copy, as in the view
+    frame = frame.drop_duplicates(["date", "source"], keep="last")
+    return frame.sort_values("date", kind="stable", ignore_index=True)[columns]
+
+
+if __name__ == "__main__":
+    # python -m runlytics.database.compact [sync|pack]
+    import sys
+    from runlytics.database.manager import get_engine, session_scope
+
+    create_compact_storage(get_engine())
+    command = sys.argv[1] if len(sys.argv) > 1 else "sync"
+    with session_scope() as session:
+        stats = sync_compact(session)
+        if command == "pack":
+            stats = {"sync": stats, "pack": pack_blocks(session)}
+    print(f"Compact storage {command} complete: {stats}")
@@ -1,13 +1,172 @@
 import os
-from sqlalchemy import create_engine
+import time
+import threading
+from contextlib import contextmanager
+from sqlalchemy import create_engine, exc
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
-def get_db_session():
-    """Returns a new DB session based on .env configuration."""
+# --- POOL CONFIG ---
+# One pool per process against one Supabase instance; keep it small,
+# the Supabase pooler limits total client connections.
+# Read when the engine is first created, so values from .env apply.
+def _pool_options():
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "3")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "2")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1").lower() not in ("0", "false"),
+    }
+
+
+_engines = {}
+_sessionmakers = {}
+_lock = threading.Lock()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def __init__(self, *args, max_overflow=10, **kwargs):
+        super().__init__(*args, max_overflow=max_overflow, **kwargs)
+        # QueuePool keeps this private; pool_stats() reports the configured value
+        self.max_overflow = max_overflow
+        self.checkout_stats = {"checkouts": 0, "timeouts": 0, "wait_total_s": 0.0, "wait_max_s": 0.0}
+        # Checkouts run on many threads at once
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            # Pool exhausted for pool_timeout seconds
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - t0
+            with self._stats_lock:
+                stats = self.checkout_stats
+                stats["checkouts"] += 1
+                stats["timeouts"] += timed_out
+                stats["wait_total_s"] += waited
+                stats["wait_max_s"] = max(stats["wait_max_s"], waited)
+
+    def checkout_snapshot(self):
+        """A consistent copy of checkout_stats."""
+        with self._stats_lock:
+            return dict(self.checkout_stats)
+
+    def recreate(self):
+        # Keep the counters when SQLAlchemy swaps the pool (e.g. after dispose())
+        pool = super().recreate()
+        pool.checkout_stats, pool._stats_lock = self.checkout_stats, self._stats_lock
+        return pool
+
+
+def get_database_url():
+    """Reads DATABASE_URL and applies the SSL requirement for Postgres."""
     db_url = os.getenv("DATABASE_URL")
     if not db_url:
         raise ValueError("DATABASE_URL not set in .env")
-        
-    engine = create_engine(db_url)
-    Session = sessionmaker(bind=engine)
-    return Session()
\ No newline at end of file
+
+    # Render/Supabase require SSL; set DB_SSLMODE= (empty) for a local Postgres
+    sslmode = os.getenv("DB_SSLMODE", "require")
+    if sslmode and db_url.startswith("postgres") and "sslmode" not in db_url:
+        db_url += ("&" if "?" in db_url else "?") + f"sslmode={sslmode}"
+    return db_url
+
+
+def is_configured():
+    return bool(os.getenv("DATABASE_URL"))
+
+
+def get_engine(db_url=None):
+    """Returns the process-wide engine for db_url (default: DATABASE_URL), creating it on first use."""
+    db_url = db_url or get_database_url()
+
+    engine = _engines.get(db_url)
+    if engine is not None:
+        return engine
+
+    with _lock:
+        if db_url not in _engines:
+            if db_url.startswith("sqlite"):
+                # SQLite (tests/benchmarks) keeps SQLAlchemy's default pool
+                _engines[db_url] = create_engine(db_url)
+            else:
+                _engines[db_url] = create_engine(db_url, poolclass=TimedQueuePool, **_pool_options())
+            _sessionmakers[db_url] = sessionmaker(autocommit=False, autoflush=False, bind=_engines[db_url])
+        return _engines[db_url]
+
+
+def get_sessionmaker(db_url=None):
+    db_url = db_url or get_database_url()
+    get_engine(db_url)
+    return _sessionmakers[db_url]
+
+
+def get_db_session():
+    """Returns a new DB session based on .env configuration."""
+    return get_sessionmaker()()
+
+
+@contextmanager
+def session_scope(db_url=None):
+    """
+    Session bound to the shared engine.
+    Commits on success, rolls back on error, always returns the connection to the pool.
+    """
+    session = get_sessionmaker(db_url)()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def pool_stats():
+    """Checkout latency and saturation for every engine created in this process."""
+    stats = {}
+    for db_url, engine in list(_engines.items()):
+        pool = engine.pool
+        entry = {"pool": type(pool).__name__}
+
+        if isinstance(pool, TimedQueuePool):
+            capacity = pool.size() + max(pool.max_overflow, 0)
+            entry.update({
+                "size": pool.size(),
+                "max_overflow": pool.max_overflow,
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "saturation": round(pool.checkedout() / capacity, 3) if capacity else 0.0,
+            })
+
+        checkout = pool.checkout_snapshot() if isinstance(pool, TimedQueuePool) else None
+        if checkout:
+            count = checkout["checkouts"]
+            entry.update({
+                "checkouts": count,
+                "checkout_timeouts": checkout["timeouts"],
+                "checkout_wait_avg_ms": round(checkout["wait_total_s"] / count * 1000, 3) if count else 0.0,
+                "checkout_wait_max_ms": round(checkout["wait_max_s"] * 1000, 3),
+            })
+
+        # Never expose credentials
+        stats[engine.url.render_as_string(hide_password=True)] = entry
+    return stats
+
+
+def dispose_engines():
+    """Closes every pool (e.g. after fork or in tests)."""
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _sessionmakers.clear()
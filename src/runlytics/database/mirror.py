@@ -0,0 +1,258 @@
+"""
+Local analytical mirror of the warehouse.
+
+export_all() copies biometrics, runs and daily_journal from Postgres into
+Hive-partitioned Parquet under MIRROR_DIR (biometrics by type and month,
+the others by month). LocalWarehouse exposes the mirror as DuckDB views
+with the same table names, so analysis queries run locally.
+"""
+import os
+import re
+import json
+import shutil
+import uuid
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from runlytics.database.manager import get_engine
+
+try:
+    import duckdb
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # Optional analytics extras; the webhook doesn't need them
+    duckdb = pa = ds = pq = None
+
+logger = logging.getLogger("mirror")
+
+MIRROR_DIR = Path(os.getenv("MIRROR_DIR", "data/mirror"))
+STATE_FILE = "_state.json"
+
+# Rows pulled from Postgres per round trip
+EXPORT_CHUNK_SIZE = 100_000
+
+# Ingest jobs commit out of id order, so each incremental biometrics export
+# re-reads this many ids below the last one mirrored and skips the ones
+# already in the mirror
+EXPORT_OVERLAP_IDS = int(os.getenv("MIRROR_OVERLAP_IDS", "200000"))
+
+# table -> (select, partition columns)
+# runs and daily_journal are a few thousand rows; one file each beats
+# hundreds of tiny monthly files (they still get a 'month' column).
+TABLES = {
+    "biometrics": ("SELECT id, date, type, value, unit, source FROM biometrics", ["type", "month"]),
+    "runs": (
+        "SELECT id, date, distance_km, duration_min, avg_hr, max_hr, energy_kcal, source, route_json, created_at FROM runs",
+        [],
+    ),
+    "daily_journal": ("SELECT * FROM daily_journal", []),
+}
+
+
+def _require_extras():
+    if duckdb is None:
+        raise ImportError("duckdb and pyarrow are required for the local mirror")
+
+
+def load_state(root=MIRROR_DIR):
+    path = Path(root) / STATE_FILE
+    if path.exists():
+        return json.loads(path.read_text())
+    return {}
+
+
+def save_state(state, root=MIRROR_DIR):
+    path = Path(root) / STATE_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=2))
+    tmp.replace(path)
+
+
+def _prepare(df):
+    """Adds the month partition column and makes object columns Parquet-friendly."""
+    df = df.copy()
+    dates = pd.to_datetime(df["date"], errors="coerce", utc=df["date"].dtype == object)
+    df["month"] = dates.dt.strftime("%Y-%m").fillna("unknown")
+    if "route_json" in df:
+        # Mixed lists/dicts: store the raw JSON text
+        df["route_json"] = df["route_json"].map(lambda v: None if v is None else json.dumps(v))
+    return df
+
+
+def _mirrored_ids(directory, above):
+    """Ids above `above` already in the Parquet dataset at directory."""
+    if not directory.exists() or not any(directory.rglob("*.parquet")):
+        return np.empty(0, dtype=np.int64)
+    dataset = ds.dataset(directory, format="parquet", partitioning="hive")
+    ids = dataset.to_table(columns=["id"], filter=ds.field("id") > above).column("id")
+    return ids.to_numpy().astype(np.int64)
+
+
+def _publish(staging, directory):
+    """Moves the part files written under staging into directory, keeping their partition paths."""
+    for part in sorted(staging.rglob("*.parquet")):
+        destination = directory / part.relative_to(staging)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        part.replace(destination)
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def _write(df, directory, partitions):
+    """Appends df as new part files into the Hive-partitioned dataset at directory."""
+    table = pa.Table.from_pandas(_prepare(df), preserve_index=False)
+    ds.write_dataset(
+        table,
+        directory,
+        format="parquet",
+        partitioning=partitions or None,
+        partitioning_flavor="hive" if partitions else None,
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def export_table(name, engine=None, root=MIRROR_DIR, full=False):
+    """
+    Mirrors one table. biometrics is append-only, so it is exported
+    incrementally from EXPORT_OVERLAP_IDS below the last mirrored id,
+    skipping rows already mirrored; runs and daily_journal are small and
+    can be updated in place, so they are re-snapshotted.
+    New files are written next to the mirror and moved in before the state
+    is saved; an export interrupted in between is deduplicated by the next.
+    Returns the number of rows written.
+    """
+    _require_extras()
+    engine = engine or get_engine()
+    query, partitions = TABLES[name]
+    directory = Path(root) / name
+    state = load_state(root)
+    incremental = name == "biometrics" and not full
+
+    if incremental:
+        last_id = state.get(name, {}).get("last_id", 0)
+        floor = max(last_id - EXPORT_OVERLAP_IDS, 0)
+        query = f"{query} WHERE id > :floor ORDER BY id"
+        params = {"floor": floor}
+        mirrored = _mirrored_ids(directory, floor)
+        # New part files are moved into the live mirror once they are all written
+        target = directory.with_name(f"{name}.staging")
+    else:
+        last_id = 0
+        params = {}
+        mirrored = None
+        # Build the snapshot next to the live one, then swap
+        target = directory.with_name(f"{name}.tmp")
+    shutil.rmtree(target, ignore_errors=True)
+
+    rows = 0
+    with engine.connect() as conn:
+        for chunk in pd.read_sql(text(query), conn, params=params, chunksize=EXPORT_CHUNK_SIZE):
+            if "id" in chunk and not chunk.empty:
+                last_id = max(last_id, int(chunk["id"].max()))
+            if mirrored is not None:
+                chunk = chunk[~np.isin(chunk["id"].to_numpy(), mirrored)]
+            if chunk.empty:
+                continue
+            _write(chunk, target, partitions)
+            rows += len(chunk)
+
+    if incremental:
+        _publish(target, directory)
+    else:
+        shutil.rmtree(directory, ignore_errors=True)
+        if target.exists():
+            target.rename(directory)
+
+    state[name] = {"last_id": last_id, "rows_last_export": rows}
+    save_state(state, root)
+    logger.info(f"Mirrored {rows} {name} rows -> {directory}")
+    return rows
+
+
+def export_all(engine=None, root=MIRROR_DIR, full=False):
+    """Mirrors every table that exists upstream. Returns {table: rows written}."""
+    engine = engine or get_engine()
+    existing = set(inspect(engine).get_table_names())
+    return {
+        name: export_table(name, engine=engine, root=root, full=full)
+        for name in TABLES if name in existing
+    }
+
+
+def compact(name="biometrics", root=MIRROR_DIR):
+    """
+    Merges the part files that incremental exports leave in each partition
+    into one file per partition. Returns the number of partitions rewritten.
+    """
+    _require_extras()
+    rewritten = 0
+    for partition in sorted({p.parent for p in (Path(root) / name).rglob("*.parquet")}):
+        files = sorted(partition.glob("*.parquet"))
+        if len(files) < 2:
+            continue
+        # Partition values live in the path, not in the files
+        table = pa.concat_tables([pq.read_table(f) for f in files], promote_options="default")
+        merged = partition / f"part-{uuid.uuid4().hex}-0.parquet"
+        pq.write_table(table, merged)
+        for f in files:
+            f.unlink()
+        rewritten += 1
+    return rewritten
+
+
+class LocalWarehouse:
+    """
+    DuckDB over the Parquet mirror. Exposes biometrics, runs and
+    daily_journal as views, so the same SQL used against Postgres works
+    here (plus the 'month' partition column).
+    """
+
+    def __init__(self, root=MIRROR_DIR):
+        _require_extras()
+        self.root = Path(root)
+        self.con = duckdb.connect()
+        self.tables = []
+        self.refresh()
+
+    def refresh(self):
+        """(Re)creates the views, picking up files written since the last call."""
+        for name in TABLES:
+            files = list((self.root / name).rglob("*.parquet")) if (self.root / name).exists() else []
+            if not files:
+                continue
+            glob = (self.root / name / "**" / "*.parquet").as_posix()
+            self.con.execute(
+                f"CREATE OR REPLACE VIEW {name} AS "
+                f"SELECT * FROM read_parquet('{glob}', hive_partitioning = true, union_by_name = true)"
+            )
+            if name not in self.tables:
+                self.tables.append(name)
+
+    def query(self, sql, params=None):
+        """
+        Runs sql and returns a DataFrame. Named parameters may be written
+        :name, as in the SQLAlchemy text() queries used against Postgres.
+        """
+        if isinstance(params, dict):
+            sql = re.sub(r"(?<![:\w]):(\w+)", r"$\1", sql)
+        return self.con.execute(sql, params or []).df()
+
+    def close(self):
+        self.con.close()
+
+
+if __name__ == "__main__":
+    import sys
+    from runlytics.utils.logger import configure_logging
+
+    configure_logging()
+    counts = export_all(full="--full" in sys.argv)
+    if "--compact" in sys.argv:
+        print(f"Compacted {compact()} biometrics partitions")
+    print(f"Mirror export complete: {counts}")
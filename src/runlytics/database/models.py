@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, BigInteger, JSON
+from sqlalchemy import Column, Integer, String, Text, Float, Date, DateTime, BigInteger, JSON, ARRAY, UniqueConstraint
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.sql import func
 
@@ -8,7 +8,8 @@ class Run(Base):
     __tablename__ = "runs"
 
     # Explicitly setting autoincrement=True for BigInteger
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    # (SQLite only autoincrements INTEGER PRIMARY KEY, used for local runs/benchmarks)
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
     
     date = Column(DateTime(timezone=True), unique=True, nullable=False)
     distance_km = Column(Float)
@@ -22,10 +23,171 @@ class Run(Base):
 
 class Biometric(Base):
     __tablename__ = 'biometrics'
+    # Target of ON CONFLICT (date, type, source) DO NOTHING in the ingest path
+    __table_args__ = (UniqueConstraint('date', 'type', 'source', name='uq_biometrics_date_type_source'),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     date = Column(DateTime, index=True)
     type = Column(String, index=True)
     value = Column(Float)
     unit = Column(String)
-    source = Column(String)
\ No newline at end of file
+    source = Column(String)
+
+class SyncState(Base):
+    """Per-source incremental sync progress (one row per upstream source)."""
+    __tablename__ = "sync_state"
+
+    source = Column(String, primary_key=True)
+    watermark = Column(DateTime(timezone=True))  # newest upstream timestamp already synced
+    last_synced_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class SyncedActivity(Base):
+    """Upstream ids already synced per source (e.g. Strava activity ids), for indexed dedup."""
+    __tablename__ = "synced_activities"
+
+    source = Column(String, primary_key=True)
+    external_id = Column(String, primary_key=True)
+    date = Column(DateTime(timezone=True))
+
+class DailyJournal(Base):
+    """One subjective training log entry per day, synced from the Google Sheet (runlytics.ingestion.journal_ingest)."""
+    __tablename__ = "daily_journal"
+
+    date = Column(Date, primary_key=True)
+    rpe = Column(Float)
+    mood = Column(Float)
+    soreness = Column(Float)
+    knee_pain = Column(Float)
+    sleep_quality = Column(Float)
+    notes = Column(Text)
+
+class JournalRowHash(Base):
+    """Content hash of each synced journal entry; unchanged sheet rows are never rewritten."""
+    __tablename__ = "journal_row_hashes"
+
+    date = Column(Date, primary_key=True)  # daily_journal.date
+    content_hash = Column(String(16), nullable=False)
+    synced_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class BiometricDaily(Base):
+    """Per-type daily aggregate of biometrics, kept current by runlytics.database.rollups."""
+    __tablename__ = "biometric_daily"
+
+    type = Column(String, primary_key=True)
+    day = Column(DateTime, primary_key=True)  # midnight, same clock as biometrics.date
+    samples = Column(Integer, nullable=False)
+    value_sum = Column(Float)
+    value_min = Column(Float)
+    value_max = Column(Float)
+    value_mean = Column(Float)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class BiometricHourly(Base):
+    """Hourly aggregate for high-frequency types (heart rate, steps, energy)."""
+    __tablename__ = "biometric_hourly"
+
+    type = Column(String, primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    samples = Column(Integer, nullable=False)
+    value_sum = Column(Float)
+    value_min = Column(Float)
+    value_max = Column(Float)
+    value_mean = Column(Float)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class TrainingLoadDay(Base):
+    """Daily TRIMP and ATL/CTL/TSB series, maintained by runlytics.analysis.metrics."""
+    __tablename__ = "training_load"
+
+    day = Column(Date, primary_key=True)
+    trimp = Column(Float, nullable=False)  # summed over the day's runs
+    atl = Column(Float, nullable=False)    # acute load (fatigue), after the day
+    ctl = Column(Float, nullable=False)    # chronic load (fitness), after the day
+    tsb = Column(Float, nullable=False)    # form going into the day: yesterday's CTL - ATL
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class RunDrift(Base):
+    """Per-run aerobic decoupling / HR drift, cached by runlytics.analysis.drift."""
+    __tablename__ = "run_drift"
+
+    run_id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)  # runs.id
+    hr_first = Column(Float)         # mean HR, first half of the run
+    hr_second = Column(Float)
+    speed_first = Column(Float)      # distance per minute per half (None without distance samples)
+    speed_second = Column(Float)
+    decoupling_pct = Column(Float)   # Pa:HR decoupling, (EF1 - EF2) / EF1 * 100
+    hr_drift_pct = Column(Float)     # (HR2 - HR1) / HR1 * 100
+    hr_samples = Column(Integer, nullable=False)
+    computed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class RouteShape(Base):
+    """Douglas-Peucker simplified route per zoom level, as an encoded polyline (runlytics.processing.gis)."""
+    __tablename__ = "route_shapes"
+
+    run_id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)  # runs.id
+    zoom = Column(Integer, primary_key=True)
+    tolerance_m = Column(Float, nullable=False)
+    points = Column(Integer, nullable=False)
+    polyline = Column(Text, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)  # spatial index refresh key
+
+class IngestWatermark(Base):
+    """Newest biometrics sample stored per (type, source); /ingest drops points at or before it."""
+    __tablename__ = "ingest_watermarks"
+
+    type = Column(String, primary_key=True)
+    source = Column(String, primary_key=True)
+    watermark = Column(DateTime, nullable=False)  # same clock as biometrics.date
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class DerivedState(Base):
+    """Progress cursor of a derived table over an append-only source (e.g. last biometrics.id seen)."""
+    __tablename__ = "derived_state"
+
+    name = Column(String, primary_key=True)
+    last_id = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class RunZone(Base):
+    """Seconds per heart-rate zone per run and zone model, cached by runlytics.processing.zones."""
+    __tablename__ = "run_zones"
+
+    run_id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)  # runs.id
+    model = Column(String, primary_key=True)
+    zone = Column(String, primary_key=True)
+    seconds = Column(Float, nullable=False)
+    samples = Column(Integer, nullable=False)
+
+class BiometricSeries(Base):
+    """Dictionary of (type, source) series for the compact biometrics layout (runlytics.database.compact)."""
+    __tablename__ = "biometric_series"
+    __table_args__ = (UniqueConstraint("type", "source", name="uq_biometric_series_type_source"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    type = Column(String, nullable=False)
+    source = Column(String, nullable=False)  # '' when the sample had none
+    unit = Column(String)
+
+class BiometricPoint(Base):
+    """One compact sample: series id, timestamp, value. The primary key is the only index."""
+    __tablename__ = "biometric_points"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    series_id = Column(Integer, primary_key=True)  # biometric_series.id
+    date = Column(DateTime, primary_key=True)
+    value = Column(Float)
+
+class BiometricBlock(Base):
+    """A series' samples for one day as two parallel arrays in a single row (JSON text on SQLite)."""
+    __tablename__ = "biometric_blocks"
+
+    series_id = Column(Integer, primary_key=True)  # biometric_series.id
+    bucket = Column(DateTime, primary_key=True)    # midnight of the block's day
+    samples = Column(Integer, nullable=False)
+    first_date = Column(DateTime, nullable=False)
+    last_date = Column(DateTime, nullable=False)
+    value_min = Column(Float)
+    value_max = Column(Float)
+    value_sum = Column(Float)
+    offsets_us = Column(ARRAY(BigInteger).with_variant(JSON, "sqlite"), nullable=False)  # microseconds since bucket
+    sample_values = Column(ARRAY(Float).with_variant(JSON, "sqlite"), nullable=False)
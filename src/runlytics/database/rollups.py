@@ -0,0 +1,194 @@
+"""
+Daily (and, for high-frequency types, hourly) biometrics rollups.
+
+/ingest calls refresh_rollups() with the buckets its batches touched, so
+only the affected type/day (type/hour) rows are recomputed from raw
+samples. Dashboards read biometric_daily / biometric_hourly instead of
+grouping raw biometrics on every refresh, e.g. a rolling HRV panel:
+
+    SELECT day AS time, AVG(value_mean) OVER (ORDER BY day ROWS 6 PRECEDING) AS hrv_7d
+    FROM biometric_daily WHERE type = 'heart_rate_variability' AND $__timeFilter(day)
+
+rebuild_rollups() recomputes a whole date range (backfills, repairs).
+"""
+import os
+import time
+import logging
+from datetime import timedelta
+
+import pandas as pd
+from sqlalchemy import select, delete, func
+
+from runlytics.database.models import BiometricDaily, BiometricHourly
+from runlytics.database.bulk import dialect_insert
+from runlytics.database.compact import samples_table
+
+logger = logging.getLogger("rollups")
+
+# Types sampled many times a day also get an hourly rollup
+HOURLY_TYPES = tuple(
+    t.strip() for t in os.getenv(
+        "ROLLUP_HOURLY_TYPES",
+        "heart_rate,step_count,active_energy,basal_energy_burned,walking_running_distance",
+    ).split(",") if t.strip()
+)
+
+# granularity -> (table, bucket column, bucket width)
+GRANULARITIES = {
+    "day": (BiometricDaily.__table__, "day", timedelta(days=1)),
+    "hour": (BiometricHourly.__table__, "hour", timedelta(hours=1)),
+}
+
+AGG_COLUMNS = ["samples", "value_sum", "value_min", "value_max", "value_mean", "updated_at"]
+
+
+def _bucket(connection, granularity, date):
+    """SQL expression truncating a sample date column to the start of its day/hour."""
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        return func.date_trunc(granularity, date)
+    if dialect == "sqlite":
+        # Same text format SQLAlchemy stores DateTime in, so range filters compare correctly
+        fmt = "%Y-%m-%d 00:00:00.000000" if granularity == "day" else "%Y-%m-%d %H:00:00.000000"
+        return func.strftime(fmt, date)
+    raise NotImplementedError(f"Rollups are not supported on the '{dialect}' backend")
+
+
+def touched_buckets(rows):
+    """
+    The (type, bucket start) pairs a biometrics batch (DataFrame or list of
+    dicts) falls into, per granularity: {"day": {...}, "hour": {...}}.
+    """
+    frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows, columns=["date", "type"])
+    touched = {"day": set(), "hour": set()}
+    if frame.empty:
+        return touched
+
+    dates = pd.to_datetime(frame["date"])
+    days = pd.DataFrame({"type": frame["type"], "bucket": dates.dt.floor("D")}).drop_duplicates()
+    touched["day"].update(zip(days["type"], days["bucket"]))
+
+    hourly = frame["type"].isin(HOURLY_TYPES)
+    if hourly.any():
+        hours = pd.DataFrame({"type": frame["type"][hourly], "bucket": dates[hourly].dt.floor("h")}).drop_duplicates()
+        touched["hour"].update(zip(hours["type"], hours["bucket"]))
+    return touched
+
+
+def merge_buckets(into, touched):
+    """Adds the pairs from one touched_buckets() result into another, in place."""
+    for granularity, pairs in touched.items():
+        into.setdefault(granularity, set()).update(pairs)
+    return into
+
+
+def _ranges(pairs, width):
+    """
+    Collapses (type, bucket) pairs into contiguous [start, end) ranges with
+    the union of their types, so a batch spanning a week is one statement.
+    """
+    by_bucket = {}
+    for type_, bucket in pairs:
+        by_bucket.setdefault(pd.Timestamp(bucket), set()).add(type_)
+
+    ranges = []
+    for bucket in sorted(by_bucket):
+        if ranges and bucket == ranges[-1][1]:
+            ranges[-1][1] = bucket + width
+            ranges[-1][2].update(by_bucket[bucket])
+        else:
+            ranges.append([bucket, bucket + width, set(by_bucket[bucket])])
+    return ranges
+
+
+def _upsert_range(connection, granularity, start=None, end=None, types=None):
+    """Recomputes one granularity's rollup rows from raw samples in [start, end) for types (None = all)."""
+    table, column, _ = GRANULARITIES[granularity]
+    # Compact storage moves old samples out of biometrics
+    samples = samples_table(start)
+    bucket = _bucket(connection, granularity, samples.c.date)
+
+    query = select(
+        samples.c.type,
+        bucket,
+        func.count(),
+        func.sum(samples.c.value),
+        func.min(samples.c.value),
+        func.max(samples.c.value),
+        func.avg(samples.c.value),
+        func.current_timestamp(),
+    ).where(samples.c.value.is_not(None))
+    if types is not None:
+        query = query.where(samples.c.type.in_(sorted(types)))
+    if start is not None:
+        query = query.where(samples.c.date >= start.to_pydatetime())
+    if end is not None:
+        query = query.where(samples.c.date < end.to_pydatetime())
+    query = query.group_by(samples.c.type, bucket)
+
+    stmt = dialect_insert(connection)(table).from_select(["type", column] + AGG_COLUMNS, query)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["type", column],
+        set_={c: stmt.excluded[c] for c in AGG_COLUMNS},
+    )
+    return connection.execute(stmt).rowcount
+
+
+def refresh_rollups(session, touched):
+    """
+    Recomputes only the rollup rows for the buckets in touched (from
+    touched_buckets/merge_buckets). Runs inside the session's transaction;
+    the caller commits. Returns {"day": rows, "hour": rows, "seconds": s}.
+    """
+    connection = session.connection()
+    stats = {"day": 0, "hour": 0, "seconds": 0.0}
+    t0 = time.perf_counter()
+
+    for granularity, (_, _, width) in GRANULARITIES.items():
+        for start, end, types in _ranges(touched.get(granularity, ()), width):
+            stats[granularity] += _upsert_range(connection, granularity, start, end, types)
+
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    if stats["day"] or stats["hour"]:
+        logger.info(f"Refreshed {stats['day']} daily / {stats['hour']} hourly rollups in {stats['seconds']:.2f}s")
+    return stats
+
+
+def rebuild_rollups(session, start=None, end=None):
+    """
+    Drops and recomputes every rollup row in [start, end) (whole history
+    by default) from raw samples. For backfills and repairs.
+    """
+    connection = session.connection()
+    start = pd.Timestamp(start).floor("D") if start is not None else None
+    end = pd.Timestamp(end).ceil("D") if end is not None else None
+    stats = {"day": 0, "hour": 0, "seconds": 0.0}
+    t0 = time.perf_counter()
+
+    for granularity, (table, column, _) in GRANULARITIES.items():
+        stmt = delete(table)
+        if start is not None:
+            stmt = stmt.where(table.c[column] >= start.to_pydatetime())
+        if end is not None:
+            stmt = stmt.where(table.c[column] < end.to_pydatetime())
+        connection.execute(stmt)
+
+        types = HOURLY_TYPES if granularity == "hour" else None
+        stats[granularity] = _upsert_range(connection, granularity, start, end, types)
+
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    logger.info(f"Rebuilt {stats['day']} daily / {stats['hour']} hourly rollups in {stats['seconds']:.2f}s")
+    return stats
+
+
+if __name__ == "__main__":
+    # python -m runlytics.database.rollups [start-date] [end-date]
+    import sys
+    from runlytics.database.models import Base
+    from runlytics.database.manager import get_engine, session_scope
+
+    Base.metadata.create_all(bind=get_engine(), tables=[BiometricDaily.__table__, BiometricHourly.__table__])
+    args = sys.argv[1:]
+    with session_scope() as session:
+        stats = rebuild_rollups(session, *args[:2])
+    print(f"Rollup rebuild complete: {stats}")
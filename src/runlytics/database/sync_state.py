@@ -0,0 +1,247 @@
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func, case
+
+from runlytics.database.models import SyncState, SyncedActivity, DerivedState, IngestWatermark, Biometric
+from runlytics.database.bulk import dialect_insert
+from runlytics.utils.telemetry import span
+
+# Bind-parameter friendly chunk for IN (...) lookups
+LOOKUP_CHUNK_SIZE = 1_000
+
+
+def _as_utc(dt):
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def get_watermark(session, source):
+    """Newest upstream timestamp synced for source, or None before the first sync."""
+    return session.execute(
+        select(SyncState.watermark).where(SyncState.source == source)
+    ).scalar()
+
+
+def set_watermark(session, source, watermark):
+    """Advances the watermark for source (never moves it backwards)."""
+    existing = get_watermark(session, source)
+    if existing is not None and watermark is not None:
+        watermark = max(_as_utc(existing), _as_utc(watermark))
+
+    stmt = dialect_insert(session.connection())(SyncState).values(
+        source=source, watermark=watermark, last_synced_at=datetime.now(timezone.utc)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["source"],
+        set_={"watermark": stmt.excluded.watermark, "last_synced_at": stmt.excluded.last_synced_at},
+    )
+    session.execute(stmt)
+
+
+def known_external_ids(session, source, external_ids):
+    """Which of external_ids were already synced for source (primary-key lookup, only the incoming ids)."""
+    ids = [str(i) for i in external_ids]
+    known = set()
+    for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+        chunk = ids[start:start + LOOKUP_CHUNK_SIZE]
+        known.update(session.execute(
+            select(SyncedActivity.external_id)
+            .where(SyncedActivity.source == source, SyncedActivity.external_id.in_(chunk))
+        ).scalars())
+    return known
+
+
+def record_external_ids(session, source, rows):
+    """Marks (external_id, date) pairs as synced for source."""
+    values = [{"source": source, "external_id": str(ext_id), "date": date} for ext_id, date in rows]
+    if not values:
+        return
+
+    insert = dialect_insert(session.connection())
+    for start in range(0, len(values), LOOKUP_CHUNK_SIZE):
+        stmt = insert(SyncedActivity).values(values[start:start + LOOKUP_CHUNK_SIZE])
+        session.execute(stmt.on_conflict_do_nothing(index_elements=["source", "external_id"]))
+
+
+def get_cursor(session, name):
+    """Last source id processed by the derived table `name` (0 before its first pass)."""
+    return session.execute(
+        select(DerivedState.last_id).where(DerivedState.name == name)
+    ).scalar() or 0
+
+
+def set_cursor(session, name, last_id):
+    stmt = dialect_insert(session.connection())(DerivedState).values(name=name, last_id=last_id)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=["name"], set_={"last_id": stmt.excluded.last_id, "updated_at": func.now()}
+    ))
+
+
+def save_ingest_watermarks(session, marks):
+    """Upserts {(type, source): newest date} into ingest_watermarks, never moving one backwards."""
+    rows = [{"type": t, "source": s, "watermark": pd.Timestamp(w).to_pydatetime()} for (t, s), w in marks.items()]
+    insert = dialect_insert(session.connection())
+    for start in range(0, len(rows), LOOKUP_CHUNK_SIZE):
+        stmt = insert(IngestWatermark).values(rows[start:start + LOOKUP_CHUNK_SIZE])
+        newer = stmt.excluded.watermark > IngestWatermark.watermark
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=["type", "source"],
+            set_={
+                "watermark": case((newer, stmt.excluded.watermark), else_=IngestWatermark.watermark),
+                "updated_at": func.now(),
+            },
+        ))
+
+
+class IngestWatermarks:
+    """
+    Process-wide cache of ingest_watermarks: the newest biometrics sample
+    stored per (type, source). Loaded on first use (seeded from biometrics
+    when the table is still empty) and advanced only after an ingest commits.
+    """
+
+    def __init__(self):
+        self._marks = None
+        self._lock = threading.Lock()
+
+    def load(self, session):
+        """Snapshot of the watermarks, reading them from the database the first time."""
+        with self._lock:
+            if self._marks is None:
+                rows = session.execute(
+                    select(IngestWatermark.type, IngestWatermark.source, IngestWatermark.watermark)
+                ).all()
+                if not rows:
+                    rows = session.execute(
+                        select(Biometric.type, Biometric.source, func.max(Biometric.date))
+                        .where(Biometric.type.is_not(None), Biometric.source.is_not(None))
+                        .group_by(Biometric.type, Biometric.source)
+                    ).all()
+                    rows = [r for r in rows if r[2] is not None]
+                    save_ingest_watermarks(session, {(t, s): w for t, s, w in rows})
+                self._marks = {(t, s): pd.Timestamp(w) for t, s, w in rows}
+            return dict(self._marks)
+
+    def advance(self, marks):
+        with self._lock:
+            if self._marks is None:
+                return
+            for key, mark in marks.items():
+                current = self._marks.get(key)
+                self._marks[key] = mark if current is None else max(current, mark)
+
+    def reset(self):
+        """Forgets the cache; the next load() reads the database again."""
+        with self._lock:
+            self._marks = None
+
+
+class DataWatermarks:
+    """
+    When this process last committed new rows to each table. Caches of
+    derived views (the coach report) key on a snapshot of the tables they
+    read, so checking freshness needs no database query.
+    """
+
+    def __init__(self):
+        self._marks = {}
+        self._lock = threading.Lock()
+
+    def touch(self, *tables):
+        """Records a committed write to `tables` (call after the commit)."""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            for table in tables:
+                self._marks[table] = now
+
+    def snapshot(self, tables):
+        return tuple(self._marks.get(table) for table in tables)
+
+
+# Shared by the webhook's ingest/sync jobs and the report cache
+data_watermarks = DataWatermarks()
+
+
+class InFlightWrites:
+    """
+    Biometrics writes in progress in this process. Their ids can be lower
+    than ids another job has already committed, so an id cursor moved past
+    them would skip their rows: cursors stop at floor() instead.
+    """
+
+    def __init__(self):
+        self._floors = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def writing(self, session):
+        """Registers a write from before its first insert until its transaction ends."""
+        token = object()
+        floor = session.execute(select(func.max(Biometric.id))).scalar() or 0
+        with self._lock:
+            self._floors[token] = floor
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._floors[token]
+
+    def floor(self):
+        """Every id an uncommitted write may still commit is above this (None when idle)."""
+        with self._lock:
+            return min(self._floors.values(), default=None)
+
+
+# Shared by /ingest jobs (which register) and the derived tables with biometrics.id cursors
+biometrics_writes = InFlightWrites()
+
+
+def bounded_high_water(session):
+    """
+    The highest biometrics id an id cursor may advance to: the current
+    max, capped below writes still in flight. Read the bound first, so a
+    write committing in between is seen by the max.
+    """
+    floor = biometrics_writes.floor()
+    high_water = session.execute(select(func.max(Biometric.id))).scalar() or 0
+    return high_water if floor is None else min(high_water, floor)
+
+
+class WatermarkFilter:
+    """
+    One ingest's view of the watermarks. Called on each parsed biometrics
+    frame, it drops points at or before their (type, source) watermark and
+    tracks the newest accepted point per series in `pending`.
+    """
+
+    def __init__(self, marks):
+        self.marks = {key: np.datetime64(mark) for key, mark in marks.items()}
+        self.pending = {}
+        self.accepted = 0
+        self.skipped = 0
+
+    def __call__(self, frame):
+        with span("dedup"):
+            return self._filter(frame)
+
+    def _filter(self, frame):
+        if frame.empty:
+            return frame
+        dates = frame["date"].to_numpy()
+        keep = np.ones(len(frame), dtype=bool)
+
+        for key, idx in frame.groupby(["type", "source"], sort=False).indices.items():
+            mark = self.marks.get(key)
+            if mark is not None:
+                keep[idx] = dates[idx] > mark
+            kept = dates[idx][keep[idx]]
+            if len(kept):
+                newest = pd.Timestamp(kept.max())
+                self.pending[key] = max(self.pending.get(key, newest), newest)
+
+        self.accepted += int(keep.sum())
+        self.skipped += int(len(keep) - keep.sum())
+        return frame if keep.all() else frame[keep].reset_index(drop=True)
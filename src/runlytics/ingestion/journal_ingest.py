@@ -1,38 +1,97 @@
 import os
+import json
+import hashlib
+import logging
+import threading
 import gspread
+from gspread.utils import rowcol_to_a1
 import pandas as pd
-from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import select, func
+
+from runlytics.database.models import DailyJournal, JournalRowHash
+from runlytics.database.manager import session_scope
+from runlytics.database.bulk import dialect_insert
+from runlytics.database.sync_state import get_cursor, set_cursor, LOOKUP_CHUNK_SIZE
+from runlytics.utils.telemetry import operation, span
 
 # Load Environment
 load_dotenv()
 
+logger = logging.getLogger("journal")
+
 # --- CONFIG ---
 SHEET_URL = "https://docs.google.com/spreadsheets/d/1raS0HJtnGqNn397I1W_AmWEuLjTdKS-K1JprSNwL6IY/edit?resourcekey=&gid=904959031#gid=904959031"
+CREDS_PATH = "google_credentials.json"
+SCOPES = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+JOURNAL_FIELDS = ["rpe", "mood", "soreness", "knee_pain", "sleep_quality", "notes"]
+NUMERIC_FIELDS = JOURNAL_FIELDS[:-1]
+
+# --- INCREMENTAL SYNC ---
+# The last sheet row synced is kept as a derived_state cursor. Each sync reads
+# the rows after it plus this many before it, so edits to recent entries are
+# picked up; rows whose content hash is unchanged are not written.
+# sync_journal(full=True) re-reads the whole sheet.
+ROW_CURSOR = "journal:sheet_row"
+JOURNAL_OVERLAP_ROWS = int(os.getenv("JOURNAL_OVERLAP_ROWS", "14"))
+
+
+class GoogleSheet:
+    """Sheet backend over a gspread worksheet."""
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def fetch(self, start):
+        """(header, rows from sheet row `start` to the last non-empty one)."""
+        header = self.worksheet.row_values(1)
+        if not header:
+            return [], []
+        # Open-ended in rows ("A48:H"), so rows added since the worksheet was opened are included
+        last_column = rowcol_to_a1(1, len(header))[:-1]
+        return header, list(self.worksheet.get(f"A{start}:{last_column}"))
+
+
+class ListSheet:
+    """In-memory sheet backend (header row first), for benchmarks and local runs."""
+
+    def __init__(self, rows):
+        self.rows = [list(row) for row in rows]
 
-# Database Connection
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL is missing from .env")
+    @classmethod
+    def from_records(cls, records):
+        header = list(records[0].keys()) if records else []
+        return cls([header] + [[record.get(h, "") for h in header] for record in records])
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(bind=engine)
+    def fetch(self, start):
+        return (self.rows[0] if self.rows else []), [list(row) for row in self.rows[start - 1:]]
+
+
+_sheet = None
+_sheet_lock = threading.Lock()
+
+def get_sheet():
+    """The journal worksheet, authorised once per process (gspread refreshes the token itself)."""
+    global _sheet
+    with _sheet_lock:
+        if _sheet is None:
+            if not os.path.exists(CREDS_PATH):
+                raise FileNotFoundError("Missing google_credentials.json")
+            client = gspread.service_account(filename=CREDS_PATH, scopes=SCOPES)
+            # Open by URL is safer than filename
+            _sheet = GoogleSheet(client.open_by_url(SHEET_URL).sheet1)
+        return _sheet
+
+def reset_sheet():
+    """Drops the cached client, e.g. after an API error; the next sync authorises again."""
+    global _sheet
+    with _sheet_lock:
+        _sheet = None
 
 def get_google_sheet_data():
     """Authenticates and pulls raw data."""
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds_path = "google_credentials.json"
-    
-    if not os.path.exists(creds_path):
-        raise FileNotFoundError("Missing google_credentials.json")
-        
-    creds = ServiceAccountCredentials.from_json_keyfile_name(creds_path, scope)
-    client = gspread.authorize(creds)
-    # Open by URL is safer than filename
-    return client.open_by_url(SHEET_URL).sheet1.get_all_records()
+    return get_sheet().worksheet.get_all_records()
 
 def find_header_map(available_headers):
     """
@@ -49,9 +108,9 @@ def find_header_map(available_headers):
         "sleep_quality": "Sleep",
         "notes": "Notes"
     }
-    
+
     header_map = {}
-    
+
     # Efficient O(N*M) search
     for db_field, keyword in targets.items():
         found = False
@@ -61,96 +120,158 @@ def find_header_map(available_headers):
                 found = True
                 break
         if not found:
-            print(f"Warning: Could not find a column matching '{keyword}'")
-            
+            logger.warning(f"Could not find a column matching '{keyword}'")
+
     return header_map
 
-def upload_journal_to_supabase(data, session):
-    if not data:
-        return
+def _number(value):
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def journal_entries(records):
+    """
+    Sheet records (header -> value dicts) -> {date: entry}, with numbers
+    parsed and blanks as None. Dates are parsed in one vectorised call;
+    a later row for the same date replaces an earlier one.
+    Returns None when the records have no Date column.
+    """
+    if not records:
+        return {}
 
     # 1. Map headers once
-    headers = list(data[0].keys())
-    col_map = find_header_map(headers)
-    
+    col_map = find_header_map(list(records[0].keys()))
     if "date" not in col_map:
-        print("Error: Could not find a Date column. Aborting.")
-        return
-
-    # 2. Prepare the Payload (List of Dictionaries)
-    bulk_data = []
-    
-    for row in data:
-        raw_date = row.get(col_map["date"])
-        if not raw_date: continue
-            
-        try:
-            date_obj = pd.to_datetime(raw_date).date()
-            
-            # Clean Dictionary Construction
-            entry = {
-                "date": date_obj,
-                "rpe": row.get(col_map.get("rpe")),
-                "mood": row.get(col_map.get("mood")),
-                "soreness": row.get(col_map.get("soreness")),
-                "knee_pain": row.get(col_map.get("knee_pain")),
-                "sleep_quality": row.get(col_map.get("sleep_quality")),
-                "notes": row.get(col_map.get("notes"))
-            }
-            
-            # Clean empty strings
-            entry = {k: (v if v != "" else None) for k, v in entry.items()}
-            bulk_data.append(entry)
-            
-        except Exception as e:
-            print(f"Skipping invalid row: {e}")
-
-    # 3. Bulk Insert (One Database Call)
-    if bulk_data:
-        sql = text("""
-            INSERT INTO daily_journal (date, rpe, mood, soreness, knee_pain, sleep_quality, notes)
-            VALUES (:date, :rpe, :mood, :soreness, :knee_pain, :sleep_quality, :notes)
-            ON CONFLICT (date) 
-            DO UPDATE SET 
-                rpe = EXCLUDED.rpe,
-                mood = EXCLUDED.mood,
-                soreness = EXCLUDED.soreness,
-                knee_pain = EXCLUDED.knee_pain,
-                sleep_quality = EXCLUDED.sleep_quality,
-                notes = EXCLUDED.notes;
-        """)
-        
-        session.execute(sql, bulk_data) 
-        session.commit()
-        print(f"Successfully synced {len(bulk_data)} entries in one transaction.")
+        logger.error("Could not find a Date column. Aborting.")
+        return None
+
+    # 2. Parse every date at once; unparseable ones become NaT
+    raw_dates = [record.get(col_map["date"]) or None for record in records]
+    dates = pd.to_datetime(pd.Series(raw_dates, dtype=object), errors="coerce")
+
+    entries = {}
+    invalid = 0
+    for record, raw_date, date in zip(records, raw_dates, dates):
+        if pd.isna(date):
+            invalid += raw_date is not None
+            continue
+        entry = {"date": date.date()}
+        for field in NUMERIC_FIELDS:
+            entry[field] = _number(record.get(col_map.get(field)))
+        notes = record.get(col_map.get("notes"))
+        entry["notes"] = str(notes) if notes not in (None, "") else None
+        entries[entry["date"]] = entry
+
+    if invalid:
+        logger.warning(f"Skipping {invalid} rows with an invalid date")
+    return entries
+
+def content_hash(entry):
+    values = json.dumps([entry[field] for field in JOURNAL_FIELDS])
+    return hashlib.blake2b(values.encode(), digest_size=8).hexdigest()
+
+def write_changed_entries(session, entries):
+    """
+    Upserts the entries whose content hash differs from the stored one
+    (or that have none yet). Returns (written, unchanged).
+    """
+    if not entries:
+        return 0, 0
+
+    dates = list(entries)
+    hashes = {date: content_hash(entry) for date, entry in entries.items()}
+    stored = {}
+    for start in range(0, len(dates), LOOKUP_CHUNK_SIZE):
+        stored.update(session.execute(
+            select(JournalRowHash.date, JournalRowHash.content_hash)
+            .where(JournalRowHash.date.in_(dates[start:start + LOOKUP_CHUNK_SIZE]))
+        ).all())
+    changed = [date for date in dates if stored.get(date) != hashes[date]]
+
+    insert = dialect_insert(session.connection())
+    for start in range(0, len(changed), LOOKUP_CHUNK_SIZE):
+        chunk = changed[start:start + LOOKUP_CHUNK_SIZE]
+        stmt = insert(DailyJournal).values([entries[date] for date in chunk])
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=["date"], set_={field: stmt.excluded[field] for field in JOURNAL_FIELDS}
+        ))
+        stmt = insert(JournalRowHash).values([{"date": date, "content_hash": hashes[date]} for date in chunk])
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=["date"], set_={"content_hash": stmt.excluded.content_hash, "synced_at": func.now()}
+        ))
+
+    return len(changed), len(dates) - len(changed)
+
+def upload_journal_to_supabase(data, session):
+    """Upserts sheet records into daily_journal, skipping unchanged ones. Returns the number of rows written."""
+    written, unchanged = write_changed_entries(session, journal_entries(data))
+    if written:
+        logger.info(f"Successfully synced {written} entries in one transaction ({unchanged} unchanged).")
+    return written
+
+def sync_journal(backend=None, full=False):
+    """
+    Syncs the sheet tail (see ROW_CURSOR) into daily_journal; full=True re-reads every row.
+    backend: anything with fetch(start) -> (header, rows), default the cached GoogleSheet.
+    Returns {"fetched": sheet rows read, "rows": entries written, "unchanged", "first_row", "last_row"}.
+    """
+    with operation("journal_sync") as op, session_scope() as session:
+        logger.info("Starting Journal Sync...")
+        last_row = get_cursor(session, ROW_CURSOR)
+        start = 2 if full or not last_row else max(2, last_row - JOURNAL_OVERLAP_ROWS + 1)
+
+        with span("fetch"):
+            try:
+                sheet = backend or get_sheet()
+                header, values = sheet.fetch(start)
+                if start > 2 and start + len(values) - 1 < last_row:
+                    # The sheet shrank, so rows moved up past the cursor: read all of it
+                    logger.warning("Journal sheet lost rows since the last sync; re-reading it in full.")
+                    start = 2
+                    header, values = sheet.fetch(start)
+            except Exception:
+                if backend is None:
+                    reset_sheet()
+                raise
+        end = start + len(values) - 1
+
+        # The API trims empty cells at the end of a row
+        records = [dict(zip(header, row + [""] * (len(header) - len(row)))) for row in values]
+
+        with span("db_write"):
+            entries = journal_entries(records)
+            written, unchanged = write_changed_entries(session, entries)
+            # Rows that couldn't be parsed are read again next time
+            if entries is not None:
+                set_cursor(session, ROW_CURSOR, end)
+
+        logger.info(f"Journal rows {start}-{end}: {written} written, {unchanged} unchanged.")
+        op.add_rows("fetched", len(values))
+        op.add_rows("entries", written)
+        return {"fetched": len(values), "rows": written, "unchanged": unchanged, "first_row": start, "last_row": end}
 
 def sync_journal_entry_point():
     """
     Wrapper for external calls (like from the webhook).
     Returns a status message.
     """
-    session = SessionLocal()
     try:
-        print("Starting Journal Sync...")
-        data = get_google_sheet_data()
-        upload_journal_to_supabase(data, session)
+        sync_journal()
         return "Journal Sync Complete"
     except Exception as e:
-        print(f"Journal Sync Failed: {e}")
+        logger.error(f"Journal Sync Failed: {e}")
         raise e
-    finally:
-        session.close()
 
 if __name__ == "__main__":
-    session = SessionLocal()
+    import sys
+    from runlytics.utils.logger import configure_logging
+
+    configure_logging()
+
     try:
-        print("Connecting to Google Sheets...")
-        raw_data = get_google_sheet_data()
-        
-        print(f"Fetched {len(raw_data)} rows. Uploading to database...")
-        upload_journal_to_supabase(raw_data, session)
-            
+        print(sync_journal(full="--full" in sys.argv))
     except Exception as e:
         print(f"Script failed: {e}")
-    finally:
-        session.close()
\ No newline at end of file
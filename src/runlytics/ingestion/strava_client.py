@@ -0,0 +1,255 @@
+import os
+import math
+import time
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("strava")
+
+# Overridable so the client can be pointed at a local stub server
+STRAVA_BASE = os.getenv("STRAVA_BASE_URL", "https://www.strava.com/api/v3")
+
+# Strava caps per_page at 200
+MAX_PER_PAGE = 200
+
+# Strava's default read budget (the headers override these once a response arrives)
+DEFAULT_LIMIT_15MIN = 100
+DEFAULT_LIMIT_DAILY = 1000
+
+
+class StravaAPIError(Exception):
+    pass
+
+
+class StravaRateLimitError(StravaAPIError):
+    pass
+
+
+class RateLimiter:
+    """
+    Keeps requests under Strava's 15-minute and daily budgets.
+    Usage is counted locally as requests go out (so concurrent page fetches
+    don't overshoot) and corrected from the X-RateLimit / X-ReadRateLimit
+    headers of every response. 15-minute windows reset on the quarter hour,
+    the daily one at midnight UTC.
+    """
+    WINDOW_S = 15 * 60
+
+    def __init__(self, limit_15min=DEFAULT_LIMIT_15MIN, limit_daily=DEFAULT_LIMIT_DAILY,
+                 safety_margin=2, clock=time.time, sleep=time.sleep):
+        self.limit_15min = limit_15min
+        self.limit_daily = limit_daily
+        self.safety_margin = safety_margin
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._window = None
+        self._day = None
+        self.used_15min = 0
+        self.used_daily = 0
+
+    def _roll(self, now):
+        window = int(now // self.WINDOW_S)
+        day = datetime.fromtimestamp(now, timezone.utc).date()
+        if window != self._window:
+            self._window, self.used_15min = window, 0
+        if day != self._day:
+            self._day, self.used_daily = day, 0
+
+    def acquire(self):
+        """Blocks until a request fits in the 15-minute budget. Raises if the daily budget is spent."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._roll(now)
+
+                if self.used_daily >= self.limit_daily - self.safety_margin:
+                    raise StravaRateLimitError(
+                        f"Strava daily rate limit reached ({self.used_daily}/{self.limit_daily})"
+                    )
+                if self.used_15min < self.limit_15min - self.safety_margin:
+                    self.used_15min += 1
+                    self.used_daily += 1
+                    return
+
+                wait = (self._window + 1) * self.WINDOW_S - now + 1
+
+            logger.warning(f"Strava 15-min budget reached ({self.used_15min}/{self.limit_15min}); sleeping {wait:.0f}s")
+            self._sleep(wait)
+
+    def update(self, headers):
+        """Applies the limit/usage headers ('<15min>,<daily>') from a response."""
+        limit = headers.get("X-ReadRateLimit-Limit") or headers.get("X-RateLimit-Limit")
+        usage = headers.get("X-ReadRateLimit-Usage") or headers.get("X-RateLimit-Usage")
+        if not (limit and usage):
+            return
+
+        try:
+            limit_15, limit_day = (int(x) for x in limit.split(","))
+            used_15, used_day = (int(x) for x in usage.split(","))
+        except ValueError:
+            return
+
+        with self._lock:
+            self._roll(self._clock())
+            self.limit_15min, self.limit_daily = limit_15, limit_day
+            # Our own count may be ahead of the server's while requests are in flight
+            self.used_15min = max(self.used_15min, used_15)
+            self.used_daily = max(self.used_daily, used_day)
+
+    def seconds_to_window_reset(self):
+        now = self._clock()
+        return (int(now // self.WINDOW_S) + 1) * self.WINDOW_S - now
+
+
+def retry_after_seconds(header, now=None):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date), or None if unusable."""
+    if not header:
+        return None
+    try:
+        delay = float(header)
+        return max(delay, 0.0) if math.isfinite(delay) else None
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = time.time() if now is None else now
+    return max(when.timestamp() - now, 0.0)
+
+
+class StravaClient:
+    """
+    Strava REST client: one pooled keep-alive session, a bounded number of
+    concurrent page fetches, rate-limit scheduling and retry with backoff.
+    The token is refreshed at most once per 401 streak, so a silently
+    failing refresh raises instead of looping.
+    """
+
+    def __init__(self, token, base_url=None, max_workers=4, per_page=MAX_PER_PAGE,
+                 max_retries=4, backoff_s=1.0, timeout_s=30, refresh_token_fn=None,
+                 on_refresh=None, limiter=None, session=None, sleep=time.sleep):
+        self.token = token
+        self.base_url = (base_url or STRAVA_BASE).rstrip("/")
+        self.max_workers = max_workers
+        self.per_page = min(per_page, MAX_PER_PAGE)
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.timeout_s = timeout_s
+        self.refresh_token_fn = refresh_token_fn
+        self.on_refresh = on_refresh
+        self.limiter = limiter or RateLimiter(sleep=sleep)
+        self._sleep = sleep
+        self._token_lock = threading.Lock()
+
+        self.http = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+    def close(self):
+        self.http.close()
+
+    def _refresh(self, stale_token):
+        with self._token_lock:
+            # Another page already refreshed it
+            if self.token != stale_token:
+                return
+            if not self.refresh_token_fn:
+                raise StravaAPIError("Strava token expired and no refresh function configured")
+
+            logger.info("Access Token Expired. Refreshing...")
+            self.token = self.refresh_token_fn()
+            if self.on_refresh:
+                self.on_refresh(self.token)
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = self.backoff_s * (2 ** attempt) + random.uniform(0, self.backoff_s)
+        self._sleep(delay)
+
+    def get(self, path, params=None):
+        """GET a JSON resource with rate limiting, one token refresh and retries."""
+        refreshed = False
+        attempt = 0
+
+        while True:
+            self.limiter.acquire()
+            token = self.token
+            try:
+                resp = self.http.get(
+                    f"{self.base_url}{path}",
+                    headers={"Authorization": f"Bearer {token}"},
+                    params=params,
+                    timeout=self.timeout_s,
+                )
+            except requests.RequestException as e:
+                if attempt >= self.max_retries:
+                    raise StravaAPIError(f"Strava request failed after {attempt + 1} attempts: {e}") from e
+                self._backoff(attempt)
+                attempt += 1
+                continue
+
+            self.limiter.update(resp.headers)
+
+            if resp.status_code == 200:
+                return resp.json()
+
+            if resp.status_code == 401:
+                if refreshed:
+                    raise StravaAPIError(f"Strava rejected the refreshed token: {resp.text}")
+                self._refresh(token)
+                refreshed = True
+                continue
+
+            if resp.status_code == 429 or resp.status_code >= 500:
+                if attempt >= self.max_retries:
+                    raise StravaAPIError(f"Strava returned {resp.status_code} after {attempt + 1} attempts: {resp.text}")
+                retry_after = None
+                if resp.status_code == 429:
+                    retry_after = retry_after_seconds(resp.headers.get("Retry-After"))
+                    if retry_after is None:
+                        retry_after = self.limiter.seconds_to_window_reset() + 1
+                logger.warning(f"Strava returned {resp.status_code}, retrying (attempt {attempt + 1})")
+                self._backoff(attempt, retry_after)
+                attempt += 1
+                continue
+
+            raise StravaAPIError(f"Error fetching data ({resp.status_code}): {resp.text}")
+
+    def fetch_activities(self, after_ts=0):
+        """
+        Fetches every activity after after_ts. The first page is fetched
+        alone (incremental syncs rarely need more); after that pages are
+        requested in growing windows of up to max_workers at a time.
+        A short page marks the end.
+        """
+        def page(n):
+            return self.get("/athlete/activities", {"per_page": self.per_page, "page": n, "after": int(after_ts)})
+
+        activities = []
+        next_page, window = 1, 1
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="strava") as pool:
+            while True:
+                pages = list(range(next_page, next_page + window))
+                for n, data in zip(pages, pool.map(page, pages)):
+                    activities.extend(data)
+                    logger.debug(f"Page {n}: Fetched {len(data)} items")
+                    if len(data) < self.per_page:
+                        return activities
+
+                next_page += window
+                window = min(window * 2, self.max_workers)
@@ -1,91 +1,73 @@
 import os
-import requests
 import json
+import logging
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import text, select
 
 # Corrected Import Path
 from runlytics.database.models import Run
+from runlytics.database.manager import session_scope
+from runlytics.database.bulk import upsert_runs, STRAVA_RUN_POLICY
+from runlytics.database.sync_state import (
+    get_watermark, set_watermark, known_external_ids, record_external_ids, LOOKUP_CHUNK_SIZE
+)
 from runlytics.ingestion.strava_auth import refresh_access_token, update_env
+from runlytics.ingestion.strava_client import StravaClient
+from runlytics.utils.telemetry import operation, span
 
 load_dotenv()
 
-# Configuration
-STRAVA_BASE = "https://www.strava.com/api/v3"
-DATABASE_URL = os.getenv("DATABASE_URL")
+logger = logging.getLogger("strava_ingest")
 
-# Database Connection
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(bind=engine)
+# Key for sync_state / synced_activities
+SOURCE = "strava"
 
 def get_latest_db_timestamp(session):
     """
-    Queries Supabase to find the timestamp of the last imported Strava run.
-    Used for incremental syncing.
+    Returns the sync watermark (epoch seconds) for incremental syncing:
+    the newest Strava start time already synced, from sync_state.
+    Falls back to the last imported Strava run before the first watermarked sync.
     """
+    watermark = get_watermark(session, SOURCE)
+    if watermark:
+        logger.info(f"Strava sync watermark: {watermark}")
+        return watermark.timestamp()
+
     query = text("SELECT MAX(date) FROM runs WHERE source = 'strava'")
     result = session.execute(query).scalar()
     
     if result:
-        print(f"Latest Strava run in DB: {result}")
+        logger.info(f"Latest Strava run in DB: {result}")
         return result.timestamp()
     
-    print("No Strava runs found in DB. Initiating full history fetch...")
+    logger.info("No Strava runs found in DB. Initiating full history fetch...")
     return 0
 
 def fetch_activities(token, after_ts=0):
     """
-    Recursively fetches activities from Strava API using pagination.
+    Fetches activities from Strava API using concurrent, rate-limited pagination.
     """
-    activities = []
-    page = 1
-    
-    while True:
-        resp = requests.get(
-            f"{STRAVA_BASE}/athlete/activities",
-            headers={"Authorization": f"Bearer {token}"},
-            params={"per_page": 50, "page": page, "after": int(after_ts)}
-        )
-        
-        if resp.status_code == 401:
-            print("Access Token Expired. Refreshing...")
-            token = refresh_access_token()
-            update_env(token)
-            continue
-            
-        if resp.status_code != 200:
-            print(f"Error fetching data: {resp.text}")
-            break
-            
-        data = resp.json()
-        if not data:
-            break
-            
-        activities.extend(data)
-        print(f"Page {page}: Fetched {len(data)} items")
-        page += 1
-        
-    return activities
+    client = StravaClient(token, refresh_token_fn=refresh_access_token, on_refresh=update_env)
+    try:
+        return client.fetch_activities(after_ts=after_ts)
+    finally:
+        client.close()
 
 def upload_to_supabase(activities, session):
     """
-    Transforms raw Strava JSON into Run objects and bulk-inserts new ones.
-    Returns the count of new runs added.
+    Transforms raw Strava JSON into runs rows, bulk-inserts new ones and
+    commits. Derived tables are left to the caller (see webhook.refresh_derived).
+    Returns the upsert_runs stats: rows, written and dates (start times of the new runs).
     """
+    stats = {"rows": 0, "written": 0, "dates": []}
     if not activities:
-        return 0
+        return stats
 
-    # 1. Fetch ALL existing dates from DB at once for fast duplicate checking
-    print("Checking for duplicates...")
-    existing_dates = set(
-        dt[0].replace(tzinfo=None) for dt in session.query(Run.date).all()
-    )
+    # 1. Parse the incoming runs
+    candidates = []
 
-    new_runs = []
-    
     for act in activities:
         if act.get('type') != 'Run':
             continue
@@ -95,67 +77,117 @@ def upload_to_supabase(activities, session):
             run_date_raw = datetime.strptime(act['start_date_local'], "%Y-%m-%dT%H:%M:%SZ")
         except ValueError:
             continue
-        
-        # Skip if we already have this date
-        if run_date_raw in existing_dates:
-            continue
 
-        # Create the Run Object
-        run_entry = Run(
-            date=run_date_raw,
-            distance_km=round(act['distance'] / 1000, 2),
-            duration_min=round(act['moving_time'] / 60, 2),
-            avg_hr=act.get('average_heartrate'),
-            max_hr=act.get('max_heartrate'),
-            energy_kcal=act.get('kilojoules'), 
-            source="strava",
-            route_json=act.get('map', {})
+        candidates.append((act, run_date_raw))
+
+    # 2. Indexed duplicate check over only the incoming window:
+    #    activity ids we already synced, and run dates already stored by any source
+    logger.info("Checking for duplicates...")
+    known_ids = known_external_ids(session, SOURCE, [act['id'] for act, _ in candidates if 'id' in act])
+    incoming_dates = list({d for _, d in candidates})
+    existing_dates = set()
+    for start in range(0, len(incoming_dates), LOOKUP_CHUNK_SIZE):
+        chunk = incoming_dates[start:start + LOOKUP_CHUNK_SIZE]
+        existing_dates.update(
+            dt.replace(tzinfo=None) for dt in session.execute(select(Run.date).where(Run.date.in_(chunk))).scalars()
         )
-        new_runs.append(run_entry)
 
-    # 2. Bulk Save
+    new_runs = []
+
+    for act, run_date_raw in candidates:
+        # Skip if we already have this activity or this date
+        if str(act.get('id')) in known_ids or run_date_raw in existing_dates:
+            continue
+
+        new_runs.append({
+            "date": run_date_raw,
+            "distance_km": round(act['distance'] / 1000, 2),
+            "duration_min": round(act['moving_time'] / 60, 2),
+            "avg_hr": act.get('average_heartrate'),
+            "max_hr": act.get('max_heartrate'),
+            "energy_kcal": act.get('kilojoules'),
+            "source": "strava",
+            "route_json": act.get('map', {})
+        })
+
+    # 3. Bulk Save (single INSERT ... ON CONFLICT (date) DO NOTHING)
     if new_runs:
-        session.add_all(new_runs)
-        session.commit()
-        print(f"Successfully uploaded {len(new_runs)} new runs to Supabase.")
-        return len(new_runs)
+        stats = upsert_runs(session, new_runs, policy=STRAVA_RUN_POLICY)
+        logger.info(f"Successfully uploaded {stats['written']} new runs to Supabase.")
     else:
-        print("No new runs to upload (all duplicates).")
-        return 0
+        logger.info("No new runs to upload (all duplicates).")
 
-def sync_strava_entry_point():
+    # 4. Remember what was synced and advance the watermark
+    record_external_ids(session, SOURCE, [(act['id'], d) for act, d in candidates if 'id' in act])
+    watermark = latest_start_date(activities)
+    if watermark:
+        set_watermark(session, SOURCE, watermark)
+    session.commit()
+
+    return stats
+
+def latest_start_date(activities):
+    """Newest UTC start_date across all fetched activities (runs or not)."""
+    dates = []
+    for act in activities:
+        try:
+            dates.append(datetime.strptime(act['start_date'], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return max(dates) if dates else None
+
+def sync_strava():
     """
-    Wrapper for external calls (like from the webhook).
-    Returns a status message string.
+    Runs one incremental sync and commits the new runs.
+    Returns {"fetched": activities from the API, "rows": new runs written,
+    "run_dates": their start times}.
     """
-    session = SessionLocal()
-    try:
-        print("Starting Strava Sync...")
+    with operation("strava_sync") as op, session_scope() as session:
+        logger.info("Starting Strava Sync...")
         # 1. Auth Init
-        token = os.getenv("STRAVA_ACCESS_TOKEN")
-        if not token:
-            token = refresh_access_token()
-            update_env(token)
+        with span("auth"):
+            token = os.getenv("STRAVA_ACCESS_TOKEN")
+            if not token:
+                token = refresh_access_token()
+                update_env(token)
 
         # 2. Sync Logic
-        last_ts = get_latest_db_timestamp(session)
-        runs = fetch_activities(token, after_ts=last_ts)
+        with span("fetch"):
+            last_ts = get_latest_db_timestamp(session)
+            runs = fetch_activities(token, after_ts=last_ts)
 
         # 3. Database Write
-        count = 0
+        stats = {"written": 0, "dates": []}
         if runs:
-            count = upload_to_supabase(runs, session)
-            return f"Strava Sync Complete: {count} new runs added."
+            with span("db_write"):
+                stats = upload_to_supabase(runs, session)
+        op.add_rows("fetched", len(runs))
+        op.add_rows("runs", stats["written"])
+        return {"fetched": len(runs), "rows": stats["written"], "run_dates": stats["dates"]}
+
+def sync_strava_entry_point():
+    """
+    Wrapper for external calls: the webhook's sync job, which also refreshes
+    the derived tables once the runs are committed.
+    Returns a status message string.
+    """
+    from runlytics.webhook import run_strava_sync
+
+    try:
+        result = run_strava_sync()
+        if result["fetched"]:
+            return f"Strava Sync Complete: {result['rows']} new runs added."
         else:
             return "Strava Sync Complete: No new runs found."
 
     except Exception as e:
-        print(f"Strava Sync Failed: {e}")
+        logger.error(f"Strava Sync Failed: {e}")
         raise e
-    finally:
-        session.close()
 
 if __name__ == "__main__":
+    from runlytics.utils.logger import configure_logging
+
+    configure_logging()
     try:
         status = sync_strava_entry_point()
         print(status)
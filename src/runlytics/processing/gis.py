@@ -0,0 +1,313 @@
+"""
+Route geometry: bulk Google-polyline decoding/encoding and multi-resolution
+Douglas-Peucker simplification.
+
+Routes come in two shapes in runs.route_json: Strava's map dict with an
+encoded 'summary_polyline', and Apple Health's list of {lat, lon, ...}
+points. Decoded routes are kept as one contiguous (N, 2) array of
+(lat, lng) plus an offsets array (route i is coords[offsets[i]:offsets[i + 1]]),
+so thousands of routes decode with a handful of NumPy passes.
+
+A single Douglas-Peucker pass ranks every point by the tolerance at which
+it would be dropped; each zoom level in ZOOM_TOLERANCES_M is then a simple
+threshold on that rank. Simplified routes are stored as encoded polylines
+in route_shapes, one row per run and zoom.
+"""
+import time
+import logging
+
+import numpy as np
+from sqlalchemy import select, delete, func
+
+from runlytics.database.models import Run, RouteShape
+from runlytics.database.bulk import dialect_insert, INSERT_CHUNK_SIZE
+
+logger = logging.getLogger("gis")
+
+# Polyline precision (5 decimal places, ~1 m)
+POLYLINE_SCALE = 1e5
+
+EARTH_RADIUS_M = 6_371_000.0
+
+# Map zoom level -> simplification tolerance in metres
+ZOOM_TOLERANCES_M = {10: 100.0, 13: 20.0, 16: 5.0}
+
+
+# --- Polyline codec ---
+
+def decode_polylines(polylines):
+    """
+    Decodes encoded polylines in bulk.
+    Returns (coords, offsets): float64 (N, 2) (lat, lng) and int64 offsets of length len(polylines) + 1.
+    A malformed polyline decodes to an empty route without affecting the others.
+    """
+    encoded = [p if isinstance(p, str) and p.isascii() else "" for p in polylines]
+    lengths = np.fromiter((len(p) for p in encoded), dtype=np.int64, count=len(encoded))
+    raw = np.frombuffer("".join(encoded).encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    if not len(raw):
+        return np.empty((0, 2)), np.zeros(len(encoded) + 1, dtype=np.int64)
+
+    # Each value is a run of 5-bit chunks, least significant first; 0x20 flags "more to come"
+    last = (raw & 0x20) == 0
+    char_offsets = np.concatenate([[0], np.cumsum(lengths)])
+    values_per_route = np.diff(np.concatenate([[0], np.cumsum(last)])[char_offsets])
+
+    # Values run across route boundaries in the joined text, so a route with a
+    # character out of range, an unterminated last value or an odd value count
+    # would shift every route after it: blank those and decode again
+    invalid = np.zeros(len(encoded), dtype=bool)
+    invalid[np.repeat(np.arange(len(encoded)), lengths)[(raw < 0) | (raw > 63)]] = True
+    nonempty = lengths > 0
+    invalid[nonempty] |= ~last[char_offsets[1:][nonempty] - 1]
+    invalid |= values_per_route % 2 == 1
+    if invalid.any():
+        logger.warning(f"Skipping {int(invalid.sum())} malformed polyline(s)")
+        return decode_polylines(["" if bad else p for p, bad in zip(encoded, invalid)])
+
+    value_id = np.concatenate([[0], np.cumsum(last)[:-1]])
+    value_start = np.flatnonzero(np.concatenate([[True], last[:-1]]))
+    shift = 5 * (np.arange(len(raw)) - value_start[value_id])
+    values = np.bincount(value_id, weights=(raw & 0x1F) << shift, minlength=int(last.sum())).astype(np.int64)
+
+    # Zigzag: the low bit carries the sign
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    # Values per route come from the terminal chunks inside each route's characters
+    points_per_route = values_per_route // 2
+    offsets = np.concatenate([[0], np.cumsum(points_per_route)])
+
+    deltas = deltas[:2 * offsets[-1]].reshape(-1, 2)
+    # Cumulative sum that restarts at every route
+    totals = np.cumsum(deltas, axis=0)
+    starts = np.repeat(offsets[:-1], points_per_route)
+    base = np.vstack([np.zeros((1, 2), dtype=np.int64), totals])[starts]
+    coords = (totals - base) / POLYLINE_SCALE
+    return coords, offsets
+
+
+def decode_polyline(polyline):
+    """Single polyline -> (N, 2) array of (lat, lng)."""
+    coords, _ = decode_polylines([polyline])
+    return coords
+
+
+def encode_polylines(coords, offsets):
+    """Inverse of decode_polylines: returns one encoded string per route."""
+    ints = np.round(np.asarray(coords, dtype=float) * POLYLINE_SCALE).astype(np.int64)
+    deltas = np.diff(ints, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    # Each route's first point is relative to (0, 0)
+    route_starts = offsets[:-1][np.diff(offsets) > 0]
+    deltas[route_starts] = ints[route_starts]
+
+    values = deltas.reshape(-1)
+    zigzag = np.where(values < 0, ~(values << 1), values << 1)
+
+    # Up to 7 chunks of 5 bits per 32-bit value
+    chunks = (zigzag[:, None] >> (5 * np.arange(7))) & 0x1F
+    n_chunks = 1 + ((zigzag[:, None] >> (5 * np.arange(1, 7))) > 0).sum(axis=1)
+    used = np.arange(7) < n_chunks[:, None]
+    more = np.arange(7) < (n_chunks - 1)[:, None]
+    chars = (chunks | np.where(more, 0x20, 0)) + 63
+    text = chars[used].astype(np.uint8).tobytes().decode("ascii")
+
+    # Split back into routes
+    value_offsets = np.concatenate([[0], np.cumsum(n_chunks)])
+    bounds = value_offsets[2 * offsets]
+    return [text[bounds[i]:bounds[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def encode_polyline(coords):
+    return encode_polylines(coords, np.array([0, len(coords)]))[0]
+
+
+# --- Route extraction ---
+
+def route_to_coords(route_json):
+    """(N, 2) (lat, lng) array from a runs.route_json value (Strava map dict or Apple point list)."""
+    if isinstance(route_json, dict):
+        return decode_polyline(route_json.get("summary_polyline") or route_json.get("polyline") or "")
+    if isinstance(route_json, list) and route_json:
+        lat = [p.get("lat", p.get("latitude")) for p in route_json]
+        lng = [p.get("lon", p.get("lng", p.get("longitude"))) for p in route_json]
+        coords = np.array([lat, lng], dtype=float).T
+        return coords[~np.isnan(coords).any(axis=1)]
+    return np.empty((0, 2))
+
+
+def routes_to_coords(route_jsons):
+    """Bulk route_to_coords: (coords, offsets) for a sequence of route_json values."""
+    route_jsons = list(route_jsons)
+    polylines = [
+        (r.get("summary_polyline") or r.get("polyline") or "") if isinstance(r, dict) else ""
+        for r in route_jsons
+    ]
+    coords, offsets = decode_polylines(polylines)
+
+    # Point-list routes (Apple Health) are already coordinates; splice them in
+    if not any(isinstance(r, list) and r for r in route_jsons):
+        return coords, offsets
+    parts = [
+        route_to_coords(r) if isinstance(r, list) else coords[offsets[i]:offsets[i + 1]]
+        for i, r in enumerate(route_jsons)
+    ]
+    lengths = np.array([len(p) for p in parts], dtype=np.int64)
+    return np.vstack(parts + [np.empty((0, 2))]), np.concatenate([[0], np.cumsum(lengths)])
+
+
+# --- Simplification ---
+
+def to_metres(coords):
+    """Local equirectangular projection (x east, y north, metres), fine at route scale."""
+    lat0 = np.radians(np.mean(coords[:, 0])) if len(coords) else 0.0
+    rad = np.radians(coords)
+    return np.column_stack([rad[:, 1] * np.cos(lat0), rad[:, 0]]) * EARTH_RADIUS_M
+
+
+def dp_importance(coords, floor=0.0):
+    """
+    Douglas-Peucker rank of every point: the largest tolerance (metres) at
+    which it survives. Endpoints are inf. Simplifying at tolerance t keeps
+    exactly the points with rank > t, so all zoom levels share one pass.
+    Spans whose deviation is at most floor aren't split further (their
+    points rank 0), which is exact for every tolerance >= floor.
+    """
+    n = len(coords)
+    rank = np.zeros(n)
+    if n == 0:
+        return rank
+    rank[0] = rank[-1] = np.inf
+    if n < 3:
+        return rank
+
+    xy = to_metres(coords)
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        i, j, parent = stack.pop()
+        if j - i < 2:
+            continue
+
+        # Distance of every interior point to the chord i-j
+        a, b = xy[i], xy[j]
+        seg = b - a
+        pts = xy[i + 1:j] - a
+        length = np.hypot(*seg)
+        if length == 0:
+            dist = np.hypot(pts[:, 0], pts[:, 1])
+        else:
+            dist = np.abs(seg[0] * pts[:, 1] - seg[1] * pts[:, 0]) / length
+
+        k = int(np.argmax(dist))
+        # A point can't outlive the split that exposed it
+        d = min(float(dist[k]), parent)
+        if d <= floor:
+            continue
+        k += i + 1
+        rank[k] = d
+        stack.append((i, k, d))
+        stack.append((k, j, d))
+    return rank
+
+
+def simplify(coords, tolerance_m, rank=None):
+    """Douglas-Peucker simplification of one route at tolerance_m metres."""
+    rank = dp_importance(coords) if rank is None else rank
+    return coords[rank > tolerance_m]
+
+
+def simplify_levels(coords, tolerances=ZOOM_TOLERANCES_M):
+    """{zoom: simplified coords} for every zoom level, from one Douglas-Peucker pass."""
+    rank = dp_importance(coords, floor=min(tolerances.values()))
+    return {zoom: coords[rank > tol] for zoom, tol in tolerances.items()}
+
+
+# --- Storage ---
+
+def update_route_shapes(session, recompute=False, run_dates=None, tolerances=ZOOM_TOLERANCES_M):
+    """
+    Decodes and simplifies routes of runs without stored shapes (every run
+    with recompute=True) and stores one encoded polyline per zoom level.
+    Runs without a usable route (indoor, empty or single-point) get empty
+    rows (points=0), so they aren't decoded again on every ingest.
+    run_dates (start times of runs upsert_runs just rewrote) are re-shaped
+    even if stored, so a route that arrives or changes later replaces them.
+    The caller commits. Returns {"runs": processed, "shapes": rows written, "seconds": s}.
+    """
+    t0 = time.perf_counter()
+    if run_dates and not recompute:
+        # Dropping their shapes queues rewritten runs below (and clears a route that is now gone)
+        rewritten = select(Run.id).where(Run.date.in_(list(run_dates)))
+        session.execute(delete(RouteShape).where(RouteShape.run_id.in_(rewritten)))
+
+    query = select(Run.id, Run.route_json).where(Run.route_json.is_not(None))
+    if not recompute:
+        query = query.where(Run.id.not_in(select(RouteShape.run_id)))
+    runs = session.execute(query).all()
+
+    stats = {"runs": len(runs), "shapes": 0, "seconds": 0.0}
+    if not runs:
+        return stats
+
+    coords, offsets = routes_to_coords(r.route_json for r in runs)
+    rows = []
+    for i, run in enumerate(runs):
+        route = coords[offsets[i]:offsets[i + 1]]
+        if len(route) < 2:
+            route = np.empty((0, 2))
+        for zoom, simple in simplify_levels(route, tolerances).items():
+            rows.append({"coords": simple, "run_id": run.id, "zoom": zoom, "tolerance_m": tolerances[zoom], "points": len(simple)})
+
+    if rows:
+        # Encode every simplified route at once
+        lengths = np.array([r["points"] for r in rows], dtype=np.int64)
+        encoded = encode_polylines(np.vstack([r.pop("coords") for r in rows]), np.concatenate([[0], np.cumsum(lengths)]))
+        for row, polyline in zip(rows, encoded):
+            row["polyline"] = polyline
+
+    if recompute:
+        session.execute(delete(RouteShape).where(RouteShape.run_id.in_([r.id for r in runs])))
+    insert = dialect_insert(session.connection())
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        stmt = insert(RouteShape).values(rows[start:start + INSERT_CHUNK_SIZE])
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=["run_id", "zoom"],
+            set_={**{c: stmt.excluded[c] for c in ("tolerance_m", "points", "polyline")}, "updated_at": func.now()},
+        ))
+
+    stats["shapes"] = len(rows)
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    logger.info(f"Route shapes updated: {stats}")
+    return stats
+
+
+def nearest_zoom(zoom, levels=ZOOM_TOLERANCES_M):
+    """The stored level to serve a map zoom: the most detailed one not finer than it."""
+    candidates = [z for z in sorted(levels) if z <= zoom]
+    return candidates[-1] if candidates else min(levels)
+
+
+def get_route_shapes(session, zoom, run_ids=None, decode=False):
+    """
+    {run_id: encoded polyline} at the stored level for a map zoom
+    ({run_id: (N, 2) coords} with decode=True). Only that level is read.
+    """
+    query = select(RouteShape.run_id, RouteShape.polyline).where(RouteShape.zoom == nearest_zoom(zoom), RouteShape.points > 0)
+    if run_ids is not None:
+        query = query.where(RouteShape.run_id.in_(list(run_ids)))
+    rows = session.execute(query).all()
+
+    if not decode:
+        return {r.run_id: r.polyline for r in rows}
+    coords, offsets = decode_polylines([r.polyline for r in rows])
+    return {r.run_id: coords[offsets[i]:offsets[i + 1]] for i, r in enumerate(rows)}
+
+
+if __name__ == "__main__":
+    # python -m runlytics.processing.gis [--recompute]
+    import sys
+    from runlytics.database.models import Base
+    from runlytics.database.manager import get_engine, session_scope
+
+    Base.metadata.create_all(bind=get_engine(), tables=[RouteShape.__table__])
+    with session_scope() as session:
+        stats = update_route_shapes(session, recompute="--recompute" in sys.argv)
+    print(f"Route shapes complete: {stats}")
@@ -1,9 +1,69 @@
 import pandas as pd
 from datetime import datetime
 
+try:
+    import ijson
+except ImportError:  # Streaming ingest is optional; fall back to full JSON parsing
+    ijson = None
+
+# Rows per batch handed to the database layer (runlytics.database.bulk chunks further)
+BATCH_SIZE = 5000
+
+# Points HealthStream holds for a metric whose "data" comes before its "name"
+MAX_UNNAMED_POINTS = 20 * BATCH_SIZE
+
+# Where Health Auto Export puts its lists (see HealthParser._extract_list)
+METRIC_PREFIXES = ("metrics.item", "data.metrics.item", "data.item")
+WORKOUT_PREFIXES = ("workouts.item", "data.workouts.item")
+
+BIOMETRIC_COLUMNS = ["date", "type", "value", "unit", "source"]
+
+# Trailing UTC offset: " -0500", "+01:00", "Z"
+TZ_SUFFIX = r"\s*(?:Z|[+-]\d{2}:?\d{2})$"
+
+
+def _batched(rows, batch_size):
+    """Re-chunks an iterable of row lists into lists of exactly batch_size (last one shorter)."""
+    buffer = []
+    for chunk in rows:
+        buffer.extend(chunk)
+        while len(buffer) >= batch_size:
+            yield buffer[:batch_size]
+            buffer = buffer[batch_size:]
+    if buffer:
+        yield buffer
+
+
+def _split_frames(frames, batch_size):
+    """Concatenates frames and cuts them into full batches. Returns (batches, remainder)."""
+    buffer = pd.concat(frames, ignore_index=True)
+    cut = len(buffer) - len(buffer) % batch_size
+    batches = [buffer.iloc[start:start + batch_size].reset_index(drop=True) for start in range(0, cut, batch_size)]
+    return batches, buffer.iloc[cut:].reset_index(drop=True)
+
+
+def _batched_frames(frames, batch_size):
+    """Same as _batched, for DataFrames."""
+    pending, size = [], 0
+    for frame in frames:
+        if frame.empty:
+            continue
+        pending.append(frame)
+        size += len(frame)
+        if size >= batch_size:
+            batches, remainder = _split_frames(pending, batch_size)
+            yield from batches
+            pending, size = [remainder], len(remainder)
+
+    if size:
+        yield pd.concat(pending, ignore_index=True)
+
+
 class HealthParser:
-    def __init__(self, payload):
+    def __init__(self, payload, watermarks=None):
         self.payload = payload
+        # Optional callable (e.g. sync_state.WatermarkFilter) dropping already-stored points from each frame
+        self.watermarks = watermarks
 
     def _extract_list(self, key_name):
         """
@@ -13,76 +73,236 @@ class HealthParser:
         # Case 1: Top level (e.g., payload['metrics'])
         if key_name in self.payload:
             return self.payload[key_name]
-        
+
         # Case 2: Nested in 'data' (e.g., payload['data']['metrics'])
         data_block = self.payload.get("data", {})
         if isinstance(data_block, dict) and key_name in data_block:
             return data_block[key_name]
-            
+
         # Case 3: 'data' is the list itself (rare, but your code handled it)
         if key_name == "metrics" and isinstance(data_block, list):
             return data_block
 
         return []
 
+    @staticmethod
+    def _parse_dates(date_strs):
+        """
+        Vectorized version of pd.to_datetime(date_str).replace(tzinfo=None).
+        The UTC offset is dropped, keeping local wall-clock time:
+        "2025-12-10 08:32:00 -0500" -> 2025-12-10 08:32:00. Unparseable values become NaT.
+        """
+        raw = pd.Series(date_strs, dtype="string")
+        local = raw.str.replace(TZ_SUFFIX, "", regex=True)
+        dates = pd.to_datetime(local, format="ISO8601", errors="coerce")
+
+        # Rare non-ISO strings: one more vectorized pass over just those rows
+        retry = dates.isna() & local.notna()
+        if retry.any():
+            dates[retry] = pd.to_datetime(local[retry], format="mixed", errors="coerce")
+        return dates
+
+    @staticmethod
+    def _biometric_frame(name, unit, points):
+        """Converts raw data points of one metric into a biometrics DataFrame (one column per field)."""
+        dates = HealthParser._parse_dates([p.get("date") for p in points])
+        values = pd.to_numeric(pd.Series([p.get("qty") for p in points], dtype=object), errors="coerce")
+        sources = pd.Series([p.get("source") for p in points], dtype=object).fillna("Apple Health")
+
+        # Bad rows are dropped through a mask instead of a per-point try/except
+        valid = dates.notna().to_numpy()
+        frame = pd.DataFrame({
+            "date": dates.to_numpy()[valid],
+            "type": name,
+            "value": values.to_numpy(dtype=float)[valid],
+            "unit": unit,
+            "source": sources.to_numpy()[valid],
+        }, columns=BIOMETRIC_COLUMNS)
+        return frame
+
+    @staticmethod
+    def to_records(frame):
+        """DataFrame -> list of row dicts, with NaN mapped to None for the database."""
+        return frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+
+    @staticmethod
+    def _workout_row(w):
+        """Converts a raw workout into a runs row, or None if it isn't a usable run."""
+        # We only care about Running
+        if w.get("name") != "Running":
+            return None
+
+        date_str = w.get("start")
+        try:
+            dt_obj = pd.to_datetime(date_str).replace(tzinfo=None)
+        except:
+            return None
+
+        # Runs are deduplicated on their start time (runs.date), the id is assigned by the DB
+        return {
+            "date": dt_obj,
+            "duration_min": w.get("duration"),
+            "distance_km": w.get("distance"),
+            "avg_hr": w.get("avg_heart_rate"),
+            "max_hr": w.get("max_heart_rate"),
+            "energy_kcal": w.get("active_energy"),
+            "source": "Apple Health",
+            "route_json": w.get("route", [])
+        }
+
+    def iter_biometrics(self, batch_size=BATCH_SIZE):
+        """Yields biometrics DataFrames of at most batch_size rows."""
+        def per_metric():
+            for m in self._extract_list("metrics"):
+                # Some exports use 'data', some might use 'qty' directly if aggregated
+                points = m.get("data", [])
+                for start in range(0, len(points), batch_size):
+                    frame = self._biometric_frame(m.get("name"), m.get("units"), points[start:start + batch_size])
+                    yield self.watermarks(frame) if self.watermarks else frame
+
+        yield from _batched_frames(per_metric(), batch_size)
+
+    def iter_workouts(self, batch_size=BATCH_SIZE):
+        """Yields runs rows in lists of at most batch_size."""
+        rows = (self._workout_row(w) for w in self._extract_list("workouts"))
+        yield from _batched(([r] for r in rows if r), batch_size)
+
+    def iter_batches(self, batch_size=BATCH_SIZE):
+        """Yields ('biometrics' | 'runs', rows) tuples, same shape as HealthStream."""
+        for batch in self.iter_biometrics(batch_size):
+            yield "biometrics", batch
+        for batch in self.iter_workouts(batch_size):
+            yield "runs", batch
+
     def parse_biometrics(self):
         """Extracts background metrics like HR, Steps, HRV."""
-        metrics = self._extract_list("metrics")
-        parsed_data = []
-
-        for m in metrics:
-            name = m.get("name")
-            unit = m.get("units")
-            
-            # Some exports use 'data', some might use 'qty' directly if aggregated
-            points = m.get("data", [])
-            
-            for point in points:
-                # Clean the date string: "2025-12-10 08:32:00 -0500" -> UTC naive
-                date_str = point.get("date")
-                try:
-                    # Parse and strip timezone for Postgres compatibility
-                    dt_obj = pd.to_datetime(date_str).replace(tzinfo=None)
-                except:
-                    continue
-
-                parsed_data.append({
-                    "date": dt_obj,
-                    "type": name,
-                    "value": point.get("qty"),
-                    "unit": unit,
-                    "source": point.get("source", "Apple Health")
-                })
-        
-        return parsed_data
+        return [row for batch in self.iter_biometrics() for row in self.to_records(batch)]
 
     def parse_workouts(self):
         """Extracts running workouts."""
-        workouts = self._extract_list("workouts")
-        parsed_runs = []
-
-        for w in workouts:
-            # We only care about Running
-            if w.get("name") == "Running":
-                date_str = w.get("start")
-                try:
-                    dt_obj = pd.to_datetime(date_str).replace(tzinfo=None)
-                except:
-                    continue
-
-                # Create a unique ID based on time hash to prevent duplicates
-                run_id = f"run_{int(dt_obj.timestamp())}"
-
-                parsed_runs.append({
-                    "id": run_id,
-                    "date": dt_obj,
-                    "duration_min": w.get("duration"),
-                    "distance_km": w.get("distance"),
-                    "avg_hr": w.get("avg_heart_rate"),
-                    "max_hr": w.get("max_heart_rate"),
-                    "energy_kcal": w.get("active_energy"),
-                    "source": "Apple Health",
-                    "route_json": w.get("route", [])
-                })
-        
-        return parsed_runs
\ No newline at end of file
+        return [row for batch in self.iter_workouts() for row in batch]
+
+
+class HealthStream:
+    """
+    Incremental version of HealthParser for bodies too large to hold in memory.
+    Bytes are pushed in with feed(); completed batches come back out as
+    ('biometrics' | 'runs', rows) tuples, so only one batch is alive at a time.
+    """
+    available = ijson is not None
+
+    def __init__(self, batch_size=BATCH_SIZE, watermarks=None):
+        if ijson is None:
+            raise RuntimeError("ijson is required for streaming ingest")
+
+        self.batch_size = batch_size
+        self.watermarks = watermarks
+        self._events = ijson.sendable_list()
+        self._coro = ijson.parse_coro(self._events, use_float=True)
+
+        self._metric_prefix = None
+        self._metric = {}
+        self._points = []
+        self._frames = []
+        self._frame_rows = 0
+        self._runs = []
+
+        # Builds one point/workout object at a time out of parser events
+        self._builder = None
+        self._builder_target = None
+
+    def feed(self, chunk):
+        """Pushes raw body bytes and returns the batches that became complete."""
+        if chunk:
+            try:
+                self._coro.send(chunk)
+            except ijson.JSONError as e:
+                raise ValueError(str(e)) from e
+        return self._drain()
+
+    def close(self):
+        """Signals end of body and returns whatever is left."""
+        try:
+            self._coro.close()
+        except ijson.JSONError as e:
+            raise ValueError(str(e)) from e
+        ready = self._drain()
+        if self._frame_rows:
+            ready.append(("biometrics", pd.concat(self._frames, ignore_index=True)))
+        if self._runs:
+            ready.append(("runs", self._runs))
+        self._frames, self._frame_rows, self._runs = [], 0, []
+        return ready
+
+    def _drain(self):
+        for prefix, event, value in self._events:
+            self._handle(prefix, event, value)
+        del self._events[:]
+
+        ready = []
+        if self._frame_rows >= self.batch_size:
+            batches, remainder = _split_frames(self._frames, self.batch_size)
+            ready.extend(("biometrics", batch) for batch in batches)
+            self._frames, self._frame_rows = [remainder], len(remainder)
+        while len(self._runs) >= self.batch_size:
+            ready.append(("runs", self._runs[:self.batch_size]))
+            self._runs = self._runs[self.batch_size:]
+        return ready
+
+    def _handle(self, prefix, event, value):
+        # 1. Inside a point or workout object: keep building until it closes
+        if self._builder is not None:
+            self._builder.event(event, value)
+            if not self._builder.containers:
+                obj, self._builder = self._builder.value, None
+                if self._builder_target == "point":
+                    self._points.append(obj)
+                    if len(self._points) >= self.batch_size:
+                        self._flush_points()
+                else:
+                    row = HealthParser._workout_row(obj)
+                    if row:
+                        self._runs.append(row)
+            return
+
+        # 2. Metric boundaries and header fields
+        if event == "start_map" and prefix in METRIC_PREFIXES:
+            self._metric_prefix = prefix
+            self._metric = {}
+        elif self._metric_prefix and prefix == self._metric_prefix + ".name":
+            self._metric["name"] = value
+        elif self._metric_prefix and prefix == self._metric_prefix + ".units":
+            self._metric["units"] = value
+        elif event == "end_map" and prefix == self._metric_prefix:
+            self._flush_points(final=True)
+            self._metric_prefix = None
+
+        # 3. Start of a point or workout object
+        elif event == "start_map" and self._metric_prefix and prefix == self._metric_prefix + ".data.item":
+            self._start_builder("point", event, value)
+        elif event == "start_map" and prefix in WORKOUT_PREFIXES:
+            self._start_builder("workout", event, value)
+
+    def _start_builder(self, target, event, value):
+        self._builder = ijson.ObjectBuilder()
+        self._builder_target = target
+        self._builder.event(event, value)
+
+    def _flush_points(self, final=False):
+        # Points can arrive before the metric name if the exporter orders keys
+        # differently; hold them until the name is known (or the metric ends),
+        # up to MAX_UNNAMED_POINTS so a body can't grow the buffer without bound.
+        if "name" not in self._metric and not final:
+            if len(self._points) > MAX_UNNAMED_POINTS:
+                raise ValueError(
+                    f"Metric has more than {MAX_UNNAMED_POINTS} data points before its name; send 'name' before 'data'"
+                )
+            return
+        if self._points:
+            frame = HealthParser._biometric_frame(self._metric.get("name"), self._metric.get("units"), self._points)
+            if self.watermarks:
+                frame = self.watermarks(frame)
+            if not frame.empty:
+                self._frames.append(frame)
+                self._frame_rows += len(frame)
+            self._points = []
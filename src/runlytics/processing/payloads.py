@@ -0,0 +1,243 @@
+"""
+Request body formats for /ingest.
+
+Content-Encoding: identity, gzip/deflate (zlib) or zstd (needs zstandard).
+Decompression is streamed in READ_BYTES steps and stops with
+PayloadTooLarge once more than max_bytes come out, so a small compressed
+body can't expand into unbounded memory.
+
+Content-Type:
+  - application/json (and anything unrecognised): the Health Auto Export
+    document, streamed through HealthStream when ijson is installed;
+  - application/x-ndjson: one object per line. A line is a metric
+    ({"name", "units", "data": [...]}, as in the export's metrics list),
+    a workout (has "start") or a single point ({"name", "units", "date",
+    "qty", "source"}; consecutive points of a metric are batched together);
+  - application/msgpack (needs msgpack): the export document encoded as
+    MessagePack, or a stream of objects shaped like the NDJSON lines.
+
+Every format yields the same ('biometrics' | 'runs', rows) batches as
+HealthParser.iter_batches().
+"""
+import os
+import json
+import zlib
+from itertools import chain
+
+from runlytics.processing.health_parser import HealthParser, HealthStream, BATCH_SIZE, _batched, _batched_frames
+
+try:
+    import zstandard
+except ImportError:  # zstd bodies are optional
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack bodies are optional
+    msgpack = None
+
+READ_BYTES = 64 * 1024
+
+# Cap on the decompressed body
+MAX_DECOMPRESSED_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Cap on one NDJSON line (a record, or a whole metric with its data list)
+MAX_NDJSON_LINE_BYTES = int(os.getenv("INGEST_MAX_LINE_BYTES", str(32 * 1024 * 1024)))
+
+JSON, NDJSON, MSGPACK = "json", "ndjson", "msgpack"
+
+CONTENT_TYPES = {
+    "application/x-ndjson": NDJSON,
+    "application/ndjson": NDJSON,
+    "application/jsonl": NDJSON,
+    "application/x-jsonlines": NDJSON,
+    "application/msgpack": MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+}
+
+ENCODINGS = ("identity", "gzip", "x-gzip", "deflate", "zstd")
+
+# Accepts both zlib and gzip headers
+_INFLATE_WBITS = 32 + zlib.MAX_WBITS
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+class UnsupportedPayload(Exception):
+    pass
+
+
+def payload_format(content_type=None, content_encoding=None):
+    """
+    (format, encoding) for a request's headers.
+    Raises UnsupportedPayload for encodings that can't be read here.
+    """
+    fmt = CONTENT_TYPES.get((content_type or "").split(";")[0].strip().lower(), JSON)
+    encoding = (content_encoding or "identity").strip().lower() or "identity"
+
+    if encoding not in ENCODINGS:
+        raise UnsupportedPayload(f"Unsupported Content-Encoding '{encoding}'")
+    if encoding == "zstd" and zstandard is None:
+        raise UnsupportedPayload("zstd bodies need the zstandard package")
+    if fmt == MSGPACK and msgpack is None:
+        raise UnsupportedPayload("MessagePack bodies need the msgpack package")
+    return fmt, encoding
+
+
+# --- Decompression ---
+
+def _inflate(body, read_bytes):
+    """gzip/zlib stream -> chunks of at most read_bytes (concatenated gzip members included)."""
+    inflater = zlib.decompressobj(_INFLATE_WBITS)
+    try:
+        while data := body.read(read_bytes):
+            while data:
+                if inflater.eof:
+                    inflater = zlib.decompressobj(_INFLATE_WBITS)
+                chunk = inflater.decompress(data, read_bytes)
+                if chunk:
+                    yield chunk
+                data = inflater.unconsumed_tail or (inflater.unused_data if inflater.eof else b"")
+        if not inflater.eof:
+            raise ValueError("Truncated compressed body")
+    except zlib.error as e:
+        raise ValueError(f"Invalid compressed body: {e}") from e
+
+
+def _unzstd(body, read_bytes):
+    try:
+        yield from zstandard.ZstdDecompressor().read_to_iter(body, read_size=read_bytes, write_size=read_bytes)
+    except zstandard.ZstdError as e:
+        raise ValueError(f"Invalid compressed body: {e}") from e
+
+
+def decompressed_chunks(body, encoding="identity", read_bytes=READ_BYTES, max_bytes=MAX_DECOMPRESSED_BYTES):
+    """Decoded body bytes in chunks; raises PayloadTooLarge past max_bytes."""
+    if encoding == "identity":
+        chunks = iter(lambda: body.read(read_bytes), b"")
+    elif encoding == "zstd":
+        chunks = _unzstd(body, read_bytes)
+    else:
+        chunks = _inflate(body, read_bytes)
+
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        if total > max_bytes:
+            raise PayloadTooLarge(f"Body exceeds {max_bytes} bytes once decompressed")
+        yield chunk
+
+
+# --- Formats ---
+
+def _is_document(obj):
+    """A whole Health Auto Export document rather than one metric/workout/point."""
+    return isinstance(obj, dict) and (
+        "metrics" in obj or "workouts" in obj or (isinstance(obj.get("data"), (dict, list)) and "name" not in obj)
+    )
+
+
+def iter_record_batches(records, batch_size=BATCH_SIZE, watermarks=None):
+    """Batches from a stream of metric, workout or point objects (NDJSON lines, MessagePack stream)."""
+    runs = []
+
+    def frame(key, points):
+        result = HealthParser._biometric_frame(key[0], key[1], points)
+        return watermarks(result) if watermarks else result
+
+    def frames():
+        key, points = None, []
+        for record in records:
+            if not isinstance(record, dict):
+                raise ValueError("Expected one JSON object per record")
+
+            if isinstance(record.get("data"), list):
+                data = record["data"]
+                for start in range(0, len(data), batch_size):
+                    yield frame((record.get("name"), record.get("units")), data[start:start + batch_size])
+            elif "start" in record:
+                row = HealthParser._workout_row(record)
+                if row:
+                    runs.append(row)
+            else:
+                point_key = (record.get("name"), record.get("units"))
+                if points and (point_key != key or len(points) >= batch_size):
+                    yield frame(key, points)
+                    points = []
+                key = point_key
+                points.append(record)
+        if points:
+            yield frame(key, points)
+
+    for batch in _batched_frames(frames(), batch_size):
+        yield "biometrics", batch
+    yield from (("runs", batch) for batch in _batched(([r] for r in runs), batch_size))
+
+
+def _ndjson_records(chunks):
+    """One object per NDJSON line; only the new chunk is split, the unfinished line carries over."""
+    max_line_bytes = MAX_NDJSON_LINE_BYTES
+    too_long = f"NDJSON line exceeds {max_line_bytes} bytes"
+    line = bytearray()
+    for chunk in chunks:
+        *complete, rest = chunk.split(b"\n")
+        for piece in complete:
+            line += piece
+            if len(line) > max_line_bytes:
+                raise PayloadTooLarge(too_long)
+            if line.strip():
+                yield json.loads(line)
+            line = bytearray()
+        line += rest
+        if len(line) > max_line_bytes:
+            raise PayloadTooLarge(too_long)
+    if line.strip():
+        yield json.loads(line)
+
+
+def _msgpack_objects(chunks):
+    unpacker = msgpack.Unpacker(raw=False, strict_map_key=False, max_buffer_size=MAX_DECOMPRESSED_BYTES)
+    try:
+        for chunk in chunks:
+            unpacker.feed(chunk)
+            yield from unpacker
+    except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid MessagePack body: {e}") from e
+
+
+def _json_batches(chunks, batch_size, watermarks):
+    if not HealthStream.available:
+        parser = HealthParser(json.loads(b"".join(chunks)), watermarks=watermarks)
+        yield from parser.iter_batches(batch_size)
+        return
+
+    stream = HealthStream(batch_size=batch_size, watermarks=watermarks)
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.close()
+
+
+def iter_payload_batches(body, fmt=JSON, encoding="identity", batch_size=BATCH_SIZE, watermarks=None,
+                         read_bytes=READ_BYTES, max_bytes=MAX_DECOMPRESSED_BYTES):
+    """(kind, rows) batches from a request body file in any supported format and encoding."""
+    chunks = decompressed_chunks(body, encoding, read_bytes, max_bytes)
+
+    if fmt == NDJSON:
+        yield from iter_record_batches(_ndjson_records(chunks), batch_size, watermarks)
+    elif fmt == MSGPACK:
+        objects = _msgpack_objects(chunks)
+        first = next(objects, None)
+        if first is None:
+            return
+        if _is_document(first):
+            yield from HealthParser(first, watermarks=watermarks).iter_batches(batch_size)
+            # Anything after the document is another stream of records
+            records = objects
+        else:
+            records = chain([first], objects)
+        yield from iter_record_batches(records, batch_size, watermarks)
+    else:
+        yield from _json_batches(chunks, batch_size, watermarks)
@@ -0,0 +1,314 @@
+"""
+In-process spatial index over run routes ("runs near here", "runs through
+this park", "runs sharing this segment"), no PostGIS needed.
+
+Routes (the finest stored route_shapes level from runlytics.processing.gis)
+are rasterised onto a regular lat/lng grid. The index is a sorted array of
+(cell key, run id) pairs, so a query only binary-searches the grid rows it
+covers and then checks the candidate routes' segments exactly. It is
+saved to SPATIAL_INDEX_PATH as one .npz and refreshed from the route_shapes
+rows updated since the last refresh (less REFRESH_OVERLAP_S, for
+transactions that committed late).
+"""
+import os
+import time
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import select
+
+from runlytics.database.models import RouteShape
+from runlytics.processing.gis import decode_polylines, ZOOM_TOLERANCES_M, EARTH_RADIUS_M
+
+logger = logging.getLogger("spatial")
+
+SPATIAL_INDEX_PATH = Path(os.getenv("SPATIAL_INDEX_PATH", "data/spatial/route_index.npz"))
+
+# Grid cell size in degrees (~110 m of latitude)
+CELL_DEG = 0.001
+
+# Routes are indexed at the most detailed stored zoom level
+INDEX_ZOOM = max(ZOOM_TOLERANCES_M)
+
+# Shapes updated this long before the newest one seen are read again on every refresh
+REFRESH_OVERLAP_S = int(os.getenv("SPATIAL_REFRESH_OVERLAP_S", "600"))
+
+_write_lock = threading.Lock()
+
+
+def _metres(coords, lat0):
+    """Equirectangular projection around lat0 (x east, y north, metres)."""
+    rad = np.radians(coords)
+    return np.column_stack([rad[:, 1] * np.cos(np.radians(lat0)), rad[:, 0]]) * EARTH_RADIUS_M
+
+
+class RouteIndex:
+    def __init__(self, cell_deg=CELL_DEG):
+        self.cell_deg = cell_deg
+        self.n_cols = int(np.ceil(360 / cell_deg))
+        # (cell key, run id) pairs sorted by key
+        self.keys = np.empty(0, dtype=np.int64)
+        self.key_runs = np.empty(0, dtype=np.int64)
+        # Route geometry for exact checks: run i is coords[offsets[i]:offsets[i + 1]]
+        self.run_ids = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.coords = np.empty((0, 2))
+        # Newest route_shapes.updated_at seen (epoch seconds), for incremental updates
+        self.shapes_seen = 0.0
+
+    def __len__(self):
+        return len(self.run_ids)
+
+    # --- Grid ---
+
+    def _cell(self, lat, lng):
+        row = np.floor((np.asarray(lat) + 90) / self.cell_deg).astype(np.int64)
+        col = np.floor((np.asarray(lng) + 180) / self.cell_deg).astype(np.int64)
+        return row, col
+
+    def _crossings(self, a, b, axis):
+        """(segment, t) for every grid line of one axis that segments a-b cross, t in (0, 1)."""
+        origin = 90 if axis == 0 else 180
+        u0, u1 = (a[:, axis] + origin) / self.cell_deg, (b[:, axis] + origin) / self.cell_deg
+        c0, c1 = np.floor(u0).astype(np.int64), np.floor(u1).astype(np.int64)
+        n = np.abs(c1 - c0)
+        seg = np.repeat(np.arange(len(a)), n)
+        k = np.arange(len(seg)) - np.repeat(np.cumsum(n) - n, n)
+        # Upwards the first line is c0 + 1, downwards it is c0 itself
+        line = np.where(c1[seg] > c0[seg], c0[seg] + 1 + k, c0[seg] - k)
+        return seg, (line - u0[seg]) / (u1 - u0)[seg]
+
+    def _route_cells(self, coords, offsets):
+        """Unique (key, route index) pairs for every cell each route passes through."""
+        counts = np.diff(offsets)
+        route_of_point = np.repeat(np.arange(len(counts)), counts)
+
+        # Segments within a route
+        same_route = route_of_point[1:] == route_of_point[:-1]
+        a, b = coords[:-1][same_route], coords[1:][same_route]
+        seg_route = route_of_point[:-1][same_route]
+
+        # Grid traversal: split each segment where it crosses a row or column
+        # line; the midpoint of every piece lies in one cell the segment visits
+        n = len(a)
+        row_seg, row_t = self._crossings(a, b, 0)
+        col_seg, col_t = self._crossings(a, b, 1)
+        seg = np.concatenate([np.arange(n), row_seg, col_seg, np.arange(n)])
+        t = np.concatenate([np.zeros(n), row_t, col_t, np.ones(n)])
+        order = np.lexsort((t, seg))
+        seg, t = seg[order], t[order]
+        piece = np.flatnonzero(seg[1:] == seg[:-1])
+        mid = (t[piece] + t[piece + 1]) / 2
+        piece_seg = seg[piece]
+        samples = a[piece_seg] + (b[piece_seg] - a[piece_seg]) * mid[:, None]
+
+        # Route points too (single-point routes have no segments)
+        lat = np.concatenate([samples[:, 0], coords[:, 0]])
+        lng = np.concatenate([samples[:, 1], coords[:, 1]])
+        route = np.concatenate([seg_route[piece_seg], route_of_point])
+
+        row, col = self._cell(lat, lng)
+        n_routes = max(len(counts), 1)
+        pairs = np.unique((row * self.n_cols + col) * n_routes + route)
+        return pairs // n_routes, pairs % n_routes
+
+    def _candidates(self, min_lat, min_lng, max_lat, max_lng):
+        """Run ids with a cell in the box: one binary search per covered grid row."""
+        r0, c0 = self._cell(min_lat, min_lng)
+        r1, c1 = self._cell(max_lat, max_lng)
+        rows = np.arange(r0, r1 + 1, dtype=np.int64)
+        lo = np.searchsorted(self.keys, rows * self.n_cols + c0, side="left")
+        hi = np.searchsorted(self.keys, rows * self.n_cols + c1, side="right")
+        hits = [self.key_runs[s:e] for s, e in zip(lo, hi) if e > s]
+        return np.unique(np.concatenate(hits)) if hits else np.empty(0, dtype=np.int64)
+
+    def _segments(self, run_ids):
+        """Segment endpoints (a, b) and owning run id for the given runs (single points as zero-length)."""
+        idx = np.flatnonzero(np.isin(self.run_ids, run_ids))
+        starts, ends = self.offsets[idx], self.offsets[idx + 1]
+        lengths = ends - starts
+        points = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(idx) else np.empty(0, dtype=np.int64)
+        owner = np.repeat(self.run_ids[idx], lengths)
+
+        # Pair each point with the next one in the same run (the last one with itself)
+        nxt = points + 1
+        last = np.cumsum(lengths) - 1
+        nxt[last] = points[last]
+        return self.coords[points], self.coords[nxt], owner
+
+    # --- Updates ---
+
+    def remove(self, run_ids):
+        run_ids = np.asarray(list(run_ids), dtype=np.int64)
+        keep_pairs = ~np.isin(self.key_runs, run_ids)
+        self.keys, self.key_runs = self.keys[keep_pairs], self.key_runs[keep_pairs]
+
+        keep = ~np.isin(self.run_ids, run_ids)
+        if keep.all():
+            return
+        counts = np.diff(self.offsets)
+        self.coords = self.coords[np.repeat(keep, counts)]
+        self.offsets = np.concatenate([[0], np.cumsum(counts[keep])])
+        self.run_ids = self.run_ids[keep]
+
+    def add(self, run_ids, coords, offsets):
+        """Indexes routes (replacing any already indexed under the same run ids)."""
+        run_ids = np.asarray(run_ids, dtype=np.int64)
+        if not len(run_ids):
+            return
+        self.remove(run_ids)
+
+        keys, route = self._route_cells(coords, offsets)
+        runs = run_ids[route]
+        # Merge into the sorted pairs without re-sorting the whole index
+        order = np.argsort(keys, kind="stable")
+        keys, runs = keys[order], runs[order]
+        at = np.searchsorted(self.keys, keys, side="right")
+        self.keys = np.insert(self.keys, at, keys)
+        self.key_runs = np.insert(self.key_runs, at, runs)
+
+        self.coords = np.vstack([self.coords, coords])
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + offsets[1:]])
+        self.run_ids = np.concatenate([self.run_ids, run_ids])
+
+    # --- Queries ---
+
+    def bbox(self, min_lat, min_lng, max_lat, max_lng):
+        """Run ids whose route enters the box."""
+        candidates = self._candidates(min_lat, min_lng, max_lat, max_lng)
+        if not len(candidates):
+            return []
+        a, b, owner = self._segments(candidates)
+
+        # Liang-Barsky clip of every candidate segment against the box
+        d = b - a
+        p = np.column_stack([-d[:, 0], d[:, 0], -d[:, 1], d[:, 1]])
+        q = np.column_stack([a[:, 0] - min_lat, max_lat - a[:, 0], a[:, 1] - min_lng, max_lng - a[:, 1]])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = q / p
+        t0 = np.where(p < 0, r, -np.inf).max(axis=1).clip(min=0)
+        t1 = np.where(p > 0, r, np.inf).min(axis=1).clip(max=1)
+        parallel_outside = ((p == 0) & (q < 0)).any(axis=1)
+        hit = (t0 <= t1) & ~parallel_outside
+        return sorted(int(x) for x in np.unique(owner[hit]))
+
+    def radius(self, lat, lng, radius_m):
+        """Run ids whose route passes within radius_m metres of (lat, lng)."""
+        dlat = np.degrees(radius_m / EARTH_RADIUS_M)
+        dlng = dlat / max(np.cos(np.radians(lat)), 1e-6)
+        candidates = self._candidates(lat - dlat, lng - dlng, lat + dlat, lng + dlng)
+        if not len(candidates):
+            return []
+        a, b, owner = self._segments(candidates)
+
+        # Point-to-segment distance in a projection centred on the query point
+        centre = _metres(np.array([[lat, lng]]), lat)[0]
+        a, b = _metres(a, lat) - centre, _metres(b, lat) - centre
+        d = b - a
+        length2 = (d ** 2).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(length2 > 0, -(a * d).sum(axis=1) / length2, 0).clip(0, 1)
+        dist = np.hypot(*(a + d * t[:, None]).T)
+        return sorted(int(x) for x in np.unique(owner[dist <= radius_m]))
+
+    def overlap(self, route, min_share=0.3):
+        """
+        Runs sharing grid cells with route (a run id or an (N, 2) coords array).
+        Returns [(run_id, share)] by share of the route's cells, highest first.
+        """
+        exclude = None
+        if np.isscalar(route):
+            exclude = int(route)
+            idx = np.flatnonzero(self.run_ids == exclude)
+            if not len(idx):
+                raise KeyError(f"Run {exclude} is not indexed")
+            route = self.coords[self.offsets[idx[0]]:self.offsets[idx[0] + 1]]
+
+        keys, _ = self._route_cells(np.asarray(route, dtype=float), np.array([0, len(route)]))
+        if not len(keys):
+            return []
+        lo = np.searchsorted(self.keys, keys, side="left")
+        hi = np.searchsorted(self.keys, keys, side="right")
+        hits = np.concatenate([self.key_runs[s:e] for s, e in zip(lo, hi)])
+
+        runs, shared = np.unique(hits, return_counts=True)
+        share = shared / len(keys)
+        result = [(int(r), round(float(s), 3)) for r, s in zip(runs, share) if s >= min_share and r != exclude]
+        return sorted(result, key=lambda x: -x[1])
+
+    # --- Persistence ---
+
+    def save(self, path=SPATIAL_INDEX_PATH):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.stem + ".tmp.npz")
+        np.savez(
+            tmp, cell_deg=self.cell_deg, keys=self.keys, key_runs=self.key_runs,
+            run_ids=self.run_ids, offsets=self.offsets, coords=self.coords, shapes_seen=self.shapes_seen,
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path=SPATIAL_INDEX_PATH, cell_deg=CELL_DEG):
+        """Loads the saved index, or an empty one if there is none yet."""
+        path = Path(path)
+        if not path.exists():
+            return cls(cell_deg)
+        with np.load(path) as data:
+            index = cls(float(data["cell_deg"]))
+            for name in ("keys", "key_runs", "run_ids", "offsets", "coords"):
+                setattr(index, name, data[name])
+            # Indexes saved before shapes_seen existed are refreshed from scratch
+            index.shapes_seen = float(data["shapes_seen"]) if "shapes_seen" in data else 0.0
+        return index
+
+
+def _epoch(value):
+    """route_shapes.updated_at (naive UTC on SQLite) -> epoch seconds."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def update_index(session, path=SPATIAL_INDEX_PATH, rebuild=False):
+    """
+    Re-indexes the routes whose route_shapes rows changed since the saved
+    index was refreshed (all of them with rebuild=True) and saves it.
+    Returns {"runs": re-indexed, "indexed": total, "seconds": s}.
+    """
+    t0 = time.perf_counter()
+    with _write_lock:
+        index = RouteIndex() if rebuild else RouteIndex.load(path)
+        since = datetime.fromtimestamp(max(index.shapes_seen - REFRESH_OVERLAP_S, 0), timezone.utc)
+        rows = session.execute(
+            select(RouteShape.run_id, RouteShape.points, RouteShape.polyline, RouteShape.updated_at)
+            .where(RouteShape.zoom == INDEX_ZOOM, RouteShape.updated_at >= since)
+            .order_by(RouteShape.run_id)
+        ).all()
+
+        if rows:
+            # Routes that became empty leave the index
+            index.remove(r.run_id for r in rows if not r.points)
+            routes = [r for r in rows if r.points]
+            coords, offsets = decode_polylines([r.polyline for r in routes])
+            index.add([r.run_id for r in routes], coords, offsets)
+            index.shapes_seen = max(index.shapes_seen, max(_epoch(r.updated_at) for r in rows))
+            index.save(path)
+
+    stats = {"runs": len(rows), "indexed": len(index), "seconds": round(time.perf_counter() - t0, 3)}
+    if rows:
+        logger.info(f"Spatial index updated: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    # python -m runlytics.processing.spatial [--rebuild]
+    import sys
+    from runlytics.database.manager import session_scope
+
+    with session_scope() as session:
+        stats = update_index(session, rebuild="--rebuild" in sys.argv)
+    print(f"Spatial index complete: {stats}")
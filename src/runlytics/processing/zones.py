@@ -0,0 +1,261 @@
+"""
+Time in heart-rate zone per run.
+
+Every heart_rate sample is assigned to each run whose window
+[runs.date, + duration_min) contains it (overlapping duplicates, e.g. the
+same run from Strava and Apple Health, both count it) with two
+searchsorteds of the run bounds into the sorted samples, binned into zones
+with a third over the zone bounds, and weighted by the time until the next
+sample. One bincount then gives seconds per (run, zone) for all runs at once.
+HR is only read inside the run windows (merged where they are close).
+
+Results are cached in run_zones. A cursor on biometrics.id (biometrics
+is append-only) tells update_run_zones() which runs received new samples
+since the last pass; only those and runs never computed are redone. The
+cursor stops below ingests still in flight (see bounded_high_water).
+"""
+import os
+import time
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, delete, or_
+
+from runlytics.database.models import Run, Biometric, RunZone, DerivedState
+from runlytics.database.bulk import dialect_insert, INSERT_CHUNK_SIZE
+from runlytics.database.compact import samples_table
+from runlytics.database.sync_state import get_cursor, set_cursor, bounded_high_water
+
+logger = logging.getLogger("zones")
+
+HR_TYPE = "heart_rate"
+
+# Athlete parameters (shared with the training-load settings)
+HR_MAX = float(os.getenv("TRIMP_HR_MAX", "190"))
+HR_REST = float(os.getenv("TRIMP_HR_REST", "50"))
+LTHR = float(os.getenv("LTHR", "170"))
+
+DEFAULT_MODEL = os.getenv("HR_ZONE_MODEL", "max_hr")
+
+# A sample counts until the next one, but never for more than this (gaps are missing data)
+MAX_SAMPLE_GAP_S = 120
+
+# Spans of run windows read per query
+RUNS_PER_QUERY = 200
+
+# Run windows closer than this are read as one span
+MERGE_GAP_S = 3600
+
+
+class ZoneModel:
+    """Zone labels and the lower bound (bpm) of every zone after the first."""
+
+    def __init__(self, name, labels, bounds):
+        if len(labels) != len(bounds) + 1:
+            raise ValueError("A zone model needs one more label than bounds")
+        self.name = name
+        self.labels = list(labels)
+        self.bounds = np.asarray(bounds, dtype=float)
+
+    def assign(self, hr):
+        """Zone index of every HR value."""
+        return np.searchsorted(self.bounds, hr, side="right")
+
+
+def max_hr_model(hr_max=HR_MAX):
+    """Five zones at 60/70/80/90 % of max HR (below 50 % is 'z0')."""
+    pct = np.array([0.5, 0.6, 0.7, 0.8, 0.9])
+    return ZoneModel("max_hr", ["z0", "z1", "z2", "z3", "z4", "z5"], pct * hr_max)
+
+
+def hrr_model(hr_max=HR_MAX, hr_rest=HR_REST):
+    """Karvonen: the same percentages applied to heart-rate reserve."""
+    pct = np.array([0.5, 0.6, 0.7, 0.8, 0.9])
+    return ZoneModel("hrr", ["z0", "z1", "z2", "z3", "z4", "z5"], hr_rest + pct * (hr_max - hr_rest))
+
+
+def lthr_model(lthr=LTHR):
+    """Friel's running zones as % of lactate-threshold HR."""
+    pct = np.array([0.85, 0.90, 0.95, 1.00, 1.03, 1.07])
+    return ZoneModel("lthr", ["z1", "z2", "z3", "z4", "z5a", "z5b", "z5c"], pct * lthr)
+
+
+ZONE_MODELS = {"max_hr": max_hr_model, "hrr": hrr_model, "lthr": lthr_model}
+
+
+def get_model(model=None):
+    if isinstance(model, ZoneModel):
+        return model
+    name = model or DEFAULT_MODEL
+    if name not in ZONE_MODELS:
+        raise ValueError(f"Unknown zone model '{name}', expected one of {sorted(ZONE_MODELS)}")
+    return ZONE_MODELS[name]()
+
+
+def run_windows(runs):
+    """runs (id, date, duration_min) -> arrays (ids, starts, ends) sorted by start, naive wall clock (ns)."""
+    start = pd.to_datetime(runs["date"], utc=True).dt.tz_localize(None)
+    end = start + pd.to_timedelta(pd.to_numeric(runs["duration_min"], errors="coerce"), unit="min")
+    frame = pd.DataFrame({"id": runs["id"].to_numpy(), "start": start, "end": end}).dropna().sort_values("start")
+    return (
+        frame["id"].to_numpy(dtype=np.int64),
+        frame["start"].to_numpy(dtype="datetime64[ns]").astype(np.int64),
+        frame["end"].to_numpy(dtype="datetime64[ns]").astype(np.int64),
+    )
+
+
+def locate(times, starts, ends):
+    """(run index, sample index) for every sorted time (ns) inside every run window, grouped by run."""
+    lo = np.searchsorted(times, starts, side="left")
+    hi = np.searchsorted(times, ends, side="left")
+    counts = np.maximum(hi - lo, 0)
+    run = np.repeat(np.arange(len(starts)), counts)
+    sample = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+    return run, sample
+
+
+def time_in_zones(starts, ends, times, hr, model):
+    """
+    Seconds and sample counts per (run, zone) for sorted sample times (ns)
+    and HR values. Returns two (n_runs, n_zones) arrays.
+    """
+    n_runs, n_zones = len(starts), len(model.labels)
+    seconds = np.zeros(n_runs * n_zones)
+    samples = np.zeros(n_runs * n_zones, dtype=np.int64)
+
+    run, sample = locate(times, starts, ends)
+    times, hr = times[sample], hr[sample]
+    # No sample inside any run window
+    if not len(times):
+        return seconds.reshape(n_runs, n_zones), samples.reshape(n_runs, n_zones)
+
+    # Each sample lasts until the next one in the same run, the last until the run ends
+    nxt = np.append(times[1:], 0)
+    last = np.append(run[1:] != run[:-1], True)
+    nxt[last] = ends[run[last]]
+    weight = np.minimum((nxt - times) / 1e9, MAX_SAMPLE_GAP_S)
+
+    cell = run * n_zones + model.assign(hr)
+    seconds += np.bincount(cell, weights=weight, minlength=n_runs * n_zones)
+    samples += np.bincount(cell, minlength=n_runs * n_zones)
+    return seconds.reshape(n_runs, n_zones), samples.reshape(n_runs, n_zones)
+
+
+def merge_windows(starts, ends, gap_s=MERGE_GAP_S):
+    """Sorted, non-overlapping (start, end) spans (ns) covering the run windows, joining those within gap_s."""
+    if not len(starts):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], np.maximum.accumulate(ends[order])
+    # A new span starts where a window begins after everything before it ended (plus the gap)
+    new = np.append(True, starts[1:] > ends[:-1] + int(gap_s * 1e9))
+    first = np.flatnonzero(new)
+    last = np.append(first[1:] - 1, len(starts) - 1)
+    return starts[first], ends[last]
+
+
+def load_hr(session, spans):
+    """HR sample times (ns) and values inside the (start, end) datetime spans, sorted."""
+    samples = samples_table(min(start for start, _ in spans))
+    rows = session.execute(
+        select(samples.c.date, samples.c.value)
+        .where(samples.c.type == HR_TYPE, or_(*(
+            (samples.c.date >= start) & (samples.c.date < end) for start, end in spans
+        )))
+        .where(samples.c.value.is_not(None))
+        .order_by(samples.c.date)
+    ).all()
+    frame = pd.DataFrame(rows, columns=["date", "value"])
+    times = pd.to_datetime(frame["date"]).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    return times, frame["value"].to_numpy(dtype=float)
+
+
+def _cursor_name(model):
+    return f"run_zones:{model.name}"
+
+
+def update_run_zones(session, model=None, recompute=False):
+    """
+    Computes time in zones for runs never computed under model and runs
+    that received HR samples since the last pass (every run with
+    recompute=True), and caches them. The caller commits.
+    Returns {"runs": computed, "with_hr": runs with samples, "seconds": s}.
+    """
+    t0 = time.perf_counter()
+    model = get_model(model)
+    name = _cursor_name(model)
+
+    # Read the cursor target first so samples arriving meanwhile are picked up next time
+    high_water = bounded_high_water(session)
+    last_id = 0 if recompute else get_cursor(session, name)
+
+    runs = pd.DataFrame(
+        session.execute(select(Run.id, Run.date, Run.duration_min).where(Run.duration_min > 0)).all(),
+        columns=["id", "date", "duration_min"],
+    )
+    ids, starts, ends = run_windows(runs)
+
+    if recompute or last_id == 0:
+        target = np.ones(len(ids), dtype=bool)
+    else:
+        done = set(session.execute(select(RunZone.run_id).where(RunZone.model == model.name).distinct()).scalars())
+        target = ~np.isin(ids, list(done))
+        # Runs whose window contains a sample added since the cursor
+        new_dates = session.execute(
+            select(Biometric.date).where(Biometric.type == HR_TYPE, Biometric.id > last_id)
+        ).scalars().all()
+        if new_dates:
+            new_times = pd.to_datetime(pd.Series(new_dates)).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+            hit, _ = locate(np.sort(new_times), starts, ends)
+            target[np.unique(hit)] = True
+
+    ids, starts, ends = ids[target], starts[target], ends[target]
+    stats = {"runs": len(ids), "with_hr": 0, "seconds": 0.0}
+
+    if len(ids):
+        # One sample query per block of run windows, reading only inside them
+        span_starts, span_ends = merge_windows(starts, ends)
+        times, hr = [], []
+        for block in range(0, len(span_starts), RUNS_PER_QUERY):
+            spans = [
+                (pd.Timestamp(lo).to_pydatetime(), pd.Timestamp(hi).to_pydatetime())
+                for lo, hi in zip(span_starts[block:block + RUNS_PER_QUERY], span_ends[block:block + RUNS_PER_QUERY])
+            ]
+            t, v = load_hr(session, spans)
+            times.append(t)
+            hr.append(v)
+        times, order = np.unique(np.concatenate(times), return_index=True)
+        hr = np.concatenate(hr)[order]
+
+        seconds, samples = time_in_zones(starts, ends, times, hr, model)
+        rows = [
+            {"run_id": int(run_id), "model": model.name, "zone": label,
+             "seconds": float(seconds[i, z]), "samples": int(samples[i, z])}
+            for i, run_id in enumerate(ids) for z, label in enumerate(model.labels)
+        ]
+
+        session.execute(delete(RunZone).where(RunZone.model == model.name, RunZone.run_id.in_(ids.tolist())))
+        insert = dialect_insert(session.connection())
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            session.execute(insert(RunZone).values(rows[start:start + INSERT_CHUNK_SIZE]))
+        stats["with_hr"] = int((samples.sum(axis=1) > 0).sum())
+
+    set_cursor(session, name, high_water)
+
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    logger.info(f"Run zones ({model.name}) updated: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    # python -m runlytics.processing.zones [model] [--recompute]
+    import sys
+    from runlytics.database.models import Base
+    from runlytics.database.manager import get_engine, session_scope
+
+    Base.metadata.create_all(bind=get_engine(), tables=[RunZone.__table__, DerivedState.__table__])
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    with session_scope() as session:
+        stats = update_run_zones(session, model=args[0] if args else None, recompute="--recompute" in sys.argv)
+    print(f"Run zones complete: {stats}")
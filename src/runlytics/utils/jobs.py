@@ -0,0 +1,113 @@
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from runlytics.utils.logger import request_id_var
+
+logger = logging.getLogger("jobs")
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+class JobQueue:
+    """
+    Runs blocking work (DB writes, Strava/Sheets calls) on a bounded thread
+    pool so it never sits on the event loop.
+
+    Jobs submitted with a `source` are coalesced: while a job for that
+    source is queued or running, further triggers return the same job.
+    Job functions may return a dict; its "rows" entry is reported as the
+    job's row count. Jobs run in a copy of the submitter's context, so the
+    request id (and any other context variables) follow the work.
+    """
+
+    def __init__(self, max_workers=2, history=200):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._history = history
+        self._jobs = OrderedDict()
+        self._futures = {}
+        self._active = {}  # source -> job id
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, source=None, **kwargs):
+        """Enqueues fn(*args, **kwargs). Returns (job, created)."""
+        with self._lock:
+            if source is not None and source in self._active:
+                job = self._jobs[self._active[source]]
+                job["coalesced"] += 1
+                return dict(job), False
+
+            job = {
+                "id": uuid.uuid4().hex,
+                "kind": kind,
+                "source": source,
+                "status": QUEUED,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "started_at": None,
+                "finished_at": None,
+                "duration_s": None,
+                "rows": None,
+                "result": None,
+                "error": None,
+                "coalesced": 0,
+                "request_id": request_id_var.get(),
+            }
+            self._jobs[job["id"]] = job
+            if source is not None:
+                self._active[source] = job["id"]
+            self._trim()
+
+            context = contextvars.copy_context()
+            self._futures[job["id"]] = self._executor.submit(context.run, self._run, job["id"], fn, args, kwargs)
+            return dict(job), True
+
+    def get(self, job_id):
+        """Snapshot of a job, or None if unknown/expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def future(self, job_id):
+        """The concurrent.futures.Future for a job (resolves to the function's return value)."""
+        with self._lock:
+            return self._futures.get(job_id)
+
+    def _run(self, job_id, fn, args, kwargs):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = RUNNING
+            job["started_at"] = datetime.now(timezone.utc).isoformat()
+        t0 = time.perf_counter()
+
+        try:
+            result = fn(*args, **kwargs)
+            update = {"status": SUCCEEDED, "result": result}
+            if isinstance(result, dict):
+                update["rows"] = result.get("rows")
+            return result
+        except Exception as e:
+            logger.error(f"Job {job['kind']} {job_id} failed: {e}")
+            update = {"status": FAILED, "error": str(e)}
+            raise
+        finally:
+            update["duration_s"] = round(time.perf_counter() - t0, 3)
+            update["finished_at"] = datetime.now(timezone.utc).isoformat()
+            with self._lock:
+                job.update(update)
+                if self._active.get(job["source"]) == job_id:
+                    del self._active[job["source"]]
+
+    def _trim(self):
+        # Forget the oldest finished jobs beyond the history limit
+        finished = [jid for jid, j in self._jobs.items() if j["status"] in (SUCCEEDED, FAILED)]
+        for jid in finished[:max(len(self._jobs) - self._history, 0)]:
+            del self._jobs[jid]
+            self._futures.pop(jid, None)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
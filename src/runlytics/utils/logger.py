@@ -0,0 +1,55 @@
+"""
+Logging setup shared by the service and the sync jobs.
+
+LOG_FORMAT=json writes one JSON object per line (timestamp, level, logger,
+message, request id and any `extra` fields); the default keeps the plain
+"LEVEL:logger:message" lines. The request id of the HTTP request (or the
+job it queued) is attached to every record from request_id_var.
+"""
+import os
+import json
+import logging
+import contextvars
+from datetime import datetime, timezone
+
+# Set per HTTP request by the webhook middleware; copied into queued jobs
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        entry.update({k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(fmt=None, level=None):
+    """Installs the root handler (replacing basicConfig's). fmt: "json" or "text"."""
+    fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+    level = level or os.getenv("LOG_LEVEL", "INFO").upper()
+
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(logging.BASIC_FORMAT))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
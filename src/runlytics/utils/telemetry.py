@@ -0,0 +1,292 @@
+"""
+In-process instrumentation: timing spans, counters and histograms,
+rendered in the Prometheus text format for /metrics (no client library).
+
+    with operation("ingest") as op:
+        with span("parse"):
+            ...
+        op.add_rows("biometrics", n)
+
+An operation collects the time of the spans inside it and, when it ends,
+records its duration, per-stage totals and row counts, and logs one
+structured "operation finished" line. Spans measure self time (time in a
+nested span counts only for the inner one), so stages add up to the
+operation. Spans outside an operation are recorded on their own.
+
+TELEMETRY=0 turns operation() and span() into shared no-op objects.
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+
+from runlytics.utils.logger import request_id_var
+
+logger = logging.getLogger("telemetry")
+
+ENABLED = os.getenv("TELEMETRY", "1").lower() not in ("0", "false", "")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+_operation_var = contextvars.ContextVar("operation", default=None)
+_span_var = contextvars.ContextVar("span", default=None)
+
+
+# --- Metrics ---
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self, key, value):
+        counts, total, count = value
+        lines = [
+            f"{self.name}_bucket{_labels(self.labelnames, key, [('le', bound)])} {n}"
+            for bound, n in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        # Callables returning extra exposition lines at scrape time (e.g. pool stats)
+        self.collectors = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+OPERATION_SECONDS = REGISTRY.add(Histogram(
+    "runlytics_operation_seconds", "Duration of ingests, syncs and reports.", ["operation", "status"]))
+STAGE_SECONDS = REGISTRY.add(Histogram(
+    "runlytics_stage_seconds", "Self time per stage of an operation.", ["operation", "stage"]))
+ROWS_TOTAL = REGISTRY.add(Counter(
+    "runlytics_rows_total", "Rows handled per operation and kind.", ["operation", "kind"]))
+ROWS_PER_SECOND = REGISTRY.add(Gauge(
+    "runlytics_rows_per_second", "Rows per second of the last run of each operation.", ["operation"]))
+PAYLOAD_BYTES = REGISTRY.add(Histogram(
+    "runlytics_payload_bytes", "Request body sizes as received.", ["operation", "format", "encoding"], buckets=SIZE_BUCKETS))
+HTTP_SECONDS = REGISTRY.add(Histogram(
+    "runlytics_http_request_seconds", "HTTP request latency.", ["method", "route", "status"]))
+
+
+def _pool_lines():
+    """Connection pool gauges from runlytics.database.manager.pool_stats()."""
+    from sqlalchemy.engine import make_url
+    from runlytics.database.manager import pool_stats
+
+    fields = {
+        "checked_out": ("runlytics_db_pool_checked_out", "gauge", "Connections in use."),
+        "saturation": ("runlytics_db_pool_saturation", "gauge", "Checked-out share of pool capacity."),
+        "checkouts": ("runlytics_db_pool_checkouts_total", "counter", "Pool checkouts."),
+        "checkout_timeouts": ("runlytics_db_pool_checkout_timeouts_total", "counter", "Checkouts that timed out."),
+        "checkout_wait_max_ms": ("runlytics_db_pool_checkout_wait_max_ms", "gauge", "Longest checkout wait."),
+    }
+    # Keyed by database URL; never export the password
+    stats = {make_url(url).render_as_string(hide_password=True): entry for url, entry in pool_stats().items()}
+    lines = []
+    for field, (name, kind, help) in fields.items():
+        samples = [(engine, entry[field]) for engine, entry in stats.items() if field in entry]
+        if samples:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            lines += [f'{name}{{engine="{_escape(engine)}"}} {value}' for engine, value in samples]
+    return lines
+
+
+REGISTRY.collectors.append(_pool_lines)
+
+
+def render_metrics():
+    return REGISTRY.render()
+
+
+# --- Spans ---
+
+class _Noop:
+    """Stands in for spans and operations when telemetry is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_rows(self, kind, rows):
+        pass
+
+
+_NOOP = _Noop()
+
+
+class Operation:
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.rows = {}
+        self.request_id = request_id_var.get()
+
+    def add_rows(self, kind, rows):
+        self.rows[kind] = self.rows.get(kind, 0) + rows
+
+    def __enter__(self):
+        self._token = _operation_var.set(self)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._t0
+        _operation_var.reset(self._token)
+        status = "error" if exc_type else "ok"
+
+        OPERATION_SECONDS.observe(duration, operation=self.name, status=status)
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, operation=self.name, stage=stage)
+        for kind, rows in self.rows.items():
+            ROWS_TOTAL.inc(rows, operation=self.name, kind=kind)
+        total_rows = sum(self.rows.values())
+        if total_rows and duration:
+            ROWS_PER_SECOND.set(round(total_rows / duration, 1), operation=self.name)
+
+        logger.info("operation finished", extra={
+            "operation": self.name,
+            "status": status,
+            "duration_s": round(duration, 4),
+            "stages": {k: round(v, 4) for k, v in self.stages.items()},
+            "rows": self.rows,
+        })
+        return False
+
+
+class Span:
+    __slots__ = ("stage", "operation", "_t0", "_token", "_parent", "_child")
+
+    def __init__(self, stage, operation=None):
+        self.stage = stage
+        self.operation = operation
+
+    def __enter__(self):
+        self._parent = _span_var.get()
+        self._token = _span_var.set(self)
+        self._child = 0.0
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._t0
+        _span_var.reset(self._token)
+        if self._parent is not None:
+            self._parent._child += elapsed
+
+        self_time = elapsed - self._child
+        op = _operation_var.get()
+        if op is not None and self.operation in (None, op.name):
+            op.stages[self.stage] = op.stages.get(self.stage, 0.0) + self_time
+        else:
+            STAGE_SECONDS.observe(self_time, operation=self.operation or "none", stage=self.stage)
+        return False
+
+
+def operation(name):
+    """Context manager around one ingest/sync/report; yields an object with add_rows(kind, n)."""
+    return Operation(name) if ENABLED else _NOOP
+
+
+def span(stage, operation=None):
+    """Times a stage of the current operation (or of `operation`, when used outside one)."""
+    return Span(stage, operation) if ENABLED else _NOOP
+
+
+def observe_payload(size, operation, fmt, encoding):
+    if ENABLED:
+        PAYLOAD_BYTES.observe(size, operation=operation, format=fmt, encoding=encoding)
+
+
+def observe_request(seconds, method, route, status):
+    if ENABLED:
+        HTTP_SECONDS.observe(seconds, method=method, route=route, status=status)
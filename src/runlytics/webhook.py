@@ -1,122 +1,496 @@
 import os
+import time
+import uuid
+import asyncio
 import logging
-from fastapi import FastAPI, Request, HTTPException, Security, Header
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import insert
+import tempfile
+import importlib
+import threading
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response, HTTPException, Security, Header
+from fastapi.responses import JSONResponse
+from dotenv import load_dotenv
+
+# --- ENVIRONMENT ---
+# Before any setting below is read (API_KEY, DATABASE_URL, LOG_FORMAT, ...)
+load_dotenv()
 
 # --- IMPORTS ---
-from runlytics.database.models import Base, Run, Biometric
-from runlytics.processing.health_parser import HealthParser
-from runlytics.ingestion.journal_ingest import sync_journal_entry_point
-from runlytics.ingestion.strava_ingest import sync_strava_entry_point
+# Only what the routes need to answer. Database models, pandas and the
+# Strava/Sheets integrations are imported where they are used (and ahead
+# of time by the startup warm-up), so a cold start serves / quickly.
+from runlytics.utils.jobs import JobQueue
+from runlytics.utils.logger import configure_logging, request_id_var
+from runlytics.utils.telemetry import operation, span, observe_payload, observe_request, render_metrics
 
 # --- LOGGING ---
-logging.basicConfig(level=logging.INFO)
+# LOG_FORMAT=json for one JSON object per line (with the request id)
+configure_logging()
 logger = logging.getLogger("webhook")
 
-app = FastAPI()
-
 # --- DATABASE SETUP ---
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-# Fix for Render/Supabase SSL requirements
-if DATABASE_URL and "sslmode" not in DATABASE_URL:
-    DATABASE_URL += "?sslmode=require"
+# Shared engine from runlytics.database.manager (also used by the sync jobs and AICoach).
+# Tables are checked once per process, by the warm-up or the first job that needs them.
+_schema_lock = threading.Lock()
+_schema_ready = False
 
-engine = None
-SessionLocal = None
+def ensure_schema():
+    """Creates missing tables (and the compact view) on first call; later calls return at once."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        from runlytics.database.models import Base
+        from runlytics.database.manager import get_engine
+        from runlytics.database.compact import COMPACT_ENABLED, create_compact_storage
 
-if DATABASE_URL:
-    try:
-        # pool_pre_ping=True prevents "Database has gone away" errors
-        engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        
-        # Create tables if they don't exist
-        Base.metadata.create_all(bind=engine)
+        Base.metadata.create_all(bind=get_engine())
+        if COMPACT_ENABLED:
+            create_compact_storage(get_engine())
+        _schema_ready = True
         logger.info("Database connection established and tables checked.")
-    except Exception as e:
-        logger.error(f"Database connection failed: {e}")
+
+# --- WARM-UP ---
+# After startup, a background thread checks the schema and imports the job
+# modules so the first ingest/sync doesn't pay for them. STARTUP_WARMUP=0
+# leaves both to the first request.
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1").lower() not in ("0", "false")
+WARMUP_MODULES = [
+    "runlytics.processing.payloads",
+    "runlytics.database.bulk",
+    "runlytics.database.sync_state",
+    "runlytics.database.rollups",
+    "runlytics.analysis.metrics",
+    "runlytics.processing.gis",
+    "runlytics.processing.spatial",
+    "runlytics.processing.zones",
+    "runlytics.ingestion.strava_ingest",
+    "runlytics.ingestion.journal_ingest",
+]
+
+def warm_up():
+    t0 = time.perf_counter()
+    for name in WARMUP_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logger.warning(f"Warm-up could not import {name}: {e}")
+    if database_configured():
+        try:
+            ensure_schema()
+        except Exception as e:
+            # Retried by the first job that needs the database
+            logger.error(f"Database connection failed: {e}")
+    logger.info(f"Warm-up finished in {time.perf_counter() - t0:.2f}s")
+
+def database_configured():
+    return bool(os.getenv("DATABASE_URL"))
+
+@asynccontextmanager
+async def lifespan(app):
+    if STARTUP_WARMUP:
+        threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # --- SECURITY ---
 API_KEY_NAME = "X-API-KEY"
 EXPECTED_API_KEY = os.getenv("API_KEY", "default_insecure_key")
 
+# --- INGEST ---
+# Rows written per statement; keeps memory flat on large backfill pushes
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+# Bodies are spooled to a temp file (RAM up to this size, then disk) and parsed by a worker
+INGEST_SPOOL_BYTES = int(os.getenv("INGEST_SPOOL_BYTES", str(1024 * 1024)))
+INGEST_READ_BYTES = 64 * 1024
+# Newest stored sample per (type, source); points at or before it are dropped before the write
+_watermarks = None
+
+def get_watermarks():
+    """The process-wide IngestWatermarks cache (created on first use)."""
+    global _watermarks
+    if _watermarks is None:
+        from runlytics.database.sync_state import IngestWatermarks
+        _watermarks = IngestWatermarks()
+    return _watermarks
+
+# --- JOBS ---
+# Blocking work (DB writes, Strava/Sheets calls) runs here, off the event loop
+jobs = JobQueue(max_workers=int(os.getenv("JOB_WORKERS", "2")))
+
 async def get_api_key(api_key_header: str = Header(None, alias=API_KEY_NAME)):
     if api_key_header != EXPECTED_API_KEY:
         raise HTTPException(status_code=403, detail="Invalid API Key")
     return api_key_header
 
+async def get_metrics_key(api_key_header: str = Header(None, alias=API_KEY_NAME), authorization: str = Header(None)):
+    # Prometheus sends credentials as "Authorization: Bearer <key>"
+    bearer = authorization[7:] if authorization and authorization.lower().startswith("bearer ") else None
+    if EXPECTED_API_KEY not in (api_key_header, bearer):
+        raise HTTPException(status_code=403, detail="Invalid API Key")
+    return EXPECTED_API_KEY
+
+# --- REQUEST IDS ---
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    """Tags the request (and the jobs it queues) with an id and records its latency."""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        # Route templates, not raw paths, keep the label set bounded
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        observe_request(time.perf_counter() - t0, request.method, route, str(status))
+        request_id_var.reset(token)
+
 # --- ROUTES ---
 
 @app.get("/")
 def health_check():
     return {"status": "online", "service": "Runlytics V5"}
 
+@app.get("/stats/db")
+def db_stats(api_key: str = Security(get_api_key)):
+    """Connection pool checkout latency and saturation."""
+    from runlytics.database.manager import pool_stats
+    return pool_stats()
+
+@app.get("/metrics")
+def metrics(api_key: str = Security(get_metrics_key)):
+    """Prometheus text exposition: stage latencies, rows, payload sizes, pool stats."""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def write_batch(session, kind, rows, counts):
+    """Writes one parsed batch to the database and adds to the running counts."""
+    from runlytics.database.bulk import load_biometrics, upsert_runs, APPLE_HEALTH_RUN_POLICY
+    from runlytics.database.rollups import touched_buckets, merge_buckets
+
+    if kind == "biometrics":
+        stats = load_biometrics(session, rows)
+        counts["biometrics"] += stats["rows"]
+        counts["biometrics_inserted"] += stats["inserted"]
+        counts["biometrics_seconds"] += stats["seconds"]
+        # Nothing new in this batch means its rollup buckets are unchanged
+        if stats["inserted"]:
+            merge_buckets(counts["rollup_buckets"], touched_buckets(rows))
+    elif kind == "runs":
+        stats = upsert_runs(session, rows, policy=APPLE_HEALTH_RUN_POLICY)
+        counts["runs"] += stats["rows"]
+        # Resent, unchanged runs don't need their derived tables refreshed
+        counts["runs_written"] += stats["written"]
+        counts["run_dates"].extend(stats["dates"])
+
+async def spool_body(request):
+    """Copies the request body to a temp file (in memory up to INGEST_SPOOL_BYTES, then disk)."""
+    from runlytics.processing.payloads import MAX_DECOMPRESSED_BYTES
+
+    body = tempfile.SpooledTemporaryFile(max_size=INGEST_SPOOL_BYTES)
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_DECOMPRESSED_BYTES:
+            body.close()
+            raise HTTPException(status_code=413, detail=f"Body exceeds {MAX_DECOMPRESSED_BYTES} bytes")
+        body.write(chunk)
+    body.seek(0)
+    return body
+
+def iter_ingest_batches(body, dedup=None, fmt=None, encoding="identity"):
+    """
+    Parses the spooled body (any format/encoding in runlytics.processing.payloads)
+    into (kind, rows) batches, streaming where the format allows.
+    dedup (a WatermarkFilter) drops already-stored points while parsing.
+    """
+    from runlytics.processing.payloads import JSON, MAX_DECOMPRESSED_BYTES, iter_payload_batches
+
+    yield from iter_payload_batches(
+        body, fmt or JSON, encoding, batch_size=INGEST_BATCH_SIZE, watermarks=dedup,
+        read_bytes=INGEST_READ_BYTES, max_bytes=MAX_DECOMPRESSED_BYTES,
+    )
+
+def run_ingest(body, dedup=True, fmt=None, encoding="identity"):
+    """
+    Job body for /ingest: parses and writes the payload in one transaction,
+    then refreshes the derived tables in their own (see refresh_derived).
+    With dedup, points at or before their series' watermark are skipped.
+    """
+    with operation("ingest") as op:
+        result = _run_ingest(body, dedup, fmt, encoding)
+        op.add_rows("biometrics", result["metrics_saved"])
+        op.add_rows("skipped", result["metrics_skipped"])
+        op.add_rows("runs", result["runs_saved"])
+        return result
+
+def _run_ingest(body, dedup, fmt, encoding):
+    from runlytics.database.manager import session_scope
+    from runlytics.database.sync_state import WatermarkFilter, save_ingest_watermarks, data_watermarks, biometrics_writes
+    from runlytics.database.rollups import refresh_rollups
+
+    ensure_schema()
+    watermarks = get_watermarks()
+    counts = {"biometrics": 0, "biometrics_inserted": 0, "biometrics_seconds": 0.0, "runs": 0, "runs_written": 0, "run_dates": [], "rollup_buckets": {}}
+    dedup_filter = None
+
+    try:
+        with session_scope() as session, biometrics_writes.writing(session):
+            if dedup:
+                with span("dedup"):
+                    dedup_filter = WatermarkFilter(watermarks.load(session))
+            # Each batch is written as soon as it is parsed; one commit at the end
+            batches = iter_ingest_batches(body, dedup_filter, fmt, encoding)
+            while True:
+                with span("parse"):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                with span("db_write"):
+                    write_batch(session, *batch, counts)
+            with span("rollups"):
+                if dedup_filter is not None:
+                    save_ingest_watermarks(session, dedup_filter.pending)
+                # Recompute only the days/hours this payload added samples to
+                rollup = refresh_rollups(session, counts["rollup_buckets"])
+            with span("commit"):
+                session.commit()
+    finally:
+        body.close()
+
+    # Committed: later payloads may now skip these points, cached reports are stale
+    if dedup_filter is not None:
+        watermarks.advance(dedup_filter.pending)
+    data_watermarks.touch(*[table for table, key in (("biometrics", "biometrics_inserted"), ("runs", "runs_written")) if counts[key]])
+    skipped = dedup_filter.skipped if dedup_filter is not None else 0
+
+    with span("derived"):
+        derived_failed = refresh_derived(counts)
+
+    if counts["run_dates"]:
+        refresh_spatial_index("ingest")
+
+    count_b = counts["biometrics"]
+    count_r = counts["runs"]
+    rows_per_sec = round(count_b / counts["biometrics_seconds"], 1) if counts["biometrics_seconds"] else 0.0
+    logger.info(f"Apple Ingestion Success: {count_b} metrics ({counts['biometrics_inserted']} new, {skipped} skipped by watermark, {rows_per_sec:.0f} rows/s), {count_r} runs.")
+
+    return {
+        "rows": count_b + count_r,
+        "metrics_saved": count_b,
+        "metrics_accepted": count_b,
+        "metrics_skipped": skipped,
+        "metrics_inserted": counts["biometrics_inserted"],
+        "metrics_rows_per_sec": rows_per_sec,
+        "runs_saved": count_r,
+        "runs_written": counts["runs_written"],
+        "rollup_days_refreshed": rollup["day"],
+        "rollup_hours_refreshed": rollup["hour"],
+        "derived_failed": derived_failed,
+    }
+
+def refresh_derived(counts):
+    """
+    Derived tables for a committed ingest, each in its own transaction: the
+    raw rows are already stored, so a failing step only logs. Every step
+    picks up what an earlier failure missed on its next run, except the
+    training load and the re-shaping of rewritten routes, which only cover
+    the run dates they are given.
+    Returns the names of the steps that failed.
+    """
+    from runlytics.database.manager import session_scope
+    from runlytics.database.compact import COMPACT_ENABLED, sync_compact
+    from runlytics.analysis.metrics import update_training_load
+    from runlytics.processing.gis import update_route_shapes
+    from runlytics.processing.zones import update_run_zones
+    from runlytics.analysis.drift import update_run_drift
+
+    steps = []
+    # Move samples older than the retention window into the compact layout
+    if COMPACT_ENABLED and counts["biometrics_inserted"]:
+        steps.append(("compact", sync_compact))
+    # Extend ATL/CTL/TSB from the earliest run in the payload, simplify new and changed routes
+    if counts["run_dates"]:
+        steps.append(("training_load", lambda session: update_training_load(session, counts["run_dates"])))
+        steps.append(("route_shapes", lambda session: update_route_shapes(session, run_dates=counts["run_dates"])))
+    # Time in HR zones and drift for new runs and runs that just got samples
+    if counts["run_dates"] or counts["biometrics_inserted"]:
+        steps.append(("run_zones", update_run_zones))
+        steps.append(("run_drift", update_run_drift))
+
+    failed = []
+    for name, step in steps:
+        try:
+            with session_scope() as session:
+                step(session)
+        except Exception:
+            logger.exception(f"Derived refresh {name!r} failed; the ingested rows are committed")
+            failed.append(name)
+    return failed
+
+def refresh_spatial_index(source):
+    """Re-indexes committed new or changed routes in the on-disk spatial index (a cache: failures only log)."""
+    from runlytics.database.manager import session_scope
+    from runlytics.processing.spatial import update_index
+
+    try:
+        with span("spatial_index", operation=source), session_scope() as session:
+            update_index(session)
+    except Exception as e:
+        logger.warning(f"Spatial index update failed: {e}")
+
+def run_strava_sync():
+    from runlytics.ingestion.strava_ingest import sync_strava
+    from runlytics.database.sync_state import data_watermarks
+
+    ensure_schema()
+    result = sync_strava()
+    run_dates = result.pop("run_dates")
+    if result["rows"]:
+        # The runs are committed: derived tables are refreshed like after an ingest
+        data_watermarks.touch("runs")
+        result["derived_failed"] = refresh_derived({"biometrics_inserted": 0, "run_dates": run_dates})
+        refresh_spatial_index("strava_sync")
+    logger.info(f"Strava Sync: {result}")
+    return result
+
+def run_journal_sync(full=False):
+    from runlytics.ingestion.journal_ingest import sync_journal
+    from runlytics.database.sync_state import data_watermarks
+
+    ensure_schema()
+    result = sync_journal(full=full)
+    if result["rows"]:
+        data_watermarks.touch("daily_journal")
+    logger.info(f"Journal Sync: {result}")
+    return result
+
+def accepted(job, created):
+    """202 response for an enqueued (or coalesced) job."""
+    return JSONResponse(status_code=202, content={
+        "status": "accepted" if created else "already_queued",
+        "job_id": job["id"],
+        "job_status": job["status"],
+    })
+
 # 1. APPLE HEALTH TRIGGER
 @app.post("/ingest")
-async def ingest_data(request: Request, api_key: str = Security(get_api_key)):
-    """Receives JSON from Health Auto Export (iOS)."""
-    if not SessionLocal:
-        raise HTTPException(status_code=500, detail="Database not configured")
+async def ingest_data(request: Request, wait: bool = False, dedup: bool = True, api_key: str = Security(get_api_key)):
+    """
+    Receives Health Auto Export (iOS) payloads: JSON, NDJSON or MessagePack
+    (Content-Type), optionally gzip/zstd compressed (Content-Encoding).
+    Returns 202 + job id; ?wait=true waits for the job and returns its counts.
+    ?dedup=false writes every point, e.g. to backfill a gap older than the watermarks.
+    """
+    from runlytics.processing.payloads import PayloadTooLarge, UnsupportedPayload, payload_format
 
-    payload = await request.json()
-    parser = HealthParser(payload)
-    session = SessionLocal()
+    if not database_configured():
+        raise HTTPException(status_code=500, detail="Database not configured")
 
     try:
-        # A. Process Biometrics
-        biometrics_data = parser.parse_biometrics()
-        if biometrics_data:
-            stmt = insert(Biometric).values(biometrics_data)
-            stmt = stmt.on_conflict_do_nothing(
-                index_elements=['date', 'type', 'source'] 
-            )
-            session.execute(stmt)
-        
-        # B. Process Runs (Apple Watch)
-        runs_data = parser.parse_workouts()
-        if runs_data:
-            for r_data in runs_data:
-                local_run = session.merge(Run(**r_data))
-                session.add(local_run)
-
-        session.commit()
-        
-        count_b = len(biometrics_data)
-        count_r = len(runs_data)
-        logger.info(f"Apple Ingestion Success: {count_b} metrics, {count_r} runs.")
-        
-        return {"status": "success", "metrics_saved": count_b, "runs_saved": count_r}
+        fmt, encoding = payload_format(request.headers.get("content-type"), request.headers.get("content-encoding"))
+    except UnsupportedPayload as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+    with span("read_body", operation="ingest"):
+        body = await spool_body(request)
+    observe_payload(body.seek(0, os.SEEK_END), "ingest", fmt, encoding)
+    body.seek(0)
+    job, created = jobs.submit("ingest", run_ingest, body, dedup=dedup, fmt=fmt, encoding=encoding)
+    if not wait:
+        return accepted(job, created)
 
+    try:
+        result = await asyncio.wrap_future(jobs.future(job["id"]))
+        return {"status": "success", "job_id": job["id"], **result}
+    except PayloadTooLarge as e:
+        logger.error(f"Apple Ingestion Error: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        # Malformed body (JSON, NDJSON, MessagePack or the compression around it)
+        logger.error(f"Apple Ingestion Error: invalid payload: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid payload: {e}")
     except Exception as e:
-        session.rollback()
         logger.error(f"Apple Ingestion Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        session.close()
 
 # 2. STRAVA TRIGGER
 @app.post("/sync/strava")
 async def trigger_strava(api_key: str = Security(get_api_key)):
-    """Triggers the Strava Python Script."""
-    try:
-        status_message = sync_strava_entry_point()
-        logger.info(f"Strava Trigger: {status_message}")
-        return {"status": "success", "message": status_message}
-    except Exception as e:
-        logger.error(f"Strava Trigger Failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    """Queues a Strava sync (coalesced with one already queued or running)."""
+    job, created = jobs.submit("strava_sync", run_strava_sync, source="strava")
+    logger.info(f"Strava Trigger: job {job['id']} ({'new' if created else 'coalesced'})")
+    return accepted(job, created)
 
 # 3. JOURNAL TRIGGER
 @app.post("/sync/journal")
-async def trigger_journal(api_key: str = Security(get_api_key)):
-    """Triggers the Google Sheet Python Script."""
-    try:
-        status_message = sync_journal_entry_point()
-        logger.info(f"Journal Trigger: {status_message}")
-        return {"status": "success", "message": status_message}
-    except Exception as e:
-        logger.error(f"Journal Trigger Failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+async def trigger_journal(full: bool = False, api_key: str = Security(get_api_key)):
+    """
+    Queues a Google Sheet sync (coalesced with one of the same kind already queued or running).
+    Reads the rows added since the last sync plus a few before them; ?full=true re-reads the sheet.
+    """
+    # A full re-read isn't covered by an incremental sync in flight, so it coalesces separately
+    job, created = jobs.submit("journal_sync", run_journal_sync, full=full, source="journal:full" if full else "journal")
+    logger.info(f"Journal Trigger: job {job['id']} ({'new' if created else 'coalesced'})")
+    return accepted(job, created)
+
+# 4. COACH REPORT
+def etag_matches(if_none_match, etag):
+    """If-None-Match check: "*", or any listed tag equal to etag (weak W/ prefixes ignored)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+@app.get("/coach/report")
+def coach_report(if_none_match: str = Header(None), api_key: str = Security(get_api_key)):
+    """
+    The coach context report, rebuilt only after new biometrics/runs were
+    committed (or once it is COACH_REPORT_MAX_AGE old). Send the ETag back
+    as If-None-Match to get a 304 while it is unchanged.
+    """
+    from runlytics.analysis.coach import report_cache
+
+    body, etag = report_cache.get()
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+@app.get("/analysis/correlations")
+def lagged_correlations(target: str = None, max_lag: int = None, limit: int = 20, api_key: str = Security(get_api_key)):
+    """
+    Strongest lagged correlations between daily features (journal scores,
+    biometric rollups, run pace/HR/efficiency): feature on day t against
+    target on day t + lag. Filter on a target such as run:pace_min_per_km.
+    Only the last few days are recomputed after new data is committed.
+    """
+    from runlytics.analysis.correlations import correlation_cache
+
+    pairs, days, features = correlation_cache.top(target=target, max_lag=max_lag, limit=max(1, min(limit, 500)))
+    if target is not None and target not in features:
+        raise HTTPException(status_code=404, detail=f"Unknown feature {target!r}")
+    return {
+        "days": days,
+        "features": features,
+        "max_lag": correlation_cache.max_lag,
+        "pairs": [
+            {"feature": p.feature, "target": p.target, "lag": int(p.lag), "r": round(float(p.r), 4), "n": int(p.n)}
+            for p in pairs.itertuples()
+        ],
+    }
+
+# 5. JOB STATUS
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str, api_key: str = Security(get_api_key)):
+    """Status, duration and row counts of a queued job."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job
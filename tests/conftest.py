@@ -0,0 +1,20 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT / "src"), str(ROOT)]
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A fresh SQLite database with every table, as DATABASE_URL."""
+    from runlytics.database.models import Base
+    from runlytics.database.manager import get_engine
+
+    url = f"sqlite:///{tmp_path / 'runlytics.db'}"
+    monkeypatch.setenv("DATABASE_URL", url)
+    Base.metadata.create_all(bind=get_engine(url))
+    return url
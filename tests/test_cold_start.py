@@ -0,0 +1,19 @@
+import statistics
+
+from benchmarks.bench_cold_start import DEFERRED_MODULES, IMPORT_BUDGET_S, environment, measure_import
+
+# Fresh interpreters per budget check; the median smooths out one slow start
+IMPORT_RUNS = 3
+
+
+def test_webhook_import_defers_heavy_modules(tmp_path):
+    """`import runlytics.webhook` in a fresh interpreter loads none of DEFERRED_MODULES."""
+    probe = measure_import(environment(tmp_path / "cold_start.db"))
+    assert probe["loaded"] == [], f"import runlytics.webhook loaded {probe['loaded']}"
+
+
+def test_webhook_import_within_budget(tmp_path):
+    """The median `import runlytics.webhook` stays under IMPORT_BUDGET_S (COLD_START_BUDGET_S)."""
+    env = environment(tmp_path / "cold_start.db")
+    seconds = statistics.median(measure_import(env)["seconds"] for _ in range(IMPORT_RUNS))
+    assert seconds <= IMPORT_BUDGET_S, f"import runlytics.webhook took {seconds:.3f}s, budget {IMPORT_BUDGET_S:.3f}s"
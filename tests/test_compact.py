@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+import pandas as pd
+from sqlalchemy import select, func
+
+from runlytics.database import compact
+from runlytics.database.models import Biometric, BiometricDaily
+from runlytics.database.manager import session_scope, get_engine
+from runlytics.database.rollups import touched_buckets, refresh_rollups
+
+
+def samples(day, minutes):
+    return [
+        {"date": (day + timedelta(minutes=m)).to_pydatetime(), "type": "heart_rate", "value": 100 + m, "unit": "count/min", "source": "watch"}
+        for m in minutes
+    ]
+
+
+def test_sample_in_several_tiers_is_counted_once(database, monkeypatch):
+    monkeypatch.setattr(compact, "COMPACT_ENABLED", True)
+    compact.create_compact_storage(get_engine(database))
+    day = pd.Timestamp.now().normalize() - pd.Timedelta(days=compact.PACK_AFTER_DAYS + 10)
+    rows = samples(day, range(60))
+
+    # An hour of history, compacted and packed into a daily block...
+    with session_scope() as session:
+        session.add_all([Biometric(**row) for row in rows])
+        session.flush()
+        compact.sync_compact(session)
+        compact.pack_blocks(session)
+    # ...then partly re-sent by a backfill with dedup off: some rows end up as points, some stay raw
+    with session_scope() as session:
+        session.add_all([Biometric(**row) for row in rows[:20]])
+        session.flush()
+        compact.sync_compact(session)
+        session.add_all([Biometric(**row) for row in rows[10:30]])
+        rollups = refresh_rollups(session, touched_buckets(rows))
+    assert rollups["day"] == 1
+
+    with session_scope() as session:
+        daily = session.execute(select(BiometricDaily.samples, BiometricDaily.value_sum)).one()
+        viewed = session.execute(select(func.count()).select_from(compact.VIEW)).scalar()
+        ranged = compact.read_range(session, "heart_rate", day, day + pd.Timedelta(days=1))
+    assert tuple(daily) == (60, sum(row["value"] for row in rows))
+    assert viewed == 60
+    assert ranged["date"].is_unique and len(ranged) == 60
@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from runlytics.analysis.drift import run_windows, compute_drift, HR_TYPE, DISTANCE_TYPE
+
+
+def test_overlapping_runs_each_get_their_samples():
+    start = datetime(2024, 3, 1, 7, 0)
+    # The same run recorded twice (second copy starts 5 minutes later) and a later run
+    runs = pd.DataFrame({
+        "id": [1, 2, 3],
+        "date": [start, start + timedelta(minutes=5), start + timedelta(minutes=100)],
+        "duration_min": [30, 30, 30],
+    })
+    minutes = np.arange(130)
+    dates = [start + timedelta(minutes=int(m)) for m in minutes]
+    samples = pd.DataFrame({
+        "date": dates * 2,
+        "type": [HR_TYPE] * len(dates) + [DISTANCE_TYPE] * len(dates),
+        "value": np.concatenate([140 + minutes % 100 / 10, np.full(len(dates), 0.2)]),
+    })
+
+    drift = compute_drift(run_windows(runs), samples, workers=1).set_index("run_id")
+    assert drift["hr_samples"].tolist() == [30, 30, 30]
+    assert drift["speed_first"].tolist() == drift["speed_second"].tolist() == [0.2, 0.2, 0.2]
+    # HR rises steadily within each run at a constant pace
+    assert (drift["hr_drift_pct"] > 0).all()
@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from runlytics.database.models import RouteShape
+from runlytics.database.manager import session_scope
+from runlytics.database.bulk import upsert_runs, APPLE_HEALTH_RUN_POLICY
+from runlytics.processing.gis import update_route_shapes
+
+START = datetime(2024, 5, 1, 7, 0, tzinfo=timezone.utc)
+
+
+def run(route=None):
+    return {"date": START, "distance_km": 5.0, "duration_min": 30.0, "source": "apple_health", "route_json": route}
+
+
+def shape_points():
+    with session_scope() as session:
+        return set(session.execute(select(RouteShape.points)).scalars())
+
+
+def test_route_arriving_later_replaces_empty_shape(database):
+    with session_scope() as session:
+        upsert_runs(session, [run(route=[])], policy=APPLE_HEALTH_RUN_POLICY)
+        update_route_shapes(session)
+    assert shape_points() == {0}
+
+    # The workout is resent once its route has synced
+    route = [{"lat": 51.5 + i * 1e-3, "lon": -0.1 + (i % 2) * 1e-3} for i in range(20)]
+    with session_scope() as session:
+        stats = upsert_runs(session, [run(route=route)], policy=APPLE_HEALTH_RUN_POLICY)
+        assert stats["written"] == 1
+        # Without the rewritten dates the stored empty shape is kept
+        assert update_route_shapes(session)["runs"] == 0
+        assert update_route_shapes(session, run_dates=stats["dates"])["runs"] == 1
+    assert min(shape_points()) >= 2
+
+    # An unchanged resend isn't rewritten, so nothing is re-shaped
+    with session_scope() as session:
+        stats = upsert_runs(session, [run(route=route)], policy=APPLE_HEALTH_RUN_POLICY)
+        assert update_route_shapes(session, run_dates=stats["dates"])["runs"] == 0
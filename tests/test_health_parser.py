@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from runlytics.processing import health_parser
+from runlytics.processing.health_parser import HealthStream
+
+
+def stream_rows(body, chunk=4096):
+    stream, rows = HealthStream(batch_size=100), 0
+    for start in range(0, len(body), chunk):
+        rows += sum(len(batch) for _, batch in stream.feed(body[start:start + chunk]))
+    return rows + sum(len(batch) for _, batch in stream.close())
+
+
+def metric_body(points, name_first):
+    data = [{"date": f"2024-01-01 00:{i % 60:02d}:{i // 60 % 60:02d} +0000", "qty": 60 + i % 100} for i in range(points)]
+    fields = [("name", "heart_rate"), ("units", "count/min"), ("data", data)]
+    metric = dict(fields if name_first else fields[::-1])
+    return json.dumps({"data": {"metrics": [metric]}}).encode()
+
+
+def test_points_before_name_are_held_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(health_parser, "MAX_UNNAMED_POINTS", 500)
+    assert stream_rows(metric_body(400, name_first=False)) == 400
+    assert stream_rows(metric_body(2000, name_first=True)) == 2000
+    with pytest.raises(ValueError, match="before its name"):
+        stream_rows(metric_body(2000, name_first=False))
@@ -0,0 +1,60 @@
+from datetime import date
+
+from sqlalchemy import select
+
+from runlytics.database.models import DailyJournal
+from runlytics.database.manager import session_scope
+from runlytics.database.sync_state import get_cursor
+from runlytics.ingestion.journal_ingest import ListSheet, sync_journal, ROW_CURSOR
+
+HEADER = ["Date", "RPE (Exertion)", "Mood / Motivation", "Soreness", "Knee Pain", "Sleep Quality", "Notes"]
+
+
+def row(day, rpe=5, notes=""):
+    return [f"2024-01-{day:02d}", str(rpe), "4", "2", "0", "3", notes]
+
+
+def journal():
+    with session_scope() as session:
+        return dict(session.execute(select(DailyJournal.date, DailyJournal.rpe)).all())
+
+
+def cursor():
+    with session_scope() as session:
+        return get_cursor(session, ROW_CURSOR)
+
+
+def test_incremental_sync_reads_tail_and_skips_unchanged(database):
+    sheet = ListSheet([HEADER] + [row(day) for day in range(1, 21)])
+    first = sync_journal(sheet)
+    assert first["rows"] == 20
+    assert cursor() == 21
+
+    # An edit inside the overlap window and two new rows
+    sheet.rows[20] = row(20, rpe=9)
+    sheet.rows += [row(21), row(22)]
+    second = sync_journal(sheet)
+    assert second["first_row"] > 2
+    assert second["rows"] == 3
+    assert cursor() == 23
+    assert journal()[date(2024, 1, 20)] == 9
+
+    assert sync_journal(sheet)["rows"] == 0
+
+
+def test_header_without_date_keeps_cursor(database):
+    sheet = ListSheet([HEADER] + [row(day) for day in range(1, 11)])
+    sync_journal(sheet)
+    assert cursor() == 11
+
+    # Rows added while the Date column is renamed can't be parsed...
+    sheet.rows[0] = ["Day"] + HEADER[1:]
+    sheet.rows += [row(11), row(12)]
+    assert sync_journal(sheet)["rows"] == 0
+    assert cursor() == 11
+
+    # ...so they are picked up once the header is fixed
+    sheet.rows[0] = HEADER
+    assert sync_journal(sheet)["rows"] == 2
+    assert cursor() == 13
+    assert len(journal()) == 12
@@ -0,0 +1,37 @@
+import io
+import json
+
+import pytest
+
+from runlytics.processing import payloads
+from runlytics.processing.payloads import PayloadTooLarge, iter_payload_batches, NDJSON
+
+
+def ndjson_body(points):
+    lines = [
+        json.dumps({"name": "heart_rate", "units": "count/min", "date": f"2024-01-01 00:{i // 60:02d}:{i % 60:02d} +0000", "qty": 60 + i})
+        for i in range(points)
+    ]
+    # Blank lines and a missing final newline are accepted
+    return ("\n".join(lines[:10]) + "\n\n" + "\n".join(lines[10:])).encode()
+
+
+def rows(body, **kwargs):
+    return sum(len(batch) for _, batch in iter_payload_batches(io.BytesIO(body), NDJSON, **kwargs))
+
+
+def test_ndjson_lines_split_across_reads():
+    body = ndjson_body(300)
+    assert rows(body) == 300
+    # Reads far shorter than a line, and reads holding many lines
+    assert rows(body, read_bytes=7) == rows(body, read_bytes=4096) == 300
+
+
+def test_ndjson_line_over_the_cap_is_rejected(monkeypatch):
+    monkeypatch.setattr(payloads, "MAX_NDJSON_LINE_BYTES", 200)
+    assert rows(ndjson_body(50), read_bytes=16) == 50
+
+    # A line with no newline in sight is rejected before the whole body is buffered
+    long_line = json.dumps({"name": "heart_rate", "note": "x" * 1000}).encode()
+    with pytest.raises(PayloadTooLarge, match="NDJSON line exceeds 200 bytes"):
+        rows(ndjson_body(5) + b"\n" + long_line, read_bytes=16)
@@ -0,0 +1,149 @@
+import json
+import threading
+from urllib.parse import urlsplit, parse_qs
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from runlytics.ingestion.strava_client import (
+    StravaClient, StravaAPIError, StravaRateLimitError, RateLimiter, retry_after_seconds,
+)
+
+
+class StubStrava:
+    """
+    Local HTTP server answering each GET with the next scripted (status, headers, body),
+    or with responses(path) when given a function.
+    """
+
+    def __init__(self, responses):
+        self.responses = responses if callable(responses) else list(responses)
+        self.requests = []
+        self.tokens = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append(self.path)
+                stub.tokens.append(self.headers.get("Authorization"))
+                status, headers, body = stub.responses(self.path) if callable(stub.responses) else stub.responses.pop(0)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def client(url, **kwargs):
+    sleeps = []
+    kwargs.setdefault("limiter", RateLimiter(sleep=sleeps.append))
+    return StravaClient("token", base_url=url, backoff_s=0.5, sleep=sleeps.append, **kwargs), sleeps
+
+
+def test_retry_after_seconds():
+    now = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+    later = format_datetime(now + timedelta(seconds=90), usegmt=True)
+    assert retry_after_seconds("30") == 30
+    assert retry_after_seconds(later, now=now.timestamp()) == pytest.approx(90)
+    assert retry_after_seconds(format_datetime(now - timedelta(hours=1), usegmt=True), now=now.timestamp()) == 0
+    assert retry_after_seconds("soon") is None
+    assert retry_after_seconds("inf") is None
+    assert retry_after_seconds(None) is None
+
+
+def test_retries_429_and_5xx():
+    retry_at = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=120), usegmt=True)
+    responses = [
+        (429, {"Retry-After": "7"}, {"message": "Rate Limit Exceeded"}),
+        (429, {"Retry-After": retry_at}, {"message": "Rate Limit Exceeded"}),
+        (503, {}, {"message": "Unavailable"}),
+        (200, {"X-RateLimit-Limit": "100,1000", "X-RateLimit-Usage": "10,20"}, [{"id": 1}]),
+    ]
+    with StubStrava(responses) as stub:
+        strava, sleeps = client(stub.url)
+        assert strava.get("/athlete/activities") == [{"id": 1}]
+
+    assert len(stub.requests) == 4
+    assert sleeps[0] == 7
+    # The HTTP-date is honoured rather than crashing the sync
+    assert 100 < sleeps[1] <= 120
+    # 5xx falls back to exponential backoff (attempt 2: 0.5 * 4 plus jitter)
+    assert 2.0 <= sleeps[2] <= 2.5
+    assert (strava.limiter.used_15min, strava.limiter.used_daily) == (10, 20)
+
+
+def test_gives_up_after_max_retries():
+    with StubStrava([(500, {}, {"message": "error"})] * 3) as stub:
+        strava, _ = client(stub.url, max_retries=2)
+        with pytest.raises(StravaAPIError, match="500 after 3 attempts"):
+            strava.get("/athlete/activities")
+    assert len(stub.requests) == 3
+
+
+def test_daily_budget_from_headers_stops_requests():
+    spent = {"X-ReadRateLimit-Limit": "100,1000", "X-ReadRateLimit-Usage": "5,999"}
+    with StubStrava([(200, spent, [])]) as stub:
+        strava, _ = client(stub.url)
+        assert strava.get("/athlete/activities") == []
+        with pytest.raises(StravaRateLimitError):
+            strava.get("/athlete/activities")
+    assert len(stub.requests) == 1
+
+
+def test_fetch_activities_pages_in_growing_windows_until_a_short_page():
+    # Pages 1-3 are full, page 4 is short
+    sizes = {1: 2, 2: 2, 3: 2, 4: 1}
+
+    def activities(path):
+        n = int(parse_qs(urlsplit(path).query)["page"][0])
+        return 200, {}, [{"id": n * 10 + i} for i in range(sizes.get(n, 0))]
+
+    with StubStrava(activities) as stub:
+        strava, _ = client(stub.url, per_page=2, max_workers=2)
+        fetched = strava.fetch_activities(after_ts=1_700_000_000)
+
+    assert [a["id"] for a in fetched] == [10, 11, 20, 21, 30, 31, 40]
+    # Windows of 1, 2 and 2 pages: page 5 shares a window with the short page, nothing later is asked for
+    pages = sorted(int(parse_qs(urlsplit(path).query)["page"][0]) for path in stub.requests)
+    assert pages == [1, 2, 3, 4, 5]
+    assert all("after=1700000000" in path for path in stub.requests)
+
+
+def test_refreshes_expired_token_once():
+    refreshed = []
+
+    def refresh():
+        refreshed.append(True)
+        return "fresh"
+
+    with StubStrava([(401, {}, {"message": "Authorization Error"}), (200, {}, [{"id": 1}])]) as stub:
+        strava, _ = client(stub.url, refresh_token_fn=refresh, on_refresh=refreshed.append)
+        assert strava.get("/athlete/activities") == [{"id": 1}]
+    assert stub.tokens == ["Bearer token", "Bearer fresh"]
+    assert refreshed == [True, "fresh"]
+
+    # A refreshed token that is rejected again raises instead of refreshing in a loop
+    with StubStrava([(401, {}, {"message": "Authorization Error"})] * 2) as stub:
+        strava, _ = client(stub.url, refresh_token_fn=lambda: "fresh")
+        with pytest.raises(StravaAPIError, match="rejected the refreshed token"):
+            strava.get("/athlete/activities")
+    assert len(stub.requests) == 2
@@ -0,0 +1,27 @@
+import os
+import sys
+import json
+import subprocess
+
+from benchmarks.bench_cold_start import SRC
+
+# Points python-dotenv's search at the test's .env, then reports the settings the webhook read
+PROBE = """
+import sys, json
+import dotenv.main
+dotenv.main.find_dotenv = lambda *args, **kwargs: sys.argv[1]
+import runlytics.webhook as webhook
+print(json.dumps({"key": webhook.EXPECTED_API_KEY, "db": webhook.database_configured()}))
+"""
+
+
+def test_settings_only_in_dotenv_are_read(tmp_path):
+    dotenv = tmp_path / ".env"
+    dotenv.write_text(f"API_KEY=from-dotenv\nDATABASE_URL=sqlite:///{tmp_path / 'env.db'}\n")
+    env = {k: v for k, v in os.environ.items() if k not in ("API_KEY", "DATABASE_URL")}
+    env["PYTHONPATH"] = str(SRC)
+
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE, str(dotenv)], env=env, cwd=tmp_path, capture_output=True, text=True, check=True,
+    ).stdout
+    assert json.loads(out.strip().splitlines()[-1]) == {"key": "from-dotenv", "db": True}
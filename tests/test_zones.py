@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from runlytics.database.models import Run, Biometric, RunZone
+from runlytics.database.manager import session_scope
+from runlytics.processing.zones import time_in_zones, merge_windows, max_hr_model, update_run_zones
+
+MINUTE = 60 * 10**9
+
+
+def test_overlapping_runs_each_get_their_samples():
+    # The same run recorded twice (second copy starts 5 minutes later) and a later run
+    starts = np.array([0, 5, 100]) * MINUTE
+    ends = np.array([30, 35, 130]) * MINUTE
+    times = np.arange(0, 130) * MINUTE
+    hr = np.full(len(times), 150.0)
+
+    seconds, samples = time_in_zones(starts, ends, times, hr, max_hr_model(190))
+    assert samples.sum(axis=1).tolist() == [30, 30, 30]
+    assert seconds.sum(axis=1).tolist() == [1800, 1800, 1800]
+
+
+def test_merge_windows_joins_close_runs_only():
+    starts = np.array([0, 20, 200, 90]) * MINUTE
+    ends = np.array([30, 40, 230, 100]) * MINUTE
+    span_starts, span_ends = merge_windows(starts, ends, gap_s=3600)
+    assert (span_starts // MINUTE).tolist() == [0, 200]
+    assert (span_ends // MINUTE).tolist() == [100, 230]
+
+
+def test_update_run_zones_reads_duplicate_runs(database):
+    start = datetime(2024, 3, 1, 7, 0)
+    with session_scope() as session:
+        session.add_all([
+            Run(id=1, date=start, duration_min=30, source="Strava"),
+            Run(id=2, date=start + timedelta(seconds=20), duration_min=30, source="Apple Health"),
+            # Years later: must not make the HR query span the gap
+            Run(id=3, date=start + timedelta(days=900), duration_min=30, source="Strava"),
+        ])
+        session.add_all([
+            Biometric(date=start + timedelta(minutes=m), type="heart_rate", value=150, unit="bpm", source="watch")
+            for m in range(31)
+        ])
+    with session_scope() as session:
+        stats = update_run_zones(session, model="max_hr")
+    assert stats == {"runs": 3, "with_hr": 2, "seconds": stats["seconds"]}
+
+    with session_scope() as session:
+        counts = dict(session.query(RunZone.run_id, RunZone.samples).filter(RunZone.samples > 0).all())
+    assert counts == {1: 30, 2: 30}